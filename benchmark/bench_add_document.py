@@ -0,0 +1,77 @@
+# bench_add_document.py Measure the cost of adding long messages to an inverted file
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m benchmark.bench_add_document [nb_messages] [message_len]
+
+import random
+import sys
+import time
+
+from src_inverted_file.ie_message import IEMessage
+from src_inverted_file.inverted_file import InvertedFile
+from src_inverted_file.score import score
+
+
+def legacy_score(token, document):
+    """
+    The score function with the former prototype, which makes InvertedFile count each token in document.text
+    """
+    return score(token, document)
+
+
+def generate_messages(nb_messages, message_len, seed=0):
+    """
+    Generate deterministic long messages, looking like link dumps : many distinct tokens, a few repeated ones
+    :param nb_messages: integer, the number of messages
+    :param message_len: integer, the number of tokens of each message
+    :param seed: integer, seed of the random generator
+    :return: list of IEMessage
+    """
+    rand = random.Random(seed)
+    vocabulary = ["word{}".format(i) for i in range(5000)] + ["https://example.org/paper/{}".format(i) for i in range(5000)]
+    messages = []
+    for _ in range(nb_messages):
+        message = IEMessage()
+        message.text = [rand.choice(vocabulary) for _ in range(message_len)]
+        messages.append(message)
+    return messages
+
+
+def bench(score_function, messages):
+    """
+    :return: float, the time (in seconds) to add all the messages to an empty InvertedFile
+    """
+    inverted_file = InvertedFile(score_function)
+    start_time = time.perf_counter()
+    for message in messages:
+        inverted_file.add_document(message)
+    return time.perf_counter() - start_time
+
+
+def main(nb_messages=100, message_len=2000):
+    messages = generate_messages(nb_messages, message_len)
+    print("{} messages of {} tokens".format(nb_messages, message_len))
+    legacy_time = bench(legacy_score, messages)
+    print("score(token, document)                   : {:.3f}s".format(legacy_time))
+    fast_time = bench(score, messages)
+    print("score(token, document, term_frequencies) : {:.3f}s".format(fast_time))
+    print("speedup : x{:.1f}".format(legacy_time / fast_time))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,81 @@
+# bench_disk_interfacer.py Compare the speed of the disk interfacers used to store an inverted file
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m benchmark.bench_disk_interfacer [nb_postings] [repeat]
+
+import random
+import sys
+import timeit
+import uuid
+
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer
+from src_inverted_file.smart_disk_interfacer import DocIdMap, SmartDiskInterfacer
+from src_inverted_file.struct_disk_interfacer import StructDiskInterfacer
+
+
+def generate_posting_list(nb_postings, seed=0):
+    """
+    Generate a deterministic posting list
+    :param nb_postings: integer, the number of (doc_id, score) elements
+    :param seed: integer, seed of the random generator
+    :return: list of tuples (uuid.UUID, integer)
+    """
+    rand = random.Random(seed)
+    return sorted((uuid.UUID(int=rand.getrandbits(128)), rand.randint(1, 20)) for _ in range(nb_postings))
+
+
+def bench(interfacer, posting_list, repeat):
+    """
+    Time the encoding and decoding of a posting list with a given interfacer
+    :return: a tuple (encode_time, decode_time, size), the best times out of <repeat> runs, in seconds,
+             and the size of the encoded posting list in bytes
+    """
+    encoded = interfacer.encode_posting_list("key", posting_list)
+    # skip <key_len><key><list_len> to only give the postings to decode_list
+    bin_list = bytes(encoded[interfacer.key_len_len + len("key") + interfacer.list_len_len:])
+    encode_time = min(timeit.repeat(lambda: interfacer.encode_posting_list("key", posting_list),
+                                    number=1, repeat=repeat))
+    decode_time = min(timeit.repeat(lambda: interfacer.decode_list(bin_list), number=1, repeat=repeat))
+    return encode_time, decode_time, len(encoded)
+
+
+def main(nb_postings=100000, repeat=5):
+    posting_list = generate_posting_list(nb_postings)
+
+    # both interfacers must write the same bytes for the files to stay readable
+    assert NaiveDiskInterfacer.encode_posting_list("key", posting_list) == \
+        StructDiskInterfacer.encode_posting_list("key", posting_list)
+
+    print("{} postings, best of {}".format(nb_postings, repeat))
+    results = {}
+    smart = SmartDiskInterfacer(DocIdMap(doc_id for (doc_id, _) in posting_list))
+    for (name, interfacer) in (("NaiveDiskInterfacer", NaiveDiskInterfacer),
+                               ("StructDiskInterfacer", StructDiskInterfacer),
+                               ("SmartDiskInterfacer", smart)):
+        results[name] = bench(interfacer, posting_list, repeat)
+        print("{:<22} encode : {:.4f}s  decode : {:.4f}s  size : {} bytes".format(name, *results[name]))
+
+    naive = results["NaiveDiskInterfacer"]
+    for name in ("StructDiskInterfacer", "SmartDiskInterfacer"):
+        fast = results[name]
+        print("{:<22} encode : x{:.1f}    decode : x{:.1f}    size : x{:.1f}".format(
+            "speedup " + name[:-len("DiskInterfacer")], naive[0] / fast[0], naive[1] / fast[1], naive[2] / fast[2]))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
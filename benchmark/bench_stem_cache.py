@@ -0,0 +1,75 @@
+# bench_stem_cache.py Measure the effect of the stem cache of the Tokenizer
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m benchmark.bench_stem_cache [nb_messages] [cache_size]
+
+import itertools
+import random
+import sys
+import time
+
+from src_inverted_file.tokenizer import Tokenizer
+
+SYLLABLES = ["re", "in", "ter", "al", "ing", "tion", "pa", "per", "link", "net", "work", "deep", "learn", "ed",
+             "s", "con", "vo", "lu", "mo", "del", "er", "ly", "ness", "graph", "da", "ta", "set", "ment"]
+
+
+def generate_corpus(nb_messages, vocabulary_size=20000, seed=0):
+    """
+    Generate deterministic chat messages whose words follow a Zipf law, like a real channel vocabulary
+    :param nb_messages: integer, the number of messages
+    :param vocabulary_size: integer, the number of distinct words
+    :param seed: integer, seed of the random generator
+    :return: list of string, the messages
+    """
+    rand = random.Random(seed)
+    vocabulary = ["".join(rand.choice(SYLLABLES) for _ in range(rand.randint(1, 4))) for _ in range(vocabulary_size)]
+    cumulative_weights = list(itertools.accumulate(1. / rank for rank in range(1, vocabulary_size + 1)))
+    return [" ".join(rand.choices(vocabulary, cum_weights=cumulative_weights, k=rand.randint(3, 40))) + "."
+            for _ in range(nb_messages)]
+
+
+def bench(tokenizer, corpus):
+    """
+    :return: float, the time (in seconds) to tokenize the whole corpus
+    """
+    start_time = time.perf_counter()
+    for message in corpus:
+        tokenizer.word_tokenize(message)
+    return time.perf_counter() - start_time
+
+
+def main(nb_messages=20000, cache_size=65536):
+    corpus = generate_corpus(nb_messages)
+    print("{} messages, {} tokens".format(nb_messages, sum(len(message.split()) for message in corpus)))
+
+    no_cache_time = bench(Tokenizer(stem_cache_size=0), corpus)
+    print("without stem cache : {:.3f}s".format(no_cache_time))
+
+    tokenizer = Tokenizer(stem_cache_size=cache_size)
+    cache_time = bench(tokenizer, corpus)
+    print("with stem cache    : {:.3f}s  (hit rate : {:.1%}, {} stems kept)".format(
+        cache_time, tokenizer.stem_cache.hit_rate(), len(tokenizer.stem_cache)))
+
+    no_stem_time = bench(Tokenizer(stemming=False), corpus)
+    print("without stemming   : {:.3f}s".format(no_stem_time))
+    print("stemming cost cut by {:.1%}".format(1 - (cache_time - no_stem_time) / (no_cache_time - no_stem_time)))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
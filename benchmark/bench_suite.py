@@ -0,0 +1,270 @@
+# bench_suite.py Time the indexing pipeline on synthetic channel histories, with machine-readable results
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) :
+#     python -m benchmark.bench_suite [--sizes 1000 100000 1000000] [--seed 0] [--backend nltk|regex]
+#                                     [--output results.json] [--compare previous_results.json]
+# The results are written as json (on the standard output by default), --compare prints the ratio of each time to
+# the one of a previous run, to spot regressions between versions.
+
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark.bench_stem_cache import SYLLABLES
+from benchmark.bench_tokenizer import add_links
+from src_inverted_file.async_indexing import PortableMessage
+from src_inverted_file.ie_message import IEMessage
+from src_inverted_file.inverted_file import DOCUMENT_LENGTH_KEY, InvertedFile
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer as ndi
+from src_inverted_file.score import score
+from src_inverted_file.term_dictionary import TermDictionary
+from src_inverted_file.tokenizer import Tokenizer, regex_word_tokenize
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+# share of short chat messages, of regular messages, and of long link dumps, with their number of words
+MESSAGE_SHAPES = ((0.6, 2, 12), (0.35, 12, 60), (0.05, 150, 600))
+# number of posting lists read by each read_posting_lists step
+NB_READ_KEYS = 100
+
+
+def generate_channel_history(nb_messages, vocabulary_size=50000, nb_authors=200, seed=0):
+    """
+    Generate a deterministic channel history, as stand-ins for discord.Message : words follow a Zipf law, most
+    messages are short chat, some are long link dumps, and some hold urls (in their text and as embeds), mentions and
+    inline code (see bench_tokenizer.add_links)
+    :param nb_messages: integer, the number of messages
+    :param vocabulary_size: integer, the number of distinct words
+    :param nb_authors: integer, the number of distinct authors
+    :param seed: integer, seed of the random generator
+    :return: list of PortableMessage, from the oldest to the newest
+    """
+    rand = random.Random(seed)
+    vocabulary = ["".join(rand.choice(SYLLABLES) for _ in range(rand.randint(1, 4))) for _ in range(vocabulary_size)]
+    cumulative_weights = list(itertools.accumulate(1. / rank for rank in range(1, vocabulary_size + 1)))
+    shape_weights = list(itertools.accumulate(share for (share, _, _) in MESSAGE_SHAPES))
+    authors = [str(rand.randint(10 ** 17, 10 ** 18)) for _ in range(nb_authors)]
+
+    texts = []
+    for _ in range(nb_messages):
+        (_, min_words, max_words) = rand.choices(MESSAGE_SHAPES, cum_weights=shape_weights)[0]
+        texts.append(" ".join(rand.choices(vocabulary, cum_weights=cumulative_weights,
+                                           k=rand.randint(min_words, max_words))) + ".")
+    texts = add_links(texts, seed)
+
+    timestamp = datetime.datetime(2017, 9, 1)
+    messages = []
+    for text in texts:
+        timestamp += datetime.timedelta(seconds=rand.randint(1, 600))
+        embeds = [{'url': word} for word in text.split() if word.startswith('https://')]
+        messages.append(PortableMessage(text, rand.choice(authors), timestamp, embeds))
+    return messages
+
+
+def timed(function, *args):
+    """
+    :param function: the function to time
+    :return: tuple (seconds, result), the time taken by function(*args) and what it returned
+    """
+    gc.collect()
+    start_time = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start_time, result
+
+
+def step_result(seconds, nb_items, **details):
+    """
+    :param seconds: float, the time taken by a step
+    :param nb_items: integer, the number of items (messages, keys, bytes...) processed by the step
+    :param details: other values to report
+    :return: dictionary, the result of a step as written in the json
+    """
+    result = {'seconds': seconds, 'items': nb_items, 'items_per_second': nb_items / seconds if seconds else None}
+    result.update(details)
+    return result
+
+
+def tokenize(tokenizer, messages):
+    return [tokenizer.word_tokenize(message.content) for message in messages]
+
+
+def to_ie_messages(messages, tokenized):
+    """
+    Build the IEMessage of the messages as FormattedDocument does, from their already tokenized text
+    :param messages: list of PortableMessage
+    :param tokenized: list of lists of tokens, the tokens of each message
+    :return: list of IEMessage
+    """
+    output = []
+    for (message, tokens) in zip(messages, tokenized):
+        element = IEMessage()
+        element.text = tokens
+        element.author = message.author
+        element.date = message.timestamp
+        for embed in message.embeds:
+            element.add_link(embed['url'])
+        output.append(element)
+    return output
+
+
+def add_documents(inverted_file, documents):
+    for document in documents:
+        inverted_file.add_document(document)
+
+
+def read_posting_lists(keys, filename):
+    InvertedFile(score).read_posting_lists(keys, filename)
+
+
+def bench_size(nb_messages, tokenizer, directory, seed=0):
+    """
+    Run every step of the pipeline on a history of nb_messages messages. The history is split in two halves, indexed
+    and saved separately, so that they can then be merged as segments are.
+    :param nb_messages: integer, the number of messages
+    :param tokenizer: Tokenizer, the tokenizer of the messages
+    :param directory: string, where the inverted files are written
+    :param seed: integer, seed of the generator of the history
+    :return: dictionary (step: dictionary), the result of each step (see step_result)
+    """
+    results = {}
+    (seconds, messages) = timed(generate_channel_history, nb_messages, 50000, 200, seed)
+    results['generate'] = step_result(seconds, nb_messages)
+
+    (seconds, tokenized) = timed(tokenize, tokenizer, messages)
+    nb_tokens = sum(len(tokens) for tokens in tokenized)
+    results['word_tokenize'] = step_result(seconds, nb_messages, tokens=nb_tokens,
+                                           characters=sum(len(message.content) for message in messages))
+    documents = to_ie_messages(messages, tokenized)
+    del messages, tokenized
+
+    middle = len(documents) // 2
+    halves = [documents[:middle], documents[middle:]]
+    del documents
+    filenames = [os.path.join(directory, 'half_{}.if'.format(index)) for index in range(len(halves))]
+    add_time = 0.
+    save_time = 0.
+    for (half, filename) in zip(halves, filenames):
+        inverted_file = InvertedFile(score)
+        add_time += timed(add_documents, inverted_file, half)[0]
+        save_time += timed(inverted_file.save, filename)[0]
+        del inverted_file
+    del halves
+    nb_bytes = sum(os.path.getsize(filename) for filename in filenames)
+    results['add_document'] = step_result(add_time, nb_messages, tokens=nb_tokens)
+    results['save'] = step_result(save_time, nb_bytes)
+
+    merged_filename = os.path.join(directory, 'merged.if')
+    (seconds, _) = timed(InvertedFile.merge_inverted_files, merged_filename, filenames[0], filenames[1], ndi)
+    results['merge_inverted_files'] = step_result(seconds, nb_bytes, output_bytes=os.path.getsize(merged_filename))
+
+    (seconds, keys) = timed(InvertedFile.read_only_keys, merged_filename)
+    results['read_only_keys'] = step_result(seconds, len(keys))
+
+    # the most frequent words (long posting lists) and a random sample of the others
+    keys = [key for (key, _) in keys if key != DOCUMENT_LENGTH_KEY]
+    dictionary = TermDictionary.open(merged_filename)
+    frequent_keys = sorted(keys, key=dictionary.doc_freq, reverse=True)[:NB_READ_KEYS // 10]
+    rand = random.Random(seed)
+    read_keys = sorted(set(frequent_keys) | set(rand.sample(keys, min(len(keys), NB_READ_KEYS - len(frequent_keys)))))
+    (seconds, _) = timed(read_posting_lists, read_keys, merged_filename)
+    results['read_posting_lists'] = step_result(seconds, len(read_keys))
+
+    for filename in filenames + [merged_filename]:
+        InvertedFile.remove_inverted_file(filename)
+    return results
+
+
+def git_version():
+    """
+    :return: string, the commit of the repository being benchmarked, None if it is unknown
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """
+    Print the ratio of each time to the one of a previous run (above 1 is slower)
+    :param results: dictionary, the json of this run
+    :param previous: dictionary, the json of a previous run
+    :return: None
+    """
+    print("{:>9} {:<22} {:>10} {:>10} {:>7}".format("messages", "step", "before", "now", "ratio"), file=sys.stderr)
+    for (size, steps) in results['results'].items():
+        previous_steps = previous['results'].get(size, {})
+        for (step, result) in steps.items():
+            if step in previous_steps:
+                before = previous_steps[step]['seconds']
+                print("{:>9} {:<22} {:>9.3f}s {:>9.3f}s {:>7}".format(
+                    size, step, before, result['seconds'],
+                    "x{:.2f}".format(result['seconds'] / before) if before else "-"), file=sys.stderr)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Time the indexing pipeline on synthetic channel histories")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="numbers of messages of the histories")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the histories")
+    parser.add_argument('--backend', choices=('nltk', 'regex'), default='nltk', help="tokenizer backend")
+    parser.add_argument('--output', help="json file to write the results to, instead of the standard output")
+    parser.add_argument('--compare', help="json file of a previous run to compare the results with")
+    arguments = parser.parse_args(arguments)
+
+    results = {
+        'version': git_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.utcnow().isoformat(),
+        'seed': arguments.seed,
+        'backend': arguments.backend,
+        'results': {},
+    }
+    backend = regex_word_tokenize if arguments.backend == 'regex' else None
+    for size in arguments.sizes:
+        # a new tokenizer for each size, so that its stem cache is not warmed by the previous one
+        tokenizer = Tokenizer(backend=backend)
+        with tempfile.TemporaryDirectory(prefix='bench_suite_') as directory:
+            results['results'][str(size)] = bench_size(size, tokenizer, directory, arguments.seed)
+        print("{} messages done".format(size), file=sys.stderr)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if arguments.compare is not None:
+        with open(arguments.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
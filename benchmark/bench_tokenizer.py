@@ -0,0 +1,75 @@
+# bench_tokenizer.py Compare the throughput of the tokenizer backends
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m benchmark.bench_tokenizer [nb_messages]
+
+import random
+import sys
+import time
+
+from benchmark.bench_stem_cache import generate_corpus
+from src_inverted_file.tokenizer import Tokenizer, regex_word_tokenize
+
+
+def add_links(corpus, seed=0):
+    """
+    Add urls, mentions and inline code to some messages of a corpus, as in the bibliographic channel
+    :param corpus: list of string, the messages
+    :return: list of string, the new messages
+    """
+    rand = random.Random(seed)
+    output = []
+    for message in corpus:
+        if rand.random() < 0.3:
+            message += " https://arxiv.org/abs/{}.{:05d}v{}".format(rand.randint(1000, 1999), rand.randint(0, 99999),
+                                                                   rand.randint(1, 5))
+        if rand.random() < 0.1:
+            message = "<@{}> {}".format(rand.randint(10 ** 17, 10 ** 18), message)
+        if rand.random() < 0.05:
+            message += " `model.fit(x, y)`"
+        output.append(message)
+    return output
+
+
+def bench(tokenizer, corpus):
+    """
+    :return: a tuple (time, nb_tokens), the time (in seconds) to tokenize the whole corpus and the tokens produced
+    """
+    start_time = time.perf_counter()
+    nb_tokens = 0
+    for message in corpus:
+        nb_tokens += len(tokenizer.word_tokenize(message))
+    return time.perf_counter() - start_time, nb_tokens
+
+
+def main(nb_messages=20000):
+    corpus = add_links(generate_corpus(nb_messages))
+    nb_chars = sum(len(message) for message in corpus)
+    print("{} messages, {} characters".format(nb_messages, nb_chars))
+
+    for stemming in (False, True):
+        results = {}
+        for (name, backend) in (("nltk", None), ("regex", regex_word_tokenize)):
+            results[name] = bench(Tokenizer(stemming=stemming, backend=backend), corpus)
+            print("{:<6} stemming={:<5} : {:.3f}s  {:.2f} MB/s  {} tokens".format(
+                name, str(stemming), results[name][0], nb_chars / results[name][0] / 1e6, results[name][1]))
+        print("speedup (stemming={}) : x{:.1f}".format(stemming, results["nltk"][0] / results["regex"][0]))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
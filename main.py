@@ -19,16 +19,67 @@
 import discord
 from discord.ext import commands
 
+import asyncio
+import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 from config import *
+from src_inverted_file.async_indexing import InlineExecutor, PortableMessage, generate_inverted_file_streaming, \
+    index_messages_to_file
+from src_inverted_file.boolean_query import is_boolean_query
 from src_inverted_file.inverted_file import *
+from src_inverted_file.metrics import measured_call, merge_measured, metrics, profiled
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer as ndi
+from src_inverted_file.posting_list_cache import PostingListCache
+from src_inverted_file.query_engine import QueryEngine
+from src_inverted_file.segment_manager import SegmentManager
+from src_inverted_file.tokenizer import Tokenizer
+
+INDEX_DIRECTORY = "inverted_file"
+INDEX_STATE_FILENAME = os.path.join(INDEX_DIRECTORY, "index_state.json")
+STEM_CACHE_FILENAME = os.path.join(INDEX_DIRECTORY, "stem_cache.json")
+# text report of the timers and counters of the indexing, written after each update or rebuild
+METRICS_FILENAME = os.path.join(INDEX_DIRECTORY, "metrics.txt")
+# index the positions of the words, for "exact phrase" searches
+POSITIONAL_INDEX = True
+# memory budget of the decoded posting lists kept between searches, in bytes
+POSTING_LIST_CACHE_SIZE = 64 << 20
+
+# history ingestion : the fetched messages are indexed by batches of INGESTION_BATCH_SIZE while the fetching goes on
+INGESTION_BATCH_SIZE = 10000
+
+# live indexing : a segment is written once LIVE_BATCH_SIZE messages are waiting,
+# or LIVE_FLUSH_DELAY seconds after the first waiting message
+LIVE_BATCH_SIZE = 50
+LIVE_FLUSH_DELAY = 60
+
+# compaction : MERGE_FACTOR consecutive segments of a same size tier are merged in the background
+MERGE_FACTOR = 4
+MAX_SEGMENTS = 12
 
 description = '''An example bot to showcase the discord.ext.commands extension
 module.
 There are a number of utility commands being showcased here.'''
 bot = commands.Bot(command_prefix='?', description=description)
 
+# serializes the writers of the index (updates, rebuilds and live indexing)
+index_lock = asyncio.Lock()
+live_queue = asyncio.Queue()
+live_tokenizer = Tokenizer(stem_cache_file=STEM_CACHE_FILENAME)
+# the single writer of the manifest (INDEX_STATE_FILENAME) listing the segments of the index
+segment_manager = SegmentManager(INDEX_DIRECTORY, INDEX_STATE_FILENAME, merge_factor=MERGE_FACTOR,
+                                 max_segments=MAX_SEGMENTS)
+# set each time a segment is added, to wake the compactor up
+compaction_needed = asyncio.Event()
+# query engine over a pinned snapshot of the segments, reopened when the segments change
+search_engine = None
+search_snapshot = None
+posting_list_cache = PostingListCache(POSTING_LIST_CACHE_SIZE)
+# tokenization and indexing of the history are CPU bound, they run in worker processes
+indexing_executor = ProcessPoolExecutor()
+
 @bot.event
 async def on_ready():
     print('Logged in as')
@@ -37,6 +88,16 @@ async def on_ready():
     print('------')
 
 
+@bot.event
+async def on_message(message):
+    # the commands are dispatched first, so that nothing in the indexing can drop them
+    await bot.process_commands(message)
+    if message.author != bot.user and message.channel.name is not None and "biblio" in message.channel.name:
+        # only the embeds with a url are kept, the others have no link to index. The message is tokenized when its
+        # batch is indexed, in a worker process
+        live_queue.put_nowait((message, PortableMessage.from_discord(message)))
+
+
 @bot.command()
 async def add(left: int, right: int):
     """Adds two numbers together."""
@@ -76,27 +137,287 @@ async def joined(member : discord.Member):
 
 @bot.command()
 async def update():
-    await initialize()
+    """Indexes the messages posted since the last update."""
+    await update_index()
+
+
+@bot.command()
+async def rebuild(mode: str = None):
+    """Rebuilds the whole index from the channel history. "?rebuild profile" also profiles it (much slower)."""
+    await initialize(profile=mode == "profile")
+
+
+@bot.command()
+async def stats():
+    """Shows where the indexing time goes, and the cache hit rates."""
+    update_gauges()
+    report = metrics.format()
+    metrics.dump(METRICS_FILENAME)
+    # a discord message is limited to 2000 characters
+    await bot.say("```\n{}\n```".format(report[:1900]))
+
+
+@bot.command()
+async def search(*query: str):
+    """Searches the indexed messages. Supports AND, OR, NOT, parentheses and "exact phrases"."""
+    engine = get_search_engine()
+    if engine is None:
+        await bot.say("Nothing is indexed yet, run ?update first")
+        return
+
+    text = " ".join(query)
+    try:
+        if is_boolean_query(text):
+            results = engine.boolean_search(text, top_k=5)
+        else:
+            results = engine.search(text, top_k=5)
+    except ValueError as error:
+        await bot.say("Invalid query : {}".format(error))
+        return
+    timings = engine.last_timings
+    lines = [format_result(engine, doc_id, score) for (doc_id, score) in results]
+    lines.append("{} results in {:.1f} ms (tokenize {:.1f} ms, load {:.1f} ms, rank {:.1f} ms, {} documents scored)"
+                 .format(len(results), timings['total'] * 1000, timings['tokenize'] * 1000, timings['load'] * 1000,
+                         timings['rank'] * 1000, engine.last_nb_scored))
+    lines.append("posting list cache : {:.1%} hits, {:.1f} MB held".format(posting_list_cache.hit_rate(),
+                                                                          posting_list_cache.nb_bytes / 1e6))
+    print("\n".join(lines[-2:]))
+    await bot.say("\n".join(lines))
+
+
+def format_result(engine, doc_id, score):
+    """
+    :param engine: QueryEngine, the engine which found the message
+    :param doc_id: uuid.UUID, the id of the message
+    :param score: float, its score
+    :return: string, a line describing the message from its document store (author, date and links)
+    """
+    document = engine.document(doc_id)
+    if document is None:
+        return "{:.3f} : {}".format(score, doc_id)
+    line = "{:.3f} : {}".format(score, author_name(document.author) if document.author else doc_id)
+    if document.date is not None:
+        line += " on {:%Y-%m-%d %H:%M}".format(document.date)
+    if document.links:
+        line += " " + " ".join(document.links)
+    return line
+
+
+def author_name(author_id):
+    """
+    :param author_id: integer, the id of the author of a message (see DocumentStore)
+    :return: string, the name of the author, written so that the user is not mentioned (nor anyone, by a name such as
+             @everyone)
+    """
+    member = discord.utils.get(bot.get_all_members(), id=str(author_id))
+    name = member.display_name if member is not None else "user {}".format(author_id)
+    # a zero width space after @ keeps discord from turning the name into a mention
+    return name.replace("@", "@\u200b")
+
+
+def get_search_engine():
+    """
+    :return: QueryEngine over a snapshot of the segments of the index, None if nothing is indexed.
+             The files of the snapshot are kept until the engine is replaced, even if a merge removes them meanwhile.
+    """
+    global search_engine, search_snapshot
+    segments = segment_manager.segments
+    if not segments:
+        return None
+    if search_engine is None or list(search_snapshot.segments) != segments:
+        snapshot = segment_manager.snapshot()
+        if search_engine is not None:
+            for filename in search_snapshot.segments:
+                if filename not in snapshot.segments:
+                    posting_list_cache.invalidate(filename)
+                    posting_list_cache.invalidate(InvertedFile.positions_filename(filename))
+            search_engine.close()
+            segment_manager.release(search_snapshot)
+        search_engine = QueryEngine(snapshot.segments, live_tokenizer, cache=posting_list_cache)
+        search_snapshot = snapshot
+    return search_engine
+
+
+def update_gauges():
+    """
+    Copy the state of the caches of the bot into the gauges of the metrics
+    """
+    metrics.set('posting_list_cache.hit_rate', posting_list_cache.hit_rate())
+    metrics.set('posting_list_cache.megabytes', posting_list_cache.nb_bytes / 1e6)
+    metrics.set('live_stem_cache.hit_rate', live_tokenizer.stem_cache.hit_rate())
+    metrics.set('segments', len(segment_manager.segments))
+
+
+def save_metrics():
+    update_gauges()
+    metrics.dump(METRICS_FILENAME)
+
 
+async def initialize(profile=False):
+    async with index_lock:
+        if not profile:
+            await rebuild_index()
+            return
+        # the indexing runs in the bot process, where it can be profiled, instead of the worker processes
+        prefix = os.path.join(INDEX_DIRECTORY, "profile_{}".format(time.strftime("%Y%m%d_%H%M%S")))
+        with profiled(prefix):
+            await rebuild_index(executor=InlineExecutor())
+        await say_and_print("Profile written to {0}.txt and {0}.prof".format(prefix))
 
-async def initialize():
+
+async def rebuild_index(executor=indexing_executor):
     await say_and_print("Initializing...")
 
+    biblio_channel = await find_biblio_channel()
+    history = ChannelHistory(biblio_channel)
+
+    with metrics.timer('rebuild'):
+        file_path, nb_messages = await generate_inverted_file_streaming(
+            history, segment_manager.new_segment_filename(), executor, batch_size=INGESTION_BATCH_SIZE,
+            progress=report_progress, stem_cache_file=STEM_CACHE_FILENAME, positional=POSITIONAL_INDEX)
+    print("Generated inverted file here : {}".format(file_path))
+    # the former segments are removed once the searches stop using them
+    segment_manager.commit(file_path, history.last_message, reset=True)
+    save_metrics()
+    await say_and_print("Initialization done, {} messages indexed".format(nb_messages))
+
+
+async def update_index():
+    async with index_lock:
+        await update_index_locked()
+
+
+async def update_index_locked():
+    last_message_id = segment_manager.manifest.last_message_id
+    if last_message_id is None:
+        await rebuild_index()
+        return
+
+    biblio_channel = await find_biblio_channel()
+    # the messages indexed live since the last update are fetched again, but not indexed twice
+    history = ChannelHistory(biblio_channel, after=discord.Object(id=last_message_id),
+                             skip_ids=set(segment_manager.manifest.live_message_ids))
+    with metrics.timer('update'):
+        file_path, nb_messages = await generate_inverted_file_streaming(
+            history, segment_manager.new_segment_filename(), indexing_executor, batch_size=INGESTION_BATCH_SIZE,
+            progress=report_progress, stem_cache_file=STEM_CACHE_FILENAME, positional=POSITIONAL_INDEX)
+    segment_manager.commit(file_path, history.last_message)
+    compaction_needed.set()
+    save_metrics()
+    if file_path is None:
+        await say_and_print("Index already up to date")
+        return
+    print("Generated inverted file here : {}".format(file_path))
+    await say_and_print("Indexed {} new messages".format(nb_messages))
+
+
+async def find_biblio_channel():
     print("Looking for bibliographic channel...")
     for channel in bot.get_all_channels():
         if "biblio" in channel.name:
-            biblio_channel = channel
-            await say_and_print("Hooking on channel : " + biblio_channel.name)
-            break
-
-    messages = []
-    async for logged_message in bot.logs_from(biblio_channel, limit=1000000):
-        if logged_message.author == bot.user:
-            continue
-        messages.append(logged_message)
-    file_path = generate_inverted_file(messages)
-    print("Generated inverted file here : {}".format(file_path))
-    await say_and_print("Initialization done")
+            await say_and_print("Hooking on channel : " + channel.name)
+            return channel
+
+
+class ChannelHistory(object):
+    """
+    Asynchronous iterable over the messages of a channel, except the ones of the bot, fetched as they are iterated
+    Initialize :
+        - channel : discord.Channel, the channel to read
+        - after : discord.Message or discord.Object, only fetch the messages posted after this one. Default is all
+        - skip_ids : set of string, the ids of messages fetched but not iterated (already indexed). Default is none
+
+    Attributes :
+        - last_message : discord.Message, the newest message seen so far (even one of the bot), None if there was none
+    """
+
+    def __init__(self, channel, after=None, skip_ids=None):
+        self.channel = channel
+        self.after = after
+        self.skip_ids = skip_ids or set()
+        self.last_message = None
+
+    def __aiter__(self):
+        return self.__messages()
+
+    async def __messages(self):
+        # the time spent waiting for discord, not the one spent by the consumer between two messages
+        start_time = time.perf_counter()
+        async for logged_message in bot.logs_from(self.channel, limit=1000000, after=self.after):
+            metrics.add_time('fetch', time.perf_counter() - start_time)
+            metrics.count('messages_fetched')
+            if self.last_message is None or int(logged_message.id) > int(self.last_message.id):
+                self.last_message = logged_message
+            if logged_message.author != bot.user and logged_message.id not in self.skip_ids:
+                yield logged_message
+            start_time = time.perf_counter()
+
+
+async def live_indexer():
+    """
+    Background task, gather the messages queued by on_message and index them by batches
+    """
+    await bot.wait_until_ready()
+    batch = []
+    deadline = None
+    while not bot.is_closed:
+        timeout = None if deadline is None else max(0, deadline - bot.loop.time())
+        try:
+            batch.append(await asyncio.wait_for(live_queue.get(), timeout))
+            if deadline is None:
+                deadline = bot.loop.time() + LIVE_FLUSH_DELAY
+        except asyncio.TimeoutError:
+            pass
+
+        if len(batch) >= LIVE_BATCH_SIZE or (batch and bot.loop.time() >= deadline):
+            async with index_lock:
+                await flush_live_batch(batch)
+            batch = []
+            deadline = None
+
+
+async def flush_live_batch(batch):
+    """
+    Write a segment with the messages of a batch which are not indexed yet, and register it.
+    The segment is tokenized and saved in indexing_executor, as the history is, so that the event loop goes on
+    meanwhile (the caller holds index_lock).
+    The high-water mark of the history is not moved : the messages posted before these ones may not be fetched yet,
+    they are fetched by the next ?update, which skips the messages indexed here.
+    :param batch: list of tuples (discord.Message, PortableMessage)
+    """
+    if segment_manager.manifest.last_message_id is None:
+        # nothing indexed yet, the first ?update will fetch these messages with the rest of the history
+        return
+    new_messages = [(message, portable_message) for (message, portable_message) in batch
+                    if not segment_manager.manifest.is_indexed(message.id)]
+    if not new_messages:
+        return
+
+    with metrics.timer('live_flush'):
+        file_path = merge_measured(await bot.loop.run_in_executor(
+            indexing_executor, measured_call, index_messages_to_file,
+            [portable_message for (_, portable_message) in new_messages], segment_manager.new_segment_filename(), ndi,
+            STEM_CACHE_FILENAME, POSITIONAL_INDEX))
+    segment_manager.commit(file_path, live_messages=[message for (message, _) in new_messages])
+    compaction_needed.set()
+    print("Live indexed {} messages in {}".format(len(new_messages), file_path))
+
+
+async def compactor():
+    """
+    Background task, merge the segments of the index each time some are added, so that their number stays bounded
+    """
+    await bot.wait_until_ready()
+    while not bot.is_closed:
+        await compaction_needed.wait()
+        compaction_needed.clear()
+        nb_merges = await segment_manager.compact(indexing_executor, index_lock)
+        if nb_merges:
+            print("Compaction : {} merges, {} segments left".format(nb_merges, len(segment_manager.segments)))
+
+
+async def report_progress(nb_indexed, nb_fetched):
+    await say_and_print("Indexed {}/{} fetched messages".format(nb_indexed, nb_fetched))
 
 
 async def say_and_print(message):
@@ -110,4 +431,7 @@ async def say_and_print(message):
 
 
 if __name__ == "__main__":
+    segment_manager.remove_unreferenced()
+    bot.loop.create_task(live_indexer())
+    bot.loop.create_task(compactor())
     bot.run(token)
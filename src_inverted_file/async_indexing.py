@@ -0,0 +1,310 @@
+# async_indexing.py Build inverted files in worker processes without blocking the bot
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import shutil
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import Executor, Future
+
+from src_inverted_file.inverted_file import InvertedFile
+from src_inverted_file.metrics import measured_call, merge_measured
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer as ndi
+
+
+class PortableMessage(namedtuple('PortableMessage', ['content', 'author', 'timestamp', 'embeds'])):
+    """
+    The part of a discord.Message needed to index it, which can be sent to another process
+    (a discord.Message holds references to the whole client state and can not be pickled).
+    It can be given to FormattedDocument in place of a discord.Message.
+    Attributes :
+        - content : string, the text of the message
+        - author : string, the id of the author of the message
+        - timestamp : datetime, when the message was written
+        - embeds : list of dictionaries, the embeds of the message (only their 'url' is kept)
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_discord(cls, message):
+        """
+        :param message: discord.Message
+        :return: PortableMessage
+        """
+        return cls(message.content, message.author.id, message.timestamp,
+                   [{'url': embed['url']} for embed in message.embeds if 'url' in embed])
+
+
+def to_portable_messages(messages):
+    """
+    :param messages: list of discord.Message or PortableMessage
+    :return: list of PortableMessage
+    """
+    return [message if isinstance(message, PortableMessage) else PortableMessage.from_discord(message)
+            for message in messages]
+
+
+class InlineExecutor(Executor):
+    """
+    Executor running each function at once, in the calling thread, when it is submitted. It blocks the event loop :
+    it is meant for a profiled run (see metrics.profiled), where the work must happen in the profiled thread.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as error:
+            future.set_exception(error)
+        return future
+
+
+# tokenizers of the current (worker) process by stem cache file, so that their stem cache is reused across chunks
+_tokenizers = {}
+
+
+def get_tokenizer(stem_cache_file=None):
+    """
+    :param stem_cache_file: string, the json file of the stem cache of the tokenizer (see Tokenizer)
+    :return: Tokenizer, the same one for each call with the same stem_cache_file in a process
+    """
+    from src_inverted_file.tokenizer import Tokenizer
+
+    tokenizer = _tokenizers.get(stem_cache_file)
+    if tokenizer is None:
+        tokenizer = _tokenizers[stem_cache_file] = Tokenizer(stem_cache_file=stem_cache_file)
+    return tokenizer
+
+
+def index_messages_to_file(messages, filename, disk_interfacer=ndi, stem_cache_file=None, positional=False):
+    """
+    Tokenize and index messages, then save them as an inverted file. Made to run in a worker process.
+    :param messages: list of PortableMessage
+    :param filename: string, the path of the inverted file to be saved on disc
+    :param disk_interfacer: the disk interfacer used to encode the inverted file
+    :param stem_cache_file: string, the json file the stem cache is loaded from and saved to. Default is None
+    :param positional: boolean, also index the positions of the words (see InvertedFile). Default is False
+    :return: string, filename
+    """
+    from src_inverted_file.formatted_document import FormattedDocument
+    from src_inverted_file.inverted_file_builder import InvertedFileBuilder
+    from src_inverted_file.score import score
+
+    tokenizer = get_tokenizer(stem_cache_file)
+    builder = InvertedFileBuilder(score, disk_interfacer=disk_interfacer, positional=positional)
+    builder.add_documents(FormattedDocument(messages=messages, tokenizer=tokenizer).matches)
+    builder.finish(filename)
+    tokenizer.save_stem_cache()
+    return filename
+
+
+def split_in_chunks(messages, chunk_size):
+    """
+    :param messages: list, the messages to split
+    :param chunk_size: integer, the maximum number of messages of a chunk
+    :return: list of lists of messages
+    """
+    return [messages[start:start + chunk_size] for start in range(0, len(messages), chunk_size)]
+
+
+def build_inverted_file_parallel(messages, inverted_file_path, processes=None, chunk_size=10000, disk_interfacer=ndi,
+                                 stem_cache_file=None, positional=False):
+    """
+    Shard messages across worker processes, each of them tokenizing its shards and saving them as inverted files,
+    then merge the shards on disc.
+    :param messages: list of discord.Message or PortableMessage
+    :param inverted_file_path: string, the path of the inverted file to be saved on disc
+    :param processes: integer, the number of worker processes. Default is the number of cores
+    :param chunk_size: integer, the maximum number of messages of a shard. The messages are split in at least one
+                       shard per process
+    :param disk_interfacer: the disk interfacer used to encode the inverted file. Each process gets its own copy : a
+                            SmartDiskInterfacer with a DocIdMap saves the map of each process next to the shard it
+                            wrote, and the shards are decoded with their own map when they are merged
+    :param stem_cache_file: string, the json file of the stem cache of the tokenizers. Default is None
+    :param positional: boolean, also index the positions of the words (see InvertedFile). Default is False
+    :return: string, inverted_file_path
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    processes = processes if processes is not None else os.cpu_count() or 1
+    messages = to_portable_messages(messages)
+    chunk_size = max(1, min(chunk_size, -(-len(messages) // processes)))
+    chunks = split_in_chunks(messages, chunk_size)
+    if len(chunks) <= 1:
+        return index_messages_to_file(messages, inverted_file_path, disk_interfacer, stem_cache_file, positional)
+
+    chunk_directory = tempfile.mkdtemp(prefix='inverted_file_chunks_')
+    try:
+        chunk_paths = [os.path.join(chunk_directory, 'chunk_{}.if'.format(index)) for index in range(len(chunks))]
+        with ProcessPoolExecutor(processes) as executor:
+            list(executor.map(index_messages_to_file, chunks, chunk_paths, [disk_interfacer] * len(chunks),
+                              [stem_cache_file] * len(chunks), [positional] * len(chunks)))
+        InvertedFile.merge_many_inverted_files(inverted_file_path, chunk_paths, disk_interfacer)
+    finally:
+        shutil.rmtree(chunk_directory, ignore_errors=True)
+    return inverted_file_path
+
+
+async def generate_inverted_file_async(messages, inverted_file_path, executor, progress=None, chunk_size=10000,
+                                       disk_interfacer=ndi, stem_cache_file=None, positional=False, loop=None):
+    """
+    Index messages in an executor, so that the event loop keeps running during the indexing.
+    The messages are split in chunks which are all submitted at once : with a ProcessPoolExecutor, they are tokenized
+    and indexed in parallel, each in its own inverted file. The chunks are merged at the end, in the executor as well.
+    :param messages: list of discord.Message or PortableMessage
+    :param inverted_file_path: string, the path of the inverted file to be saved on disc
+    :param executor: concurrent.futures.Executor, typically a ProcessPoolExecutor
+    :param progress: coroutine function of prototype [progress(nb_indexed, nb_messages)], awaited each time a chunk
+                     is indexed. Default is None
+    :param chunk_size: integer, the number of messages sent to the executor at once
+    :param disk_interfacer: the disk interfacer used to encode the inverted file. It must be picklable, each worker
+                            process getting its own copy (see build_inverted_file_parallel)
+    :param stem_cache_file: string, the json file of the stem cache of the tokenizers. Default is None
+    :param positional: boolean, also index the positions of the words (see InvertedFile). Default is False
+    :param loop: asyncio event loop. Default is the current event loop
+    :return: string, inverted_file_path
+    """
+    loop = loop if loop is not None else asyncio.get_event_loop()
+    messages = to_portable_messages(messages)
+    if len(messages) <= chunk_size:
+        merge_measured(await loop.run_in_executor(executor, measured_call, index_messages_to_file, messages,
+                                                  inverted_file_path, disk_interfacer, stem_cache_file, positional))
+        if progress is not None:
+            await progress(len(messages), len(messages))
+        return inverted_file_path
+
+    chunk_directory = tempfile.mkdtemp(prefix='inverted_file_chunks_')
+    try:
+        chunks = split_in_chunks(messages, chunk_size)
+        chunk_paths = [os.path.join(chunk_directory, 'chunk_{}.if'.format(index)) for index in range(len(chunks))]
+        pending = [loop.run_in_executor(executor, measured_call, index_messages_to_file, chunk, chunk_path,
+                                        disk_interfacer, stem_cache_file, positional)
+                   for (chunk, chunk_path) in zip(chunks, chunk_paths)]
+        nb_indexed = 0
+        for (chunk, future) in zip(chunks, pending):
+            merge_measured(await future)
+            nb_indexed += len(chunk)
+            if progress is not None:
+                await progress(nb_indexed, len(messages))
+
+        merge_measured(await loop.run_in_executor(executor, measured_call, InvertedFile.merge_many_inverted_files,
+                                                  inverted_file_path, chunk_paths, disk_interfacer))
+    finally:
+        shutil.rmtree(chunk_directory, ignore_errors=True)
+    return inverted_file_path
+
+
+async def portable_batches(messages, batch_size):
+    """
+    Async generator, group the messages of an asynchronous stream in lists, converting them to PortableMessage on the
+    way so that no reference to the discord.Message objects is kept
+    :param messages: async iterable of discord.Message or PortableMessage
+    :param batch_size: integer, the number of messages of a batch (the last batch may be smaller)
+    :return: yield lists of PortableMessage
+    """
+    batch = []
+    async for message in messages:
+        batch.append(message if isinstance(message, PortableMessage) else PortableMessage.from_discord(message))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def move_inverted_file(source, destination):
+    """
+    Rename an inverted file along with the files saved with it (see InvertedFile.sidecar_filenames), if any
+    :param source: string, the path of the inverted file
+    :param destination: string, its new path
+    :return: None
+    """
+    for path in InvertedFile.sidecar_filenames(destination):
+        if os.path.exists(path):
+            os.remove(path)
+    for (path, new_path) in zip([source] + InvertedFile.sidecar_filenames(source),
+                                [destination] + InvertedFile.sidecar_filenames(destination)):
+        if os.path.exists(path):
+            os.replace(path, new_path)
+
+
+async def generate_inverted_file_streaming(messages, inverted_file_path, executor, batch_size=10000, max_pending=2,
+                                           progress=None, disk_interfacer=ndi, stem_cache_file=None, positional=False,
+                                           loop=None):
+    """
+    Index an asynchronous stream of messages (typically the history of a channel being fetched) while it is read :
+    each time batch_size messages are fetched, they are sent to the executor to be tokenized and flushed as an
+    inverted file, and the fetching goes on meanwhile. The flushed batches are merged at the end, in the executor.
+    At most max_pending batches are being indexed at once, the fetching waits otherwise : the memory taken by the
+    messages is bounded by (max_pending + 1) * batch_size, whatever the length of the stream.
+    :param messages: async iterable of discord.Message or PortableMessage
+    :param inverted_file_path: string, the path of the inverted file to be saved on disc
+    :param executor: concurrent.futures.Executor, typically a ProcessPoolExecutor
+    :param batch_size: integer, the number of messages of a flushed batch. Default is 10000
+    :param max_pending: integer, the maximum number of batches being indexed at once. Default is 2
+    :param progress: coroutine function of prototype [progress(nb_indexed, nb_fetched)], awaited each time a batch
+                     is indexed. Default is None
+    :param disk_interfacer: see generate_inverted_file_async
+    :param stem_cache_file: string, the json file of the stem cache of the tokenizers. Default is None
+    :param positional: boolean, also index the positions of the words (see InvertedFile). Default is False
+    :param loop: asyncio event loop. Default is the current event loop
+    :return: tuple (inverted_file_path, nb_messages), inverted_file_path being None if the stream was empty
+    """
+    loop = loop if loop is not None else asyncio.get_event_loop()
+    # next to the inverted file, so that a single batch can be renamed into it
+    chunk_directory = tempfile.mkdtemp(prefix='inverted_file_chunks_',
+                                       dir=os.path.dirname(os.path.abspath(inverted_file_path)))
+    pending = deque()
+    try:
+        chunk_paths = []
+        nb_fetched = 0
+        nb_indexed = 0
+        async for batch in portable_batches(messages, batch_size):
+            nb_fetched += len(batch)
+            chunk_path = os.path.join(chunk_directory, 'chunk_{}.if'.format(len(chunk_paths)))
+            chunk_paths.append(chunk_path)
+            pending.append((len(batch), loop.run_in_executor(executor, measured_call, index_messages_to_file, batch,
+                                                             chunk_path, disk_interfacer, stem_cache_file, positional)))
+            del batch
+            while len(pending) > max_pending or (pending and pending[0][1].done()):
+                (nb_messages, future) = pending.popleft()
+                merge_measured(await future)
+                nb_indexed += nb_messages
+                if progress is not None:
+                    await progress(nb_indexed, nb_fetched)
+
+        while pending:
+            (nb_messages, future) = pending.popleft()
+            merge_measured(await future)
+            nb_indexed += nb_messages
+            if progress is not None:
+                await progress(nb_indexed, nb_fetched)
+
+        if not chunk_paths:
+            return None, 0
+        if len(chunk_paths) == 1:
+            move_inverted_file(chunk_paths[0], inverted_file_path)
+        else:
+            merge_measured(await loop.run_in_executor(executor, measured_call, InvertedFile.merge_many_inverted_files,
+                                                      inverted_file_path, chunk_paths, disk_interfacer))
+        return inverted_file_path, nb_indexed
+    finally:
+        for (_, future) in pending:
+            future.cancel()
+        shutil.rmtree(chunk_directory, ignore_errors=True)
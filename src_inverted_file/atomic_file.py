@@ -0,0 +1,48 @@
+# atomic_file.py Crash-safe writing of the files of an index
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import contextlib
+import os
+
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+@contextlib.contextmanager
+def atomic_write(filename, buffer_size=WRITE_BUFFER_SIZE):
+    """
+    Context manager opening a buffered binary file to write instead of <filename>.
+    The content is written in a temporary file next to <filename>, which is then renamed to <filename> once everything
+    is written and synced, so that <filename> is either the previous file or the complete new one, never a truncated one.
+    If an exception is raised inside the block, the temporary file is removed and <filename> is left untouched.
+    :param filename: string, the path of the file to write
+    :param buffer_size: integer, the size of the write buffer (in bytes)
+    :return: yield File, the temporary file opened in binary mode
+    """
+    temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temp_filename, 'wb', buffering=buffer_size) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
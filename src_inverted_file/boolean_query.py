@@ -0,0 +1,225 @@
+# boolean_query.py Parse boolean and phrase queries, and combine sorted posting lists
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import bisect
+import heapq
+import re
+from operator import itemgetter
+
+# A query is a list of words, of "exact phrases" and of the operators AND, OR, NOT and parentheses.
+# Words following each other without an operator are joined by AND, and NOT binds tighter than AND, itself tighter
+# than OR : 'deep learning OR "neural network" NOT survey' is '(deep AND learning) OR ("neural network" AND NOT survey)'
+QUERY_REGEX = re.compile(r'"[^"]*"?|[()]|[^\s()"]+')
+OPERATORS = ('AND', 'OR', 'NOT')
+
+
+class QuerySyntaxError(ValueError):
+    """
+    Raised when a boolean query can not be parsed
+    """
+    pass
+
+
+def is_boolean_query(query):
+    """
+    :param query: string, the text of a query
+    :return: boolean, whether the query uses an operator, a parenthesis or an exact phrase
+    """
+    return any(part in OPERATORS or part[0] in '"()' for part in QUERY_REGEX.findall(query))
+
+
+def parse_query(query):
+    """
+    Parse a query into a tree of tuples, whose nodes are :
+        - ('word', text) and ('phrase', text), the leaves
+        - ('and', left, right), ('or', left, right) and ('not', node)
+    :param query: string, the text of the query
+    :return: tuple, the root of the tree, or None if the query is empty
+    """
+    parts = QUERY_REGEX.findall(query)
+    if not parts:
+        return None
+    (node, cursor) = _parse_or(parts, 0)
+    if cursor != len(parts):
+        raise QuerySyntaxError('Unexpected "{}" in the query'.format(parts[cursor]))
+    return node
+
+
+def _parse_or(parts, cursor):
+    (node, cursor) = _parse_and(parts, cursor)
+    while cursor < len(parts) and parts[cursor] == 'OR':
+        (right, cursor) = _parse_and(parts, cursor + 1)
+        node = ('or', node, right)
+    return node, cursor
+
+
+def _parse_and(parts, cursor):
+    (node, cursor) = _parse_not(parts, cursor)
+    while cursor < len(parts) and parts[cursor] not in ('OR', ')'):
+        if parts[cursor] == 'AND':
+            cursor += 1
+        (right, cursor) = _parse_not(parts, cursor)
+        node = ('and', node, right)
+    return node, cursor
+
+
+def _parse_not(parts, cursor):
+    if cursor < len(parts) and parts[cursor] == 'NOT':
+        (node, cursor) = _parse_not(parts, cursor + 1)
+        # NOT NOT a is a
+        return (node[1] if node[0] == 'not' else ('not', node)), cursor
+    return _parse_leaf(parts, cursor)
+
+
+def _parse_leaf(parts, cursor):
+    if cursor >= len(parts):
+        raise QuerySyntaxError('Unexpected end of the query')
+    part = parts[cursor]
+    if part == '(':
+        (node, cursor) = _parse_or(parts, cursor + 1)
+        if cursor >= len(parts) or parts[cursor] != ')':
+            raise QuerySyntaxError('Missing ")" in the query')
+        return node, cursor + 1
+    if part in OPERATORS or part == ')':
+        raise QuerySyntaxError('Unexpected "{}" in the query'.format(part))
+    if part[0] == '"':
+        return ('phrase', part.strip('"')), cursor + 1
+    return ('word', part), cursor + 1
+
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------SORTED LISTS OPERATIONS-------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+# The operations below work on lists of tuples sorted by their first element, the doc_id (posting lists, or the
+# results of other operations), and keep the tuples of their first operand.
+
+
+def gallop(postings, doc_id, low=0):
+    """
+    Galloping (exponential) search : find the first posting whose doc_id is not lower than doc_id, looking from low
+    with steps of 1, 2, 4, ... before a bisection, so that it takes O(log(distance)) instead of O(log(len(postings)))
+    :param postings: list of tuples (doc_id, ...), sorted by doc_id
+    :param doc_id: the doc_id to look for
+    :param low: integer, the index to start from
+    :return: integer, the index of the first posting whose doc_id >= doc_id (len(postings) if there is none)
+    """
+    size = len(postings)
+    step = 1
+    while low + step < size and postings[low + step][0] < doc_id:
+        step *= 2
+    return bisect.bisect_left(postings, (doc_id,), low + step // 2, min(low + step + 1, size))
+
+
+def intersect(postings1, postings2):
+    """
+    Intersection of two posting lists, in O(m * log(n / m)) where m is the length of the shorter list : each doc_id
+    of the shorter list is looked for in the longer one by galloping from the previous match
+    :param postings1: list of tuples (doc_id, ...), sorted by doc_id
+    :param postings2: list of tuples (doc_id, ...), sorted by doc_id
+    :return: list of the tuples of the shorter list whose doc_id is in both lists
+    """
+    if len(postings1) > len(postings2):
+        (postings1, postings2) = (postings2, postings1)
+    output = []
+    cursor = 0
+    size = len(postings2)
+    for posting in postings1:
+        cursor = gallop(postings2, posting[0], cursor)
+        if cursor == size:
+            break
+        if postings2[cursor][0] == posting[0]:
+            output.append(posting)
+    return output
+
+
+def intersect_many(posting_lists):
+    """
+    :param posting_lists: list of lists of tuples (doc_id, ...), sorted by doc_id
+    :return: list of tuples whose doc_id is in every list, starting with the shortest lists
+    """
+    if not posting_lists:
+        return []
+    posting_lists = sorted(posting_lists, key=len)
+    output = posting_lists[0]
+    for postings in posting_lists[1:]:
+        if not output:
+            break
+        output = intersect(output, postings)
+    return output
+
+
+def select(postings, matches):
+    """
+    Postings of some documents, in O(m * log(n / m)) where m is the number of documents
+    :param postings: list of tuples (doc_id, ...), sorted by doc_id
+    :param matches: list of tuples (doc_id, ...), sorted by doc_id, the documents wanted
+    :return: list of the tuples of postings whose doc_id is in matches
+    """
+    output = []
+    cursor = 0
+    size = len(postings)
+    for match in matches:
+        cursor = gallop(postings, match[0], cursor)
+        if cursor == size:
+            break
+        if postings[cursor][0] == match[0]:
+            output.append(postings[cursor])
+    return output
+
+
+def union(postings1, postings2):
+    """
+    :param postings1: list of tuples (doc_id, ...), sorted by doc_id
+    :param postings2: list of tuples (doc_id, ...), sorted by doc_id
+    :return: list of tuples whose doc_id is in at least one list, each doc_id being kept once
+    """
+    output = []
+    for posting in heapq.merge(postings1, postings2, key=itemgetter(0)):
+        if not output or output[-1][0] != posting[0]:
+            output.append(posting)
+    return output
+
+
+def difference(postings1, postings2):
+    """
+    Postings of a list whose doc_id is not in another one, in O(m * log(n / m)) where m is the length of postings1
+    :param postings1: list of tuples (doc_id, ...), sorted by doc_id
+    :param postings2: list of tuples (doc_id, ...), sorted by doc_id
+    :return: list of the tuples of postings1 whose doc_id is not in postings2
+    """
+    output = []
+    cursor = 0
+    size = len(postings2)
+    for posting in postings1:
+        cursor = gallop(postings2, posting[0], cursor)
+        if cursor == size or postings2[cursor][0] != posting[0]:
+            output.append(posting)
+    return output
+
+
+def phrase_match(positions):
+    """
+    :param positions: list of tuples of integers, the ascending positions in a document of each word of a phrase
+    :return: boolean, whether the words follow each other in the document
+    """
+    following = [set(word_positions) for word_positions in positions[1:]]
+    for start in positions[0]:
+        if all(start + offset in word_positions for (offset, word_positions) in enumerate(following, 1)):
+            return True
+    return False
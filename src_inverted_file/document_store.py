@@ -0,0 +1,563 @@
+# document_store.py Compact columnar storage of the metadata of the indexed messages
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import bisect
+import contextlib
+import datetime
+import heapq
+import mmap
+import os
+import struct
+import sys
+import uuid
+from array import array
+
+from src_inverted_file.atomic_file import atomic_write
+from src_inverted_file.term_dictionary import TermDictionary
+
+# The store is saved as a sidecar of an inverted file (see DocumentStore.store_filename), one column after the other :
+# <magic(8 bytes)><nb_documents(8 bytes)>
+# <doc_id_highs(uint64 each)><doc_id_lows(uint64 each)><timestamps(float64 each)><authors(uint64 each)>
+# <lengths(uint32 each)><link_offsets(uint32 each, nb_documents + 1)><links(utf-8, separated by '\n')>
+# Numbers are little-endian. A doc_id is split in its 64 high bits and its 64 low bits (see
+# TermDictionary.skip_doc_id_bytes for the order of the doc_ids), so that the doc_ids are searched in place as integers.
+# The documents are sorted by doc_id, so that the dense id of a document is its rank, and every column starts on a
+# multiple of its item size, so that it can be used in place from the mapped file.
+STORE_MAGIC = b'IEDOCS2\x00'
+HEADER_STRUCT = struct.Struct('<8sQ')
+DOC_ID_LEN = 16
+DOC_ID_STRUCT = struct.Struct('>QQ')
+LOW_MASK = (1 << 64) - 1
+# DocumentStore.lengths_of reads the lengths by chunks of LENGTHS_CHUNK documents, copying the part of the columns
+# holding a chunk if it has at most WINDOW_FACTOR times as many documents
+LENGTHS_CHUNK = 1024
+WINDOW_FACTOR = 8
+
+
+def doc_id_value(doc_id):
+    """
+    :param doc_id: uuid.UUID or integer, the id of a message
+    :return: integer, its 128 bits, ordered as the doc_ids themselves (see TermDictionary.skip_doc_id_bytes)
+    """
+    return doc_id if isinstance(doc_id, int) else doc_id.int
+
+
+def _timestamp(date):
+    """
+    :param date: datetime.datetime (naive dates are in UTC, as given by discord), or None
+    :return: float, the number of seconds since the epoch (0 if the date is unknown)
+    """
+    if not isinstance(date, datetime.datetime):
+        return 0.
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+
+def _author_id(author):
+    """
+    :param author: discord.Member, discord.User, or the id of the author (a string of digits), or None
+    :return: integer, the snowflake of the author (0 if it is unknown)
+    """
+    author = getattr(author, 'id', author)
+    try:
+        return int(author) if author else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+def _to_little_endian(column):
+    """
+    :param column: array.array
+    :return: bytes, the content of the array in little-endian
+    """
+    if sys.byteorder == 'little':
+        return column.tobytes()
+    swapped = array(column.typecode, column)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+class StoredDocument(object):
+    """
+    Metadata of an indexed message, as read from a DocumentStore
+    Attributes :
+        - doc_id : uuid.UUID, the id of the message in the posting lists
+        - length : integer, the number of tokens of the message
+        - timestamp : float, when the message was written, in seconds since the epoch (0 if unknown)
+        - author : integer, the id of the author of the message (0 if unknown)
+        - links : list of string, the urls embedded in the message
+    """
+    __slots__ = ('doc_id', 'length', 'timestamp', 'author', 'links')
+
+    def __init__(self, doc_id, length, timestamp, author, links):
+        self.doc_id = doc_id
+        self.length = length
+        self.timestamp = timestamp
+        self.author = author
+        self.links = links
+
+    @property
+    def date(self):
+        """
+        :return: datetime.datetime, when the message was written (UTC), None if unknown
+        """
+        if not self.timestamp:
+            return None
+        return datetime.datetime.fromtimestamp(self.timestamp, datetime.timezone.utc)
+
+
+class DocumentStoreWriter(object):
+    """
+    Class made to gather the metadata of the messages being indexed in compact columns, and to save them as a
+    DocumentStore. A document takes about 40 bytes (plus its links) instead of a whole IEMessage.
+    Initialize : None, documents are then added with add_document or add
+
+    Attributes :
+        - __doc_ids : bytearray, the concatenated 16 bytes of the doc_ids
+        - __timestamps, __authors, __lengths : array.array, a column per field
+        - __link_offsets : array.array, the position of the links of each document in __links (one more than documents)
+        - __links : bytearray, the concatenated links of the documents
+    """
+
+    def __init__(self):
+        self.__doc_ids = bytearray()
+        self.__timestamps = array('d')
+        self.__authors = array('Q')
+        self.__lengths = array('I')
+        self.__link_offsets = array('I', [0])
+        self.__links = bytearray()
+
+    def __len__(self):
+        return len(self.__lengths)
+
+    def add(self, doc_id, length, timestamp=0., author=0, links=()):
+        """
+        :param doc_id: uuid.UUID or integer, the id of the message
+        :param length: integer, the number of tokens of the message
+        :param timestamp: float, when the message was written, in seconds since the epoch. Default is unknown
+        :param author: integer, the id of the author. Default is unknown
+        :param links: iterable of string, the urls embedded in the message. Default is none
+        :return: None
+        """
+        self.__doc_ids += TermDictionary.skip_doc_id_bytes(doc_id)
+        self.__timestamps.append(timestamp)
+        self.__authors.append(author)
+        self.__lengths.append(length)
+        self.__links += '\n'.join(links).encode('utf-8')
+        self.__link_offsets.append(len(self.__links))
+
+    def add_document(self, document):
+        """
+        :param document: IEMessage, an element of FormattedDocument.matches
+        :return: None
+        """
+        self.add(document.id, document.length, _timestamp(document.date), _author_id(document.author), document.links)
+
+    def save(self, filename):
+        """
+        Save the documents, sorted by doc_id, as a DocumentStore
+        :param filename: string, the path of the store (see DocumentStore.store_filename)
+        :return: None
+        """
+        doc_ids = self.__doc_ids
+        order = sorted(range(len(self)), key=lambda index: doc_ids[index * DOC_ID_LEN:(index + 1) * DOC_ID_LEN])
+        write_store(filename, [(self, index) for index in order])
+
+    def row(self, index):
+        """
+        :param index: integer, the rank of a document in order of addition
+        :return: tuple (doc_id bytes, timestamp, author, length, links bytes)
+        """
+        return (bytes(self.__doc_ids[index * DOC_ID_LEN:(index + 1) * DOC_ID_LEN]), self.__timestamps[index],
+                self.__authors[index], self.__lengths[index],
+                bytes(self.__links[self.__link_offsets[index]:self.__link_offsets[index + 1]]))
+
+
+class DocumentStore(object):
+    """
+    Class made to read the metadata of the messages of an inverted file without loading it : the file is
+    memory-mapped and each column is read in place, no object being kept per document.
+    The documents are sorted by doc_id, their dense id is their rank in the store, found by a binary search of the
+    integer columns of the doc_ids. The posting lists being sorted by doc_id as well, their lengths are read in bulk,
+    the search of the documents of a posting list starting where the search of the previous one ended (see
+    lengths_of).
+    Initialize :
+        - filename : string, the path of the store (see store_filename)
+
+    Attributes :
+        - filename : string, the path of the store
+        - lengths : sequence of integers, the length of each document by dense id
+        - timestamps : sequence of floats, when each document was written, by dense id
+        - authors : sequence of integers, the author of each document, by dense id
+        - __highs, __lows : sequence of integers, the 64 high bits and the 64 low bits of each doc_id, by dense id
+        - __link_offsets : sequence of integers, the position of the links of each document in __links
+        - __links : bytes-like, the concatenated links of the documents
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, nb_documents = HEADER_STRUCT.unpack_from(self.__map, 0)
+        if magic != STORE_MAGIC:
+            self.__map.close()
+            raise ValueError('{} is not a document store'.format(filename))
+        self.__views = []
+
+        cursor = HEADER_STRUCT.size
+        (self.__highs, cursor) = self.__column('Q', cursor, nb_documents)
+        (self.__lows, cursor) = self.__column('Q', cursor, nb_documents)
+        (self.timestamps, cursor) = self.__column('d', cursor, nb_documents)
+        (self.authors, cursor) = self.__column('Q', cursor, nb_documents)
+        (self.lengths, cursor) = self.__column('I', cursor, nb_documents)
+        (self.__link_offsets, cursor) = self.__column('I', cursor, nb_documents + 1)
+        self.__links_start = cursor
+        self.__nb_documents = nb_documents
+
+    def __column(self, typecode, cursor, size):
+        """
+        :param typecode: string, the array typecode of the column
+        :param cursor: integer, the position of the column in the file
+        :param size: integer, the number of items of the column
+        :return: tuple (column, cursor), the column and the position following it
+        """
+        item_size = array(typecode).itemsize
+        end = cursor + item_size * size
+        if sys.byteorder == 'little':
+            view = memoryview(self.__map)[cursor:end]
+            self.__views.append(view)
+            column = view.cast(typecode)
+            self.__views.append(column)
+        else:
+            column = array(typecode, self.__map[cursor:end])
+            column.byteswap()
+        return column, end
+
+    @staticmethod
+    def store_filename(if_filename):
+        """
+        :param if_filename: string, the path of an inverted file
+        :return: string, the path of its document store
+        """
+        return if_filename + '.docs'
+
+    @classmethod
+    def open(cls, if_filename):
+        """
+        :param if_filename: string, the path of an inverted file
+        :return: DocumentStore, the store of the inverted file, or None if it has none
+        """
+        filename = cls.store_filename(if_filename)
+        if not os.path.exists(filename):
+            return None
+        return cls(filename)
+
+    def close(self):
+        """
+        Unmap the file. The columns must not be used anymore.
+        :return: None
+        """
+        for view in reversed(self.__views):
+            view.release()
+        self.__views = []
+        self.__map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.__nb_documents
+
+    def doc_id_bytes(self, dense_id):
+        """
+        :param dense_id: integer, the rank of a document
+        :return: bytes, the 16 bytes of its doc_id (see TermDictionary.skip_doc_id_bytes)
+        """
+        return DOC_ID_STRUCT.pack(self.__highs[dense_id], self.__lows[dense_id])
+
+    def search_position(self, value, start=0):
+        """
+        Search of a doc_id in the doc_id columns, in place : an exponential search from start, then a binary search
+        :param value: integer, the 128 bits of a doc_id (see doc_id_value)
+        :param start: integer, a position in the store which is not after the doc_id, typically the position found for
+                      a lower doc_id. Default is 0
+        :return: integer, the dense id of the first document whose doc_id is not lower than the doc_id (the number of
+                 documents if there is none)
+        """
+        highs = self.__highs
+        nb_documents = self.__nb_documents
+        high = value >> 64
+        step = 1
+        end = start
+        while end < nb_documents and highs[end] < high:
+            start = end + 1
+            end = start + step
+            step *= 2
+        index = bisect.bisect_left(highs, high, start, min(end, nb_documents))
+        if index < nb_documents and highs[index] == high:
+            low = value & LOW_MASK
+            if self.__lows[index] < low:
+                # doc_ids sharing their 64 high bits are sorted by their low bits
+                index = bisect.bisect_left(self.__lows, low, index, bisect.bisect_right(highs, high, index))
+        return index
+
+    def holds(self, dense_id, value):
+        """
+        :param dense_id: integer, a position in the store (as given by search_position)
+        :param value: integer, the 128 bits of a doc_id (see doc_id_value)
+        :return: boolean, True if the document at this position has this doc_id
+        """
+        return dense_id < self.__nb_documents and self.__highs[dense_id] == value >> 64 and \
+            self.__lows[dense_id] == value & LOW_MASK
+
+    def dense_id(self, doc_id, start=0):
+        """
+        :param doc_id: uuid.UUID or integer, the id of a message
+        :param start: integer, a position in the store which is not after the document (see search_position).
+                      Default is 0
+        :return: integer, the dense id of the document, None if it is not in the store
+        """
+        value = doc_id_value(doc_id)
+        dense_id = self.search_position(value, start)
+        return dense_id if self.holds(dense_id, value) else None
+
+    def lengths_of(self, doc_ids, default=None, start=0):
+        """
+        Read the lengths of documents sorted by doc_id, such as the ones of a posting list, by chunks of
+        LENGTHS_CHUNK documents (see __chunk_lengths)
+        :param doc_ids: list of uuid.UUID or integers, sorted
+        :param default: the length of the documents which are not in the store. Default is None
+        :param start: integer, a position in the store which is not after the first document. Default is 0
+        :return: tuple (lengths, position), the list of the lengths of the documents, and a position in the store which
+                 is not after the last of them (a valid start for the doc_ids following them)
+        """
+        output = []
+        position = start
+        for chunk_start in range(0, len(doc_ids), LENGTHS_CHUNK):
+            (lengths, position) = self.__chunk_lengths(doc_ids[chunk_start:chunk_start + LENGTHS_CHUNK], default,
+                                                       position)
+            output += lengths
+        return output, position
+
+    def __chunk_lengths(self, doc_ids, default, start):
+        """
+        The part of the columns between the first and the last document asked is copied into lists, and indexed by a
+        dictionary built in one call : the rest is a lookup per document, much cheaper than reading the mapped columns
+        item by item in a binary search. This is not done in place : the copies hold at most WINDOW_FACTOR *
+        LENGTHS_CHUNK documents, and are released once the chunk is read. If the documents are sparse in the store
+        (less than one in WINDOW_FACTOR), each one is searched in place instead, from where the search of the previous
+        one ended.
+        :param doc_ids: list of uuid.UUID or integers, sorted, not empty
+        :param default: the length of the documents which are not in the store
+        :param start: integer, a position in the store which is not after the first document
+        :return: tuple (lengths, position), see lengths_of
+        """
+        values = [doc_id if isinstance(doc_id, int) else doc_id.int for doc_id in doc_ids]
+        first = self.search_position(values[0], start)
+        last = self.search_position(values[-1], first)
+        end = min(last + 1, self.__nb_documents)
+        output = []
+        if end - first > WINDOW_FACTOR * len(values):
+            position = first
+            for value in values:
+                position = self.search_position(value, position)
+                output.append(self.lengths[position] if self.holds(position, value) else default)
+            return output, last
+
+        highs = self.__highs[first:end].tolist()
+        lows = self.__lows[first:end].tolist()
+        lengths = self.lengths[first:end].tolist()
+        positions = dict(zip(highs, range(len(highs))))
+        for value in values:
+            position = positions.get(value >> 64)
+            if position is not None and lows[position] == value & LOW_MASK:
+                output.append(lengths[position])
+            else:
+                # not in the store, or sharing its 64 high bits with another document
+                position = self.search_position(value, first)
+                output.append(self.lengths[position] if self.holds(position, value) else default)
+        return output, last
+
+    def doc_ids(self, tag=None):
+        """
+        Generator over the doc_ids of the store, in order
+        :param tag: any value, yielded along with each doc_id. Default is None
+        :return: yield tuples (doc_id bytes, tag, dense_id)
+        """
+        for dense_id in range(self.__nb_documents):
+            yield self.doc_id_bytes(dense_id), tag, dense_id
+
+    def lengths_items(self):
+        """
+        Generator over the lengths of the documents, in order of doc_id
+        :return: yield tuples (doc_id, length), where doc_id is a uuid.UUID
+        """
+        for dense_id in range(self.__nb_documents):
+            yield uuid.UUID(bytes=self.doc_id_bytes(dense_id)), self.lengths[dense_id]
+
+    def links(self, dense_id):
+        """
+        :param dense_id: integer, the rank of a document
+        :return: list of string, the links of the document
+        """
+        start = self.__links_start + self.__link_offsets[dense_id]
+        end = self.__links_start + self.__link_offsets[dense_id + 1]
+        return self.__map[start:end].decode('utf-8').split('\n') if end > start else []
+
+    def document(self, doc_id):
+        """
+        :param doc_id: uuid.UUID, the id of a message
+        :return: StoredDocument, or None if the document is not in the store
+        """
+        dense_id = self.dense_id(doc_id)
+        if dense_id is None:
+            return None
+        return StoredDocument(doc_id, self.lengths[dense_id], self.timestamps[dense_id], self.authors[dense_id],
+                              self.links(dense_id))
+
+    def row(self, index):
+        """
+        :param index: integer, the dense id of a document
+        :return: tuple (doc_id bytes, timestamp, author, length, links bytes)
+        """
+        start = self.__links_start + self.__link_offsets[index]
+        end = self.__links_start + self.__link_offsets[index + 1]
+        return (self.doc_id_bytes(index), self.timestamps[index], self.authors[index], self.lengths[index],
+                self.__map[start:end])
+
+    @classmethod
+    def merge(cls, filename, filenames):
+        """
+        Merge several stores into one, a doc_id found in several stores being kept once, with the metadata of the
+        last store containing it in filenames (as the posting lists, see InvertedFile.merge_many_inverted_files)
+        :param filename: string, the path of the merged store
+        :param filenames: list of string, the paths of the stores to merge
+        :return: None
+        """
+        with contextlib.ExitStack() as stack:
+            stores = [stack.enter_context(cls(store_filename)) for store_filename in filenames]
+            merged = heapq.merge(*[store.doc_ids(index) for (index, store) in enumerate(stores)])
+            rows = []
+            for (doc_id, index, dense_id) in merged:
+                if rows and rows[-1][0] == doc_id:
+                    rows[-1] = (doc_id, stores[index], dense_id)
+                else:
+                    rows.append((doc_id, stores[index], dense_id))
+            write_store(filename, [(store, dense_id) for (_, store, dense_id) in rows])
+
+
+def write_store(filename, rows):
+    """
+    Write a DocumentStore, column by column, atomically
+    :param filename: string, the path of the store
+    :param rows: list of tuples (source, index), the documents in order of doc_id, where source is a
+                 DocumentStoreWriter or a DocumentStore and index the rank of the document in it (see their method row)
+    :return: None
+    """
+    highs = array('Q')
+    lows = array('Q')
+    timestamps = array('d')
+    authors = array('Q')
+    lengths = array('I')
+    link_offsets = array('I', [0])
+    links = bytearray()
+    for (source, index) in rows:
+        (doc_id, timestamp, author, length, document_links) = source.row(index)
+        (high, low) = DOC_ID_STRUCT.unpack(doc_id)
+        highs.append(high)
+        lows.append(low)
+        timestamps.append(timestamp)
+        authors.append(author)
+        lengths.append(length)
+        links += document_links
+        link_offsets.append(len(links))
+
+    with atomic_write(filename) as f:
+        f.write(HEADER_STRUCT.pack(STORE_MAGIC, len(lengths)))
+        for column in (highs, lows, timestamps, authors, lengths, link_offsets):
+            f.write(_to_little_endian(column))
+        f.write(links)
+
+
+class DocumentLengths(object):
+    """
+    Read-only mapping (doc_id: length) over the DocumentStore of several inverted files, used in place of a
+    dictionary by the ranking so that no object is kept per document. A doc_id found in several stores has the
+    length of the last one, as in a merge.
+    Initialize :
+        - stores : list of DocumentStore, from the oldest to the newest
+
+    Attributes :
+        - stores : list of DocumentStore
+    """
+
+    def __init__(self, stores):
+        self.stores = stores
+
+    def __len__(self):
+        return sum(len(store) for store in self.stores)
+
+    def get(self, doc_id, default=None):
+        """
+        :param doc_id: uuid.UUID, the id of a message
+        :param default: the value returned if the document is unknown
+        :return: integer, the length of the document
+        """
+        for store in reversed(self.stores):
+            dense_id = store.dense_id(doc_id)
+            if dense_id is not None:
+                return store.lengths[dense_id]
+        return default
+
+    def lengths_of(self, doc_ids, default=None):
+        """
+        :param doc_ids: list of uuid.UUID or integers, sorted
+        :param default: the length of the documents which are in no store. Default is None
+        :return: list of integers, the length of each document (see DocumentStore.lengths_of), much faster than get
+                 for many documents
+        """
+        output = [default] * len(doc_ids)
+        for store in self.stores:
+            for (index, length) in enumerate(store.lengths_of(doc_ids)[0]):
+                if length is not None:
+                    output[index] = length
+        return output
+
+    def total(self):
+        """
+        :return: integer, the sum of the lengths of the documents
+        """
+        return sum(sum(store.lengths) for store in self.stores)
+
+    def items(self):
+        """
+        :return: iterator of tuples (doc_id, length), sorted by doc_id
+        """
+        return heapq.merge(*[store.lengths_items() for store in self.stores])
+
+    def values(self):
+        """
+        :return: iterator of integers, the length of each document
+        """
+        for store in self.stores:
+            yield from store.lengths
+
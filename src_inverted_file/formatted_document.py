@@ -17,9 +17,13 @@
 # <http://www.gnu.org/licenses/>.
 
 import json
+import time
+
 import nltk
 
 from src_inverted_file.ie_message import IEMessage
+from src_inverted_file.metrics import metrics
+from src_inverted_file.tokenizer import ensure_punkt
 
 
 class FormattedDocument(object):
@@ -44,9 +48,6 @@ class FormattedDocument(object):
     """
 
     def __init__(self, messages=None, json_doc=None, tokenizer=nltk):
-        if tokenizer == nltk:
-            nltk.download('punkt')
-
         self.__tokenizer = tokenizer
         if messages is not None:
             self.matches = self.__format(messages)
@@ -72,7 +73,11 @@ class FormattedDocument(object):
                 - text : list, a list of string, where each string is a paragraph
         """
         output = []
+        if self.__tokenizer == nltk and messages:
+            # the punkt models are only looked for when nltk is actually used
+            ensure_punkt()
 
+        start_time = time.perf_counter()
         for discord_message in messages:
             element = IEMessage()
 
@@ -91,6 +96,9 @@ class FormattedDocument(object):
                 element.add_link(attachment["url"])
 
             output.append(element)
+        # includes the time of the tokenizer (see the tokenizer.* timers)
+        metrics.add_time('formatted_document', time.perf_counter() - start_time, len(output))
+        metrics.count('messages', len(output))
         return output
 
     def to_json(self):
@@ -21,6 +21,9 @@ import uuid
 
 # TODO change attributes to property style : https://www.python-course.eu/python3_properties.php
 class IEMessage(object):
+    # a message is kept in memory while it is being indexed : slots avoid a dictionary per message
+    __slots__ = ('__author', '__date', '__id', '__links', '__text', '__length')
+
     def __init__(self):
         self.__author = ""
         self.__date = None
@@ -47,7 +50,11 @@ class IEMessage(object):
 
     @property
     def link(self):
-        return self.__link
+        return self.__links
+
+    @property
+    def links(self):
+        return self.__links
 
     @property
     def text(self):
@@ -57,7 +64,7 @@ class IEMessage(object):
     def author(self, val):
         self.__author = val
 
-    @author.setter
+    @date.setter
     def date(self, val):
         self.__date = val
 
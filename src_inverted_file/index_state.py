@@ -0,0 +1,168 @@
+# index_state.py Persistent state of the index of the bibliographic channel
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+from src_inverted_file.atomic_file import atomic_write
+
+
+class IndexState(object):
+    """
+    Class made to remember what has already been indexed, so that an update only indexes the new messages, and which
+    segments make up the index : it is the manifest of the index, and the only source of truth about its segments.
+    It is saved atomically as a json file of shape
+    {'generation': ..., 'next_segment': ..., 'last_message_id': ..., 'last_timestamp': ...,
+     'live_message_ids': [...], 'segments': [{'filename': ..., 'generation': ...}, ...]}
+    (the former shapes, where segments is a list of paths or live_message_ids is missing, are still read)
+    The messages indexed live (as they are posted) do not move the high-water mark, since the messages posted before
+    them may not be fetched yet : they are remembered in live_message_ids, so that the next update skips them.
+    Initialize :
+        - filename : string, the path of the json file
+
+    Attributes :
+        - filename : string, the path of the json file
+        - generation : integer, incremented each time the state is saved
+        - next_segment : integer, the number of the next segment file, so that a path is never used twice
+        - last_message_id : string, the id of the newest message indexed (high-water mark), None if nothing is indexed
+        - last_timestamp : string, the date of this message, for information only
+        - live_message_ids : set of string, the ids of the messages indexed live after the high-water mark (saved
+                             sorted, and trimmed as soon as the mark passes them, so that it stays small)
+        - segments : list of string, the paths of the inverted files making up the index, from the oldest to the newest
+        - segment_generations : dictionary (path: integer), the generation of the state each segment was added in
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.generation = 0
+        self.next_segment = 0
+        self.last_message_id = None
+        self.last_timestamp = None
+        self.live_message_ids = set()
+        self.segments = []
+        self.segment_generations = {}
+
+    @classmethod
+    def load(cls, filename):
+        """
+        :param filename: string, the path of the json file
+        :return: IndexState, empty if the file does not exist yet
+        """
+        state = cls(filename)
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                content = json.load(f)
+            state.generation = content.get('generation', 0)
+            state.next_segment = content.get('next_segment', 0)
+            state.last_message_id = content.get('last_message_id')
+            state.last_timestamp = content.get('last_timestamp')
+            state.live_message_ids = set(content.get('live_message_ids', []))
+            for segment in content.get('segments', []):
+                if isinstance(segment, str):
+                    segment = {'filename': segment, 'generation': 0}
+                state.segments.append(segment['filename'])
+                state.segment_generations[segment['filename']] = segment['generation']
+        return state
+
+    def save(self):
+        """
+        Atomically write the state to its json file, as a new generation
+        :return: None
+        """
+        self.generation += 1
+        content = {'generation': self.generation,
+                   'next_segment': self.next_segment,
+                   'last_message_id': self.last_message_id,
+                   'last_timestamp': self.last_timestamp,
+                   'live_message_ids': sorted(self.live_message_ids, key=int),
+                   'segments': [{'filename': filename, 'generation': self.segment_generations.get(filename, 0)}
+                                for filename in self.segments]}
+        with atomic_write(self.filename) as f:
+            f.write(json.dumps(content, indent=2).encode('utf-8'))
+
+    def next_segment_filename(self, directory):
+        """
+        Reserve a path for a new segment : each call gives a new one, even if the state is not saved in between
+        :param directory: string, the directory of the segments
+        :return: string, a path for a new segment which is not used yet
+        """
+        number = max(self.next_segment, len(self.segments))
+        while True:
+            filename = os.path.join(directory, 'segment_{}.if'.format(number))
+            number += 1
+            if filename not in self.segments and not os.path.exists(filename):
+                self.next_segment = number
+                return filename
+
+    def register_segment(self, filename, last_message=None, live_messages=None):
+        """
+        Add a segment to the index and move the high-water mark forward to the newest message fetched from the history,
+        or remember the messages indexed live if the segment holds such messages
+        :param filename: string, the path of the new segment (None if no segment was written)
+        :param last_message: discord.Message, the newest message fetched from the history, indexed or not
+                             (None if there was none)
+        :param live_messages: list of discord.Message, the messages indexed live in the segment. Default is None
+        :return: None
+        """
+        if filename is not None:
+            self.segments.append(filename)
+            self.segment_generations[filename] = self.generation + 1
+        if live_messages:
+            self.live_message_ids.update(message.id for message in live_messages)
+        if last_message is not None and \
+                (self.last_message_id is None or int(last_message.id) > int(self.last_message_id)):
+            self.last_message_id = last_message.id
+            self.last_timestamp = str(last_message.timestamp)
+            # the history up to the mark is indexed, the messages indexed live before it are not needed anymore
+            self.live_message_ids = {message_id for message_id in self.live_message_ids
+                                     if int(message_id) > int(self.last_message_id)}
+
+    def is_indexed(self, message_id):
+        """
+        :param message_id: string, the id of a message
+        :return: boolean, True if the message is already indexed (it is not newer than the high-water mark, or it was
+                 indexed live)
+        """
+        return (self.last_message_id is not None and int(message_id) <= int(self.last_message_id)) or \
+            message_id in self.live_message_ids
+
+    def replace_segments(self, filenames, filename):
+        """
+        Replace consecutive segments by the one they were merged into, at the place of the oldest of them
+        :param filenames: list of string, the paths of the merged segments, consecutive in segments
+        :param filename: string, the path of the segment they were merged into
+        :return: None
+        """
+        index = self.segments.index(filenames[0])
+        if self.segments[index:index + len(filenames)] != list(filenames):
+            raise ValueError('The merged segments are not consecutive in the index')
+        self.segments[index:index + len(filenames)] = [filename]
+        for merged in filenames:
+            del self.segment_generations[merged]
+        self.segment_generations[filename] = self.generation + 1
+
+    def reset(self):
+        """
+        Forget everything indexed, to rebuild the whole index
+        :return: None
+        """
+        self.last_message_id = None
+        self.last_timestamp = None
+        self.live_message_ids = set()
+        self.segments = []
+        self.segment_generations = {}
@@ -16,11 +16,30 @@
 # along with this program; see the file LICENSE.  If not see
 # <http://www.gnu.org/licenses/>.
 
+import contextlib
+import heapq
+import io
+import math
+import os
+import time
+from collections import Counter
+
 from sortedcontainers import SortedDict as sd
 from sortedcontainers import SortedList
 
+from src_inverted_file.atomic_file import atomic_write
+from src_inverted_file.document_store import DocumentStore, DocumentStoreWriter
+from src_inverted_file.metrics import metrics
 from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer as ndi
+from src_inverted_file.positional_disk_interfacer import PositionalDiskInterfacer
 from src_inverted_file.score import *
+from src_inverted_file.smart_disk_interfacer import DocIdMap, interfacer_for_file, save_interfacer_state
+from src_inverted_file.term_dictionary import TermDictionary
+
+READ_BUFFER_SIZE = 1 << 20
+
+# reserved key, which can not be produced by a tokenizer, whose posting list holds (doc_id, length) for each document
+DOCUMENT_LENGTH_KEY = '\x00length'
 
 
 class InvertedFile(object):
@@ -40,21 +59,44 @@ class InvertedFile(object):
               - integer, a score relative to a word and an message. Please note that the score is expected to be relative
                 to a specific "word", not to "the word XXX at the position XXX". For example, in the message "The black hound ate the
                 black bear.", there is a single, unique score relative to the word "black".
+          If the function accepts a keyword parameter term_frequencies, it is called as
+          function(token, document, term_frequencies=...) where term_frequencies is a dictionary (token: integer) of the
+          number of occurrences of each token in the document, computed once per document, so that the function does not
+          need to go through document.text again.
+        - disk_interfacer : the disk interfacer used to encode the inverted file. Default is NaiveDiskInterfacer
+        - positional : boolean, also index the positions of the words in each message (for phrase queries). They are
+          saved in a second inverted file (see positions_filename). Default is False
 
     Attributes :
         - __map : SortedDict, the structure used to store the index in memory. Shape (key: string, value: List)
-            - key : string, words found in various documents
+            - key : string, words found in various documents. The reserved key DOCUMENT_LENGTH_KEY holds the pairs
+              (docid, length) of every document instead, for the ranking of the search results
             - value : list, list of pairs (docid, score) :
                 - docid : integer, the id of a document to identify it in the index
                 - score : integer, the score computed by __score_function for the association (key, doc)
        - __score_function : the score_function sent in parameter for __init__, memorized by the index (see Initialize/score_function for
          more infos)
+       - __score_uses_frequencies : boolean, whether __score_function accepts the term_frequencies parameter
+       - __positions : SortedDict, shape (key: string, value: list of pairs (docid, positions)), where positions is the
+         tuple of the ascending positions of the key in the text of the document. None if the index is not positional
+       - __documents : DocumentStoreWriter, the metadata (length, date, author, links) of the documents, saved as the
+         DocumentStore of the inverted file
     """
 
-    def __init__(self, score_function, disk_interfacer=ndi):
+    def __init__(self, score_function, disk_interfacer=ndi, positional=False):
         self.__map = sd()
         self.__score_function = score_function
+        self.__score_uses_frequencies = accepts_term_frequencies(score_function)
         self.di = disk_interfacer
+        self.__positions = sd() if positional else None
+        self.__documents = DocumentStoreWriter()
+
+    @property
+    def positional(self):
+        """
+        :return: boolean, whether the positions of the words are indexed
+        """
+        return self.__positions is not None
 
     @property
     def map(self):
@@ -81,15 +123,23 @@ class InvertedFile(object):
                   - text : List of tokens
         :return: None
         """
-        tokens = document.text.copy()
-        seen_list = []
-        for token in tokens:
-            if token not in seen_list:
-                seen_list.append(token)
-                computed_score = self.__score_function(token, document)
-                if token not in self.__map:
-                    self.__map[token] = SortedList()
-                self.__map[token].add((document.id, computed_score))
+        (postings, positions) = document_postings(document, self.__score_function, self.__score_uses_frequencies,
+                                                  self.__positions is not None)
+        start_time = time.perf_counter()
+        for (key, value) in postings:
+            posting_list = self.__map.get(key)
+            if posting_list is None:
+                posting_list = self.__map[key] = SortedList()
+            posting_list.add((document.id, value))
+        self.__documents.add_document(document)
+
+        if positions is not None:
+            for (token, occurrences) in positions:
+                posting_list = self.__positions.get(token)
+                if posting_list is None:
+                    posting_list = self.__positions[token] = SortedList()
+                posting_list.add((document.id, occurrences))
+        metrics.add_time('inverted_file.insert', time.perf_counter() - start_time)
 
 # ---------------------------------------------------------------------------------------------------------------------#
 # ---------------------------------------------------------SAVE AND LOAD-----------------------------------------------#
@@ -100,31 +150,171 @@ class InvertedFile(object):
         Used for testing purposes, only encode the object without saving it
         :return: bytearray, a binary representation of the full object
         """
-        output = bytearray()
-        for (key, value) in self.__map.iteritems():
-            output += self.di.encode_posting_list(key, value)
-        return output
+        output = io.BytesIO()
+        self.__write_posting_lists(output, self.__map.items(), self.di)
+        return bytearray(output.getvalue())
 
     def save(self, filename):
         """
-        Save the InvertedFile to the disc
+        Save the InvertedFile to the disc, along with its TermDictionary, its DocumentStore (and its positions if it is
+        positional). Posting lists are encoded and written one by one, and the file is replaced atomically
+        (see write_posting_lists)
         :param filename: string, the path of the inverted file to be saved on disc
         :return: None
         """
-        output = bytearray()
-        for (key, value) in self.__map.iteritems():
-            output += self.di.encode_posting_list(key, value)
-        with open(filename, 'wb+')as f:
-            f.write(output)
+        self.write_posting_lists(filename, self.__map.items(), self.di)
+        self.__documents.save(DocumentStore.store_filename(filename))
+        if self.__positions is not None:
+            self.write_posting_lists(self.positions_filename(filename), self.__positions.items(),
+                                     PositionalDiskInterfacer)
+        else:
+            self.remove_positions(filename)
+
+    @staticmethod
+    def positions_filename(filename):
+        """
+        :param filename: string, the path of an inverted file
+        :return: string, the path of the inverted file holding its positional posting lists (PositionalDiskInterfacer)
+        """
+        return filename + '.pos'
+
+    @classmethod
+    def remove_positions(cls, filename):
+        """
+        Remove the positional posting lists of an inverted file and their dictionary, if any
+        :param filename: string, the path of an inverted file
+        :return: None
+        """
+        positions_filename = cls.positions_filename(filename)
+        for path in (positions_filename, TermDictionary.dictionary_filename(positions_filename)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        TermDictionary.evict(positions_filename)
 
-    def read_posting_lists(self, keys, filename):
+    @classmethod
+    def sidecar_filenames(cls, filename):
+        """
+        :param filename: string, the path of an inverted file
+        :return: list of string, the paths of the files saved along with it : its TermDictionary, its DocumentStore,
+                 its DocIdMap (SmartDiskInterfacer), its positions and their TermDictionary. They may not exist.
+        """
+        positions_filename = cls.positions_filename(filename)
+        return [TermDictionary.dictionary_filename(filename), DocumentStore.store_filename(filename),
+                DocIdMap.map_filename(filename), positions_filename, TermDictionary.dictionary_filename(positions_filename)]
+
+    @classmethod
+    def remove_inverted_file(cls, filename):
+        """
+        Remove an inverted file along with the files saved with it (see sidecar_filenames), if they exist, and forget
+        their term dictionaries kept in memory (see TermDictionary.open)
+        :param filename: string, the path of an inverted file
+        :return: None
+        """
+        for path in [filename] + cls.sidecar_filenames(filename):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        TermDictionary.evict(filename)
+        TermDictionary.evict(cls.positions_filename(filename))
+
+    @classmethod
+    def write_posting_lists(cls, filename, posting_lists, interfacer=ndi):
+        """
+        Write an inverted file and its TermDictionary, streaming the posting lists through a buffered writer.
+        The memory taken does not grow with the number of posting lists, but it does with the number of documents :
+        their lengths are kept during the whole write (see __write_posting_lists).
+        The inverted file is written in a temporary file renamed once complete, and the former TermDictionary is
+        removed before the rename, so that a crash never leaves a truncated file nor a dictionary describing
+        another file. The state the interfacer needs to decode the file (the DocIdMap of a SmartDiskInterfacer) is
+        saved before the rename too.
+        :param filename: string, the path of the inverted file to be saved on disc
+        :param posting_lists: iterable of tuples (key, posting_list), sorted by key, where posting_list is a list of
+                              tuples (doc_id, score)
+        :param interfacer: the disk interfacer used to encode the posting lists
+        :return: None
+        """
+        with atomic_write(filename) as f:
+            dictionary = cls.__write_posting_lists(f, posting_lists, interfacer)
+            try:
+                os.remove(TermDictionary.dictionary_filename(filename))
+            except OSError:
+                pass
+            save_interfacer_state(interfacer, filename)
+        dictionary.save(filename)
+
+    @classmethod
+    def __write_posting_lists(cls, file, posting_lists, interfacer):
+        """
+        Encode and write posting lists one by one in a binary file.
+        The document lengths (DOCUMENT_LENGTH_KEY sorts before any word) are kept while writing, so that the highest
+        score and the shortest document of each posting list can be registered in the dictionary, for ranking pruning.
+        This is the only part of the write which is not streamed : the bounds need the length of the document of any
+        posting, so a dictionary of one entry per document (about 200 bytes each, with its doc_id) is held until the
+        last posting list is written.
+        :param file: File, the binary file to write in, at its beginning
+        :param posting_lists: iterable of tuples (key, posting_list), sorted by key
+        :param interfacer: the disk interfacer used to encode the posting lists
+        :return: TermDictionary, the dictionary of the written posting lists
+        """
+        dictionary = TermDictionary()
+        position = 0
+        lengths = {}
+        encode_time = 0.
+        write_time = 0.
+        for (key, posting_list) in posting_lists:
+            if key == DOCUMENT_LENGTH_KEY:
+                lengths = dict(posting_list)
+            start_time = time.perf_counter()
+            encoded = cls.__encode_and_register(key, posting_list, interfacer, position, dictionary, lengths)
+            encoded_time = time.perf_counter()
+            file.write(encoded)
+            encode_time += encoded_time - start_time
+            write_time += time.perf_counter() - encoded_time
+            position += len(encoded)
+        metrics.add_time('disk_interfacer.encode', encode_time, len(dictionary))
+        metrics.add_time('inverted_file.write', write_time, len(dictionary))
+        metrics.count('posting_lists_written', len(dictionary))
+        metrics.count('bytes_written', position)
+        return dictionary
+
+    def read_posting_lists(self, keys, filename, cache=None):
         """
         Read and decode the posting lists correspoself.ding to their associated keys given in parameters, from a given file.
         Load them into the current object.
+        If the file has a TermDictionary, only the wanted posting lists are read, otherwise the whole file is scanned.
         :param keys: list of string, represents the posting lists that need to be decoded
         :param filename: string, the name of the file to read on disc
+        :param cache: PostingListCache, where the posting lists read through the TermDictionary are looked for first,
+                      and remembered. Default is None
         :return: None
         """
+        interfacer = interfacer_for_file(self.di, filename)
+        dictionary = TermDictionary.open(filename) if keys is not None else None
+        if dictionary is not None:
+            signature = cache.file_signature(filename) if cache is not None else None
+            with open(filename, 'rb') as f:
+                for key in sorted(set(keys)):
+                    entry = dictionary.lookup(key)
+                    if entry is None:
+                        continue
+                    cached = cache.get(filename, signature, key) if cache is not None else None
+                    if cached is not None:
+                        # the cached list is shared, the map gets its own copy
+                        self.__map[key] = list(cached)
+                        continue
+                    offset, list_len = entry[1:3]
+                    f.seek(offset)
+                    with metrics.timer('disk_interfacer.decode'):
+                        posting_list = interfacer.decode_list(f.read(list_len))
+                    metrics.count('bytes_read', list_len)
+                    if cache is not None:
+                        cache.put(filename, signature, key, list(posting_list))
+                    self.__map[key] = posting_list
+            return
+
         with open(filename, 'rb') as f:
 
             while True:
@@ -133,7 +323,9 @@ class InvertedFile(object):
                     break
                 # if key is one of the wanted keys
                 if keys is None or key in keys:
-                    posting_list = self.di.decode_list(f.read(list_len))
+                    with metrics.timer('disk_interfacer.decode'):
+                        posting_list = interfacer.decode_list(f.read(list_len))
+                    metrics.count('bytes_read', list_len)
                     self.__map[key] = posting_list
                 else:
                     f.seek(list_len, 1)
@@ -143,8 +335,13 @@ class InvertedFile(object):
         """
         Read a binary file and extract only the keys, skipping the reading of their associated posting lists
         :param filename: string, the path of the inverted file to be read on disc
-        :return: list of string, where each element is the representation of a keyword
+        :return: list of tuples (key, position), where key is the representation of a keyword and position
+                 the position of its record in the file
         """
+        dictionary = TermDictionary.open(filename)
+        if dictionary is not None:
+            return [(key, entry[0]) for (key, entry) in dictionary.items()]
+
         output = []
         with open(filename, 'rb') as f:
 
@@ -198,9 +395,71 @@ class InvertedFile(object):
                 - score : integer, the score of this message relative to the keyword of this posting list
         """
         key, list_len = cls.__read_key_and_list_len(file, interfacer)
+        if key is None:
+            return None, None
         posting_list = interfacer.decode_list(file.read(list_len))
         return key, posting_list
 
+    @classmethod
+    def __encode_and_register(cls, key, posting_list, interfacer, position, dictionary, lengths):
+        """
+        Encode a posting list and register its location, score bounds and blocks in a TermDictionary
+        :param key: string, the key word associated with the posting list
+        :param posting_list: list, a list of tuples (doc_id, score)
+        :param interfacer: the disk interfacer used to encode the posting list
+        :param position: integer, the position in the file where the encoded posting list will be written
+        :param dictionary: TermDictionary, the dictionary of the file
+        :param lengths: dictionary (doc_id: integer), the length of the documents of the file
+        :return: bytearray, the encoded posting list
+        """
+        encoded = interfacer.encode_posting_list(key, posting_list)
+        header_len = interfacer.key_len_len + len(key.encode('utf-8')) + interfacer.list_len_len
+        max_score, min_length = cls.__score_bounds(key, posting_list, lengths)
+        skips = b''
+        block_bounds = None
+        if hasattr(interfacer, 'posting_len') and len(posting_list) > TermDictionary.block_size:
+            # first doc_id and score bounds of each block, so that a reader can decode only the block holding the doc_id
+            # it looks for, and the ranking can skip the blocks which can not hold a good enough document
+            starts = range(0, len(posting_list), TermDictionary.block_size)
+            skips = b''.join(TermDictionary.skip_doc_id_bytes(posting_list[start][0]) for start in starts)
+            if max_score:
+                block_bounds = [cls.__block_bounds(posting_list[start:start + TermDictionary.block_size], lengths)
+                                for start in starts]
+        dictionary.add(key, position, position + header_len, len(encoded) - header_len, len(posting_list),
+                       max_score, min_length, skips, block_bounds)
+        return encoded
+
+    @staticmethod
+    def __score_bounds(key, postings, lengths):
+        """
+        :param key: string, the key word associated with the postings
+        :param postings: list, a list of tuples (doc_id, score), not empty
+        :param lengths: dictionary (doc_id: integer), the length of the documents of the file
+        :return: tuple (max_score, min_length), the highest score of the postings and the length of their shortest
+                 document, (0, 0) if they are unknown
+        """
+        if key == DOCUMENT_LENGTH_KEY or not postings or not lengths:
+            return 0, 0
+        max_score = int(math.ceil(max(score for (_, score) in postings)))
+        # a document without a known length, or a score which does not fit in the dictionary, makes the bound unknown
+        min_length = min(lengths.get(doc_id, 0) for (doc_id, _) in postings)
+        if min_length == 0 or not 0 < max_score <= TermDictionary.max_bound:
+            return 0, 0
+        return max_score, min_length
+
+    @staticmethod
+    def __block_bounds(postings, lengths):
+        """
+        :param postings: list, the tuples (doc_id, score) of a block, whose documents all have a known length
+        :param lengths: dictionary (doc_id: integer), the length of the documents of the file
+        :return: tuple (max_score, min_length_per_score), see TermDictionary.block_bounds
+        """
+        max_score = int(math.ceil(max(score for (_, score) in postings)))
+        min_length_per_score = min(lengths[doc_id] / score if score > 0 else math.inf for (doc_id, score) in postings)
+        # rounded down, and capped : a lower ratio only gives a higher bound
+        return max_score, int(min(min_length_per_score * TermDictionary.length_per_score_scale,
+                                  TermDictionary.max_bound))
+
 # ---------------------------------------------------------------------------------------------------------------------#
 # --------------------------------------------------MERGE INVERTED FILES-----------------------------------------------#
 # ---------------------------------------------------------------------------------------------------------------------#
@@ -208,56 +467,171 @@ class InvertedFile(object):
     @classmethod
     def merge_inverted_files(cls, filename_merge, filename_if1, filename_if2, disc_interfacer):
         """
-        Merge two inverted files saved on disc into one.
+        Merge two inverted files saved on disc into one (see merge_many_inverted_files).
         :param filename_merge: string, the path to the newly created inverted file
         :param filename_if1: string, the path to the first inverted file to merge
         :param filename_if2: string, the path to the second inverted file to merge
-        :param disc_interfacer: class, one of NaiveDiscInterfacer and SmartDiscInterfacer, explain the way if1 and if2 are encoded
+        :param disc_interfacer: class, one of NaiveDiskInterfacer, StructDiskInterfacer or a SmartDiskInterfacer instance,
+                                explain the way if1 and if2 are encoded
+        :return: None
+        """
+        cls.merge_many_inverted_files(filename_merge, [filename_if1, filename_if2], disc_interfacer)
+
+    @classmethod
+    def merge_many_inverted_files(cls, filename_merge, filenames, disc_interfacer):
+        """
+        Merge any number of inverted files saved on disc into one, in a single streaming pass : the next key of each file
+        is kept in a heap, and only the current posting list of each file is held in memory, along with the lengths of
+        all the documents (see __write_posting_lists).
+        Merged posting lists are sorted by doc_id, and a doc_id found in several files is only kept once, with the score
+        of the last file containing it in filenames. As doc_ids are generated each time a message is indexed, this only
+        happens for files sharing documents (such as a file and a copy of it) : a message indexed twice has two
+        doc_ids, and is kept twice.
+        If every file has a DocumentStore, or positional posting lists (see positions_filename), they are merged the
+        same way.
+        :param filename_merge: string, the path to the newly created inverted file
+        :param filenames: list of string, the paths to the inverted files to merge
+        :param disc_interfacer: class, one of NaiveDiskInterfacer, StructDiskInterfacer or a SmartDiskInterfacer instance,
+                                explain the way the inverted files are encoded
         :return: None
         """
+        with contextlib.ExitStack() as stack, metrics.timer('inverted_file.merge'):
+            files = [stack.enter_context(open(filename, 'rb', buffering=READ_BUFFER_SIZE)) for filename in filenames]
+            interfacers = [interfacer_for_file(disc_interfacer, filename) for filename in filenames]
+            cls.write_posting_lists(filename_merge, cls.__merge_posting_lists(files, interfacers), disc_interfacer)
+
+        store_filenames = [DocumentStore.store_filename(filename) for filename in filenames]
+        if filenames and all(os.path.exists(filename) for filename in store_filenames):
+            DocumentStore.merge(DocumentStore.store_filename(filename_merge), store_filenames)
+        elif os.path.exists(DocumentStore.store_filename(filename_merge)):
+            os.remove(DocumentStore.store_filename(filename_merge))
+
+        positions_filenames = [cls.positions_filename(filename) for filename in filenames]
+        if not filenames or not all(os.path.exists(filename) for filename in positions_filenames):
+            cls.remove_positions(filename_merge)
+            return
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(open(filename, 'rb', buffering=READ_BUFFER_SIZE))
+                     for filename in positions_filenames]
+            cls.write_posting_lists(cls.positions_filename(filename_merge),
+                                    cls.__merge_posting_lists(files, [PositionalDiskInterfacer] * len(files)),
+                                    PositionalDiskInterfacer)
+
+    @classmethod
+    def __merge_posting_lists(cls, files, interfacers):
+        """
+        Generator, read inverted files key by key and yield their merged posting lists, sorted by key
+        :param files: list of File, the inverted files, from the oldest to the newest
+        :param interfacers: list of disk interfacers, the one decoding each file (see interfacer_for_file)
+        :return: yield tuples (key, posting_list)
+        """
+        heap = []
+        for (index, file) in enumerate(files):
+            key, posting_list = cls.__read_key_and_posting_list(file, interfacers[index])
+            if key is not None:
+                heap.append((key, index, posting_list))
+        heapq.heapify(heap)
+
+        while heap:
+            key = heap[0][0]
+            posting_lists = []
+            while heap and heap[0][0] == key:
+                _, index, posting_list = heapq.heappop(heap)
+                posting_lists.append((index, posting_list))
+                next_key, next_posting_list = cls.__read_key_and_posting_list(files[index], interfacers[index])
+                if next_key is not None:
+                    heapq.heappush(heap, (next_key, index, next_posting_list))
+
+            if len(posting_lists) == 1:
+                yield key, posting_lists[0][1]
+            else:
+                yield key, cls.__merge_postings(posting_lists)
+
+    @staticmethod
+    def __merge_postings(posting_lists):
+        """
+        Merge the posting lists of a same key coming from several files
+        :param posting_lists: list of tuples (index, posting_list), index being the rank of the file the list comes from
+        :return: list of tuples (doc_id, score), sorted by doc_id, without duplicated doc_id
+        """
+        for (_, posting_list) in posting_lists:
+            # linear for lists already sorted, which is the case unless the interfacer orders them its own way
+            posting_list.sort()
+        merged = heapq.merge(*[[(doc_id, index, score) for (doc_id, score) in posting_list]
+                               for (index, posting_list) in posting_lists])
+        output = []
+        for (doc_id, _, score) in merged:
+            if output and output[-1][0] == doc_id:
+                # same doc_id in a later file : keep its score
+                output[-1] = (doc_id, score)
+            else:
+                output.append((doc_id, score))
+        return output
+
+
+def document_postings(document, score_function, score_uses_frequencies=False, positional=False):
+    """
+    Compute what a message adds to an index, the same way for InvertedFile and InvertedFileBuilder : each distinct
+    token is counted and scored once, and the length of the message is given under DOCUMENT_LENGTH_KEY
+    :param document: IEMessage, the message to index
+    :param score_function: see InvertedFile
+    :param score_uses_frequencies: boolean, whether score_function accepts the term_frequencies parameter (see
+                                   score.accepts_term_frequencies). Default is False
+    :param positional: boolean, also give the positions of the tokens. Default is False
+    :return: tuple (postings, positions) where :
+        - postings : list of tuples (key, value), the score of each distinct token of the message, followed by
+          (DOCUMENT_LENGTH_KEY, length)
+        - positions : list of tuples (token, positions), the ascending positions of each distinct token in the message
+          (see token_positions), None if positional is False
+    """
+    start_time = time.perf_counter()
+    term_frequencies = Counter(document.text)
+    if score_uses_frequencies:
+        postings = [(token, score_function(token, document, term_frequencies=term_frequencies))
+                    for token in term_frequencies]
+    else:
+        postings = [(token, score_function(token, document)) for token in term_frequencies]
+    metrics.count('postings', len(postings))
+    postings.append((DOCUMENT_LENGTH_KEY, document.length))
+    positions = list(token_positions(document.text).items()) if positional else None
+    metrics.add_time('inverted_file.score', time.perf_counter() - start_time)
+    return postings, positions
+
+
+def token_positions(tokens):
+    """
+    :param tokens: list of string, the text of a document
+    :return: dictionary (token: tuple of integers), the ascending positions of each token in the list
+    """
+    positions = {}
+    for (position, token) in enumerate(tokens):
+        positions.setdefault(token, []).append(position)
+    return {token: tuple(token_positions) for (token, token_positions) in positions.items()}
+
 
-        with open(filename_merge, 'wb+') as output:
-            with open(filename_if1, 'rb') as if1:
-                with open(filename_if2, 'rb') as if2:
-                    key_if1, pl_if1 = cls.__read_key_and_posting_list(if1)
-                    key_if2, pl_if2 = cls.__read_key_and_posting_list(if2)
-                    while True:
-
-                        if key_if1 is None and key_if2 is None:
-                            break
-                        elif key_if1 is not None and (key_if2 is None or key_if1 < key_if2):
-                            posting_list = pl_if1
-                            key = key_if1
-                            key_if1, pl_if1 = cls.__read_key_and_posting_list(if1)
-                        elif key_if1 is None or key_if1 > key_if2:
-                            posting_list = pl_if2
-                            key = key_if2
-                            key_if2, pl_if2 = cls.__read_key_and_posting_list(if2)
-                        else:
-                            posting_list = pl_if1 + pl_if2
-                            key = key_if1
-                            key_if1, pl_if1 = cls.__read_key_and_posting_list(if1)
-                            key_if2, pl_if2 = cls.__read_key_and_posting_list(if2)
-                        output.write(disc_interfacer.encode_posting_list(key, posting_list))
-
-
-def generate_inverted_file(messages):
+def generate_inverted_file(messages, inverted_file_path=None, memory_budget=64 << 20, processes=1, positional=False):
+    from src_inverted_file.async_indexing import build_inverted_file_parallel
     from src_inverted_file.formatted_document import FormattedDocument
+    from src_inverted_file.inverted_file_builder import InvertedFileBuilder
     from src_inverted_file.tokenizer import Tokenizer
     import time
 
     time_output_filename = "inverted_file/time.txt"
     with open(time_output_filename, "a+") as time_output:
         time_output.write("\n\n========== Run beginning at " + str(time.time()) + "===========\n")
-        inverted_file = InvertedFile(score)
+        if inverted_file_path is None:
+            inverted_file_path = "inverted_file/inverted_file_{}.if".format(str(len(messages)))
         print("Begin to create inverted file")
         start_time = time.time()
-        fd = FormattedDocument(messages=messages, tokenizer=Tokenizer())
-        for doc in fd.matches:
-            inverted_file.add_document(doc)
-        end_time = time.time()
+        if processes > 1:
+            build_inverted_file_parallel(messages, inverted_file_path, processes=processes, positional=positional)
+            end_time = time.time()
+        else:
+            builder = InvertedFileBuilder(score, memory_budget=memory_budget, positional=positional)
+            fd = FormattedDocument(messages=messages, tokenizer=Tokenizer())
+            builder.add_documents(fd.matches)
+            end_time = time.time()
+            builder.finish(inverted_file_path)
 
         time_output.write("number of messages : " + str(len(messages)) + ", time : " + str(end_time - start_time) + "\n")
-        inverted_file_path = "inverted_file/inverted_file_{}.if".format(str(len(messages)))
-        inverted_file.save(inverted_file_path)
         return inverted_file_path
@@ -0,0 +1,203 @@
+# inverted_file_builder.py Bulk construction of an inverted file with a bounded memory
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import time
+
+from src_inverted_file.document_store import DocumentStore, DocumentStoreWriter
+from src_inverted_file.inverted_file import InvertedFile, document_postings
+from src_inverted_file.metrics import metrics
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer as ndi
+from src_inverted_file.positional_disk_interfacer import PositionalDiskInterfacer
+from src_inverted_file.score import accepts_term_frequencies
+
+
+class InvertedFileBuilder(object):
+    """
+    Class made to index a large number of messages in a single pass (SPIMI : Single-Pass In-Memory Indexing).
+    Postings are appended to plain lists instead of being inserted in SortedList, each posting list is sorted once
+    when the run is flushed, and a sorted run is spilled to the disc each time the memory budget is reached.
+    The runs are finally merged into a single inverted file, in one pass, with InvertedFile.merge_many_inverted_files,
+    which holds the lengths of all the documents besides the current posting list of each run.
+    Initialize :
+        - score_function : see InvertedFile
+        - disk_interfacer : the disk interfacer used to encode the runs and the final inverted file.
+          Default is NaiveDiskInterfacer
+        - memory_budget : integer, the approximate number of bytes the postings in memory may take before a run is spilled.
+          Default is 64 MiB
+        - run_directory : string, the directory where the runs are written. Default is a temporary directory
+        - positional : boolean, also index the positions of the words (see InvertedFile). Default is False
+
+    Attributes :
+        - __postings : dictionary (key: string, value: list), the postings of the current run, in order of addition
+        - __positions : dictionary (key: string, value: list), the positional postings of the current run, None if the
+          index is not positional
+        - __documents : DocumentStoreWriter, the metadata of the documents of the current run
+        - __memory_used : integer, estimation of the size (in bytes) of __postings
+        - __runs : list of string, the paths of the runs already spilled to the disc
+    """
+
+    # rough size of a posting (a list slot and a tuple (doc_id, score)) and of a new key in CPython, in bytes
+    posting_cost = 72
+    key_cost = 160
+    # additional size of a position (an integer in a tuple)
+    position_cost = 36
+    # size of a document in the columns of a DocumentStoreWriter, without its links
+    document_cost = 40
+
+    def __init__(self, score_function, disk_interfacer=ndi, memory_budget=64 << 20, run_directory=None,
+                 positional=False):
+        self.__score_function = score_function
+        self.__score_uses_frequencies = accepts_term_frequencies(score_function)
+        self.di = disk_interfacer
+        self.memory_budget = memory_budget
+        self.__run_directory = run_directory
+        self.__own_run_directory = False
+
+        self.__postings = {}
+        self.__positions = {} if positional else None
+        self.__documents = DocumentStoreWriter()
+        self.__memory_used = 0
+        self.__runs = []
+
+    @property
+    def runs(self):
+        """
+        :return: list of string, the paths of the runs spilled to the disc so far
+        """
+        return list(self.__runs)
+
+    def add_document(self, document):
+        """
+        Add a message to the current run, spilling the run to the disc if the memory budget is reached
+        :param document : IEMessage, see InvertedFile.add_document
+        :return: None
+        """
+        (postings, positions) = document_postings(document, self.__score_function, self.__score_uses_frequencies,
+                                                  self.__positions is not None)
+        start_time = time.perf_counter()
+        for (key, value) in postings:
+            posting_list = self.__postings.get(key)
+            if posting_list is None:
+                posting_list = self.__postings[key] = []
+                self.__memory_used += self.key_cost + len(key)
+            posting_list.append((document.id, value))
+        self.__documents.add_document(document)
+        self.__memory_used += self.posting_cost * len(postings) + self.document_cost
+        self.__memory_used += sum(len(link) for link in document.links)
+
+        if positions is not None:
+            for (token, occurrences) in positions:
+                posting_list = self.__positions.get(token)
+                if posting_list is None:
+                    posting_list = self.__positions[token] = []
+                    self.__memory_used += self.key_cost + len(token)
+                posting_list.append((document.id, occurrences))
+            self.__memory_used += self.posting_cost * len(positions) + self.position_cost * len(document.text)
+        metrics.add_time('inverted_file.insert', time.perf_counter() - start_time)
+
+        if self.__memory_used >= self.memory_budget:
+            self.flush()
+
+    def add_documents(self, documents):
+        """
+        :param documents: iterable of IEMessage
+        :return: None
+        """
+        for document in documents:
+            self.add_document(document)
+
+    def flush(self):
+        """
+        Sort the current run and spill it to the disc
+        :return: string, the path of the run, or None if the current run is empty
+        """
+        if not self.__postings:
+            return None
+        run_filename = os.path.join(self.__get_run_directory(), 'run_{}.if'.format(len(self.__runs)))
+        self.__write_run(run_filename)
+        self.__runs.append(run_filename)
+        return run_filename
+
+    def finish(self, filename):
+        """
+        Write the inverted file of all the added messages, merging the runs if some were spilled, then remove the runs.
+        The builder is empty afterwards.
+        :param filename: string, the path of the inverted file to be saved on disc
+        :return: string, filename
+        """
+        if not self.__runs:
+            self.__write_run(filename)
+            return filename
+
+        self.flush()
+        try:
+            InvertedFile.merge_many_inverted_files(filename, self.__runs, self.di)
+        finally:
+            self.__remove_runs()
+        return filename
+
+    def __write_run(self, filename):
+        """
+        Write the current run as an inverted file, with its DocumentStore (and its positions if the index is
+        positional), then empty it
+        :param filename: string, the path of the inverted file
+        :return: None
+        """
+        metrics.count('runs_written')
+        InvertedFile.write_posting_lists(filename, self.__sorted_postings(self.__postings), self.di)
+        self.__documents.save(DocumentStore.store_filename(filename))
+        self.__documents = DocumentStoreWriter()
+        if self.__positions is not None:
+            InvertedFile.write_posting_lists(InvertedFile.positions_filename(filename),
+                                             self.__sorted_postings(self.__positions), PositionalDiskInterfacer)
+            self.__positions = {}
+        else:
+            InvertedFile.remove_positions(filename)
+        self.__postings = {}
+        self.__memory_used = 0
+
+    @staticmethod
+    def __sorted_postings(postings):
+        """
+        Generator, sort the keys and each posting list of a run
+        :param postings: dictionary (key: string, value: list), the postings of a run
+        :return: yield tuples (key, posting_list)
+        """
+        for key in sorted(postings):
+            posting_list = postings[key]
+            with metrics.timer('inverted_file_builder.sort'):
+                posting_list.sort()
+            yield key, posting_list
+
+    def __get_run_directory(self):
+        if self.__run_directory is None:
+            self.__run_directory = tempfile.mkdtemp(prefix='inverted_file_runs_')
+            self.__own_run_directory = True
+        return self.__run_directory
+
+    def __remove_runs(self):
+        for run in self.__runs:
+            InvertedFile.remove_inverted_file(run)
+        self.__runs = []
+        if self.__own_run_directory:
+            shutil.rmtree(self.__run_directory, ignore_errors=True)
+            self.__run_directory = None
+            self.__own_run_directory = False
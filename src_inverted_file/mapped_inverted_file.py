@@ -0,0 +1,252 @@
+# mapped_inverted_file.py A read-only, memory-mapped view of an inverted file saved on disc
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import bisect
+import mmap
+import os
+
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer as ndi
+from src_inverted_file.smart_disk_interfacer import interfacer_for_file
+from src_inverted_file.term_dictionary import TermDictionary
+
+
+class LazyPostingList(object):
+    """
+    Class made to represent an encoded posting list which is only decoded when iterated.
+    If the first doc_id of each block of postings is known (see TermDictionary.skips), looking for some documents
+    with find only decodes the blocks which may hold them.
+    Initialize :
+        - bin_list : memoryview, the binary representation of the posting list (a slice of the mapped file, no copy)
+        - interfacer : the disk interfacer used to decode the posting list
+        - doc_freq : integer, the number of documents of the posting list if it is known, None otherwise
+        - skips : list of bytes, the first doc_id of each block of TermDictionary.block_size postings (see
+          TermDictionary.skip_doc_id_bytes). Default is none, the posting list is then a single block
+        - block_bounds : list of tuples (max_score, min_length), the score bounds of each block (see
+          TermDictionary.block_bounds). Default is none (unknown)
+
+    Attributes :
+        - raw : memoryview, the binary representation of the posting list
+        - doc_freq : integer or None, the number of documents of the posting list
+        - skips : list of bytes, the first doc_id of each block
+        - block_bounds : list of tuples (max_score, min_length), the score bounds of each block, empty if unknown
+    """
+
+    def __init__(self, bin_list, interfacer, doc_freq=None, skips=None, block_bounds=None):
+        self.raw = bin_list
+        self.doc_freq = doc_freq
+        self.skips = skips if skips else []
+        self.block_bounds = block_bounds if block_bounds else []
+        self.__interfacer = interfacer
+
+    def __iter__(self):
+        return iter(self.decode())
+
+    def decode(self):
+        """
+        Decode the posting list. Nothing is cached, each call decodes it again.
+        :return: list, a list of tuples (doc_id, score)
+        """
+        return self.__interfacer.decode_list(self.raw)
+
+    @property
+    def nb_blocks(self):
+        """
+        :return: integer, the number of blocks which can be decoded separately
+        """
+        return max(1, len(self.skips))
+
+    def decode_block(self, index):
+        """
+        :param index: integer, the number of a block, lower than nb_blocks
+        :return: list, the tuples (doc_id, score) of the block, sorted by doc_id
+        """
+        if not self.skips:
+            return self.decode()
+        block_len = TermDictionary.block_size * self.__interfacer.posting_len
+        return self.__interfacer.decode_list(self.raw[index * block_len:(index + 1) * block_len])
+
+    def find(self, doc_ids):
+        """
+        Get the postings of some documents, decoding each block which may hold one of them at most once
+        :param doc_ids: list of doc_id, sorted
+        :return: list, the tuples (doc_id, score) of the documents found in the posting list, sorted by doc_id
+        """
+        output = []
+        block = []
+        block_index = -1
+        cursor = 0
+        for doc_id in doc_ids:
+            if self.skips:
+                index = bisect.bisect_right(self.skips, TermDictionary.skip_doc_id_bytes(doc_id),
+                                            max(block_index, 0)) - 1
+                if index < 0:
+                    continue
+            else:
+                index = 0
+            if index != block_index:
+                block = self.decode_block(index)
+                block_index = index
+                cursor = 0
+            cursor = bisect.bisect_left(block, (doc_id,), cursor)
+            if cursor < len(block) and block[cursor][0] == doc_id:
+                output.append(block[cursor])
+        return output
+
+
+class MappedInvertedFile(object):
+    """
+    Class made to query an inverted file saved on disc without loading it. The file is memory-mapped read-only, so that
+    several processes reading the same index share it in the page cache, and a posting list is only decoded when asked.
+    The posting lists are located with the TermDictionary of the file if there is one, otherwise with a single scan
+    of the keys on opening.
+    A MappedInvertedFile must be closed (or used as a context manager). The LazyPostingList it returned keep the mapping
+    alive : if some are still referenced on closing, the file is unmapped once the last of them is released.
+    Initialize :
+        - filename : string, the path of the inverted file to map
+        - disk_interfacer : the disk interfacer the inverted file was saved with. Default is NaiveDiskInterfacer
+
+    Attributes :
+        - filename : string, the path of the inverted file
+        - di : the disk interfacer used to decode the file (see interfacer_for_file)
+        - signature : tuple (mtime, size) of the mapped file, see PostingListCache.file_signature
+        - __map : mmap.mmap, the mapped file (None for an empty file)
+        - __view : memoryview, a view on the whole mapped file
+        - __dictionary : TermDictionary, the location of each posting list in the file
+    """
+
+    def __init__(self, filename, disk_interfacer=ndi):
+        self.filename = filename
+        self.di = interfacer_for_file(disk_interfacer, filename)
+
+        with open(filename, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.signature = (stat.st_mtime_ns, stat.st_size)
+            try:
+                self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file can not be mapped
+                self.__map = None
+        self.__view = memoryview(self.__map) if self.__map is not None else memoryview(b'')
+
+        self.__dictionary = TermDictionary.open(filename)
+        if self.__dictionary is None:
+            self.__dictionary = self.__scan_keys()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.__dictionary)
+
+    def __contains__(self, key):
+        return key in self.__dictionary
+
+    def __getitem__(self, key):
+        posting_list = self.posting_list(key)
+        if posting_list is None:
+            raise KeyError(key)
+        return posting_list
+
+    def close(self):
+        """
+        Unmap the file, or let the garbage collector unmap it once the LazyPostingList previously returned are released
+        (their slices of the map can not be released from here)
+        :return: None
+        """
+        self.__view.release()
+        self.__view = memoryview(b'')
+        if self.__map is not None:
+            try:
+                self.__map.close()
+            except BufferError:
+                # slices of the map are still exported, the map is closed when the last of them is released
+                pass
+            self.__map = None
+
+    def keys(self):
+        """
+        :return: list of string, the keys of the inverted file, sorted
+        """
+        return self.__dictionary.keys()
+
+    def doc_freq(self, key):
+        """
+        :param key: string, a key word
+        :return: integer, the number of documents containing the key (0 if the key is unknown,
+                 or if the file has no TermDictionary)
+        """
+        return self.__dictionary.doc_freq(key)
+
+    def score_bounds(self, key):
+        """
+        :param key: string, a key word
+        :return: tuple (max_score, min_length), the highest score of the posting list of the key and the length of its
+                 shortest document, or None if they are unknown
+        """
+        return self.__dictionary.score_bounds(key)
+
+    def posting_list(self, key):
+        """
+        Get the posting list of a key, without decoding it nor copying it
+        :param key: string, a key word
+        :return: LazyPostingList, or None if the key is not in the inverted file
+        """
+        entry = self.__dictionary.lookup(key)
+        if entry is None:
+            return None
+        offset, list_len, doc_freq = entry[1:4]
+        # a posting list is never empty, a null doc_freq means that it is unknown
+        return LazyPostingList(self.__view[offset:offset + list_len], self.di, doc_freq or None,
+                               self.__dictionary.skips(key), self.__dictionary.block_bounds(key))
+
+    def posting_lists(self, keys):
+        """
+        :param keys: list of string, the key words wanted
+        :return: dictionary (key: LazyPostingList), only for the keys found in the inverted file
+        """
+        output = {}
+        for key in keys:
+            posting_list = self.posting_list(key)
+            if posting_list is not None:
+                output[key] = posting_list
+        return output
+
+    def __scan_keys(self):
+        """
+        Build the TermDictionary of a file which has none, by reading the header of each posting list.
+        The document frequencies are unknown and set to 0.
+        :return: TermDictionary
+        """
+        dictionary = TermDictionary()
+        view = self.__view
+        key_len_len = self.di.key_len_len
+        list_len_len = self.di.list_len_len
+        position = 0
+        while position + key_len_len <= len(view):
+            key_len = self.di.decode_number(view[position:position + key_len_len])
+            cursor = position + key_len_len
+            key = bytes(view[cursor:cursor + key_len]).decode('utf-8')
+            cursor += key_len
+            list_len = self.di.decode_number(view[cursor:cursor + list_len_len])
+            cursor += list_len_len
+            dictionary.add(key, position, cursor, list_len, 0)
+            position = cursor + list_len
+        return dictionary
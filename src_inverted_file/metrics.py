@@ -0,0 +1,233 @@
+# metrics.py Named timers and counters of the indexing pipeline, and a profiling mode
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from collections import Counter
+
+from src_inverted_file.atomic_file import atomic_write
+
+
+class Metrics(object):
+    """
+    Class made to know where the time of the indexing goes : named timers (total time and number of calls) and named
+    counters (tokens, postings, bytes written, cache hits...) are updated by the stages of the pipeline.
+    It is cheap enough to stay enabled : stages are timed per message or per posting list, never per token.
+    The module attribute metrics is the instance of the current process (see measured_call for the worker processes).
+    Initialize :
+        - enabled : boolean, whether the timers and counters are updated. Default is True
+
+    Attributes :
+        - enabled : boolean, whether the timers and counters are updated
+        - counters : Counter (name: integer)
+        - timers : dictionary (name: [seconds, calls]), the total time spent in each timer and how many times it ran
+        - gauges : dictionary (name: value), values which are set rather than added, such as a hit rate
+        - started : float, when the metrics were last reset (time.time())
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.counters = Counter()
+        self.timers = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def count(self, name, value=1):
+        """
+        :param name: string, the name of a counter
+        :param value: integer, what to add to the counter. Default is 1
+        :return: None
+        """
+        if self.enabled:
+            self.counters[name] += value
+
+    def add_time(self, name, seconds, calls=1):
+        """
+        Add a measured duration to a timer, for the hot loops where a context manager would cost too much
+        :param name: string, the name of the timer
+        :param seconds: float, the time to add
+        :param calls: integer, the number of calls it stands for. Default is 1
+        :return: None
+        """
+        if not self.enabled:
+            return
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [seconds, calls]
+        else:
+            timer[0] += seconds
+            timer[1] += calls
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Context manager timing its block
+        :param name: string, the name of the timer
+        :return: yield None
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start_time)
+
+    def set(self, name, value):
+        """
+        :param name: string, the name of a gauge
+        :param value: number, its current value
+        :return: None
+        """
+        self.gauges[name] = value
+
+    def reset(self):
+        """
+        Forget every timer, counter and gauge
+        :return: None
+        """
+        self.counters.clear()
+        self.timers.clear()
+        self.gauges.clear()
+        self.started = time.time()
+
+    def snapshot(self):
+        """
+        :return: dictionary, a picklable copy of the timers and counters
+        """
+        return {'counters': dict(self.counters),
+                'timers': {name: tuple(timer) for (name, timer) in self.timers.items()}}
+
+    def difference(self, before):
+        """
+        :param before: dictionary, an earlier snapshot
+        :return: dictionary, a snapshot of what was added since before
+        """
+        counters = {name: value - before['counters'].get(name, 0) for (name, value) in self.counters.items()}
+        timers = {}
+        for (name, (seconds, calls)) in self.timers.items():
+            (seconds_before, calls_before) = before['timers'].get(name, (0., 0))
+            if calls != calls_before:
+                timers[name] = (seconds - seconds_before, calls - calls_before)
+        return {'counters': {name: value for (name, value) in counters.items() if value},
+                'timers': timers}
+
+    def merge(self, snapshot):
+        """
+        Add the timers and counters of a snapshot, typically taken in another process
+        :param snapshot: dictionary, see snapshot
+        :return: None
+        """
+        for (name, value) in snapshot['counters'].items():
+            self.count(name, value)
+        for (name, (seconds, calls)) in snapshot['timers'].items():
+            self.add_time(name, seconds, calls)
+
+    def format(self):
+        """
+        :return: string, a text report of the timers (sorted by total time), the counters and the gauges
+        """
+        lines = ["metrics since {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)))]
+        if self.timers:
+            lines.append("{:<32} {:>10} {:>10} {:>12}".format("timer", "total (s)", "calls", "mean (ms)"))
+            for (name, (seconds, calls)) in sorted(self.timers.items(), key=lambda item: -item[1][0]):
+                lines.append("{:<32} {:>10.3f} {:>10} {:>12.3f}".format(name, seconds, calls,
+                                                                        seconds / calls * 1000 if calls else 0.))
+        for (name, value) in sorted(self.counters.items()):
+            lines.append("{:<32} {:>10}".format(name, value))
+        for (name, value) in sorted(self.gauges.items()):
+            lines.append("{:<32} {:>10}".format(name, "{:.3f}".format(value) if isinstance(value, float) else value))
+        return "\n".join(lines)
+
+    def dump(self, filename):
+        """
+        Write the text report (see format) to a file
+        :param filename: string, the path of the file
+        :return: None
+        """
+        with atomic_write(filename) as f:
+            f.write((self.format() + "\n").encode('utf-8'))
+
+
+# the metrics of the current process
+metrics = Metrics()
+
+
+def measured_call(function, *args):
+    """
+    Call a function and measure what it adds to the metrics. Made to be sent to an executor : the metrics of a worker
+    process are given back to the main process with merge_measured.
+    :param function: the function to call, with *args
+    :return: tuple (result, snapshot, pid), the result of the function, the metrics it added (see Metrics.difference)
+             and the process it ran in
+    """
+    before = metrics.snapshot()
+    result = function(*args)
+    return result, metrics.difference(before), os.getpid()
+
+
+def merge_measured(measured):
+    """
+    :param measured: tuple, what measured_call returned. Its metrics are added to the ones of this process, unless it
+                     ran in this process (in a thread), where they already are
+    :return: the result of the function given to measured_call
+    """
+    (result, snapshot, pid) = measured
+    if pid != os.getpid():
+        metrics.merge(snapshot)
+    return result
+
+
+@contextlib.contextmanager
+def profiled(prefix, nb_lines=40):
+    """
+    Context manager profiling its block with cProfile and tracemalloc, which slow it down a lot : it is meant for a
+    single run. Only the current thread of the current process is profiled.
+    Two files are written at the end of the block :
+        - <prefix>.prof, the cProfile stats (to be read with pstats or snakeviz)
+        - <prefix>.txt, the functions taking the most cumulated time, then the lines allocating the most memory
+    :param prefix: string, the path of the files without their extension
+    :param nb_lines: integer, the number of functions and of allocation sites in the text report. Default is 40
+    :return: yield None
+    """
+    profiler = cProfile.Profile()
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        (current, peak) = tracemalloc.get_traced_memory()
+        if not already_tracing:
+            tracemalloc.stop()
+
+        profiler.dump_stats(prefix + '.prof')
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(nb_lines)
+        report.write("\nmemory : {:.1f} MB allocated at the end, {:.1f} MB at the peak\n".format(current / 1e6,
+                                                                                              peak / 1e6))
+        for statistic in snapshot.statistics('lineno')[:nb_lines]:
+            report.write("{}\n".format(statistic))
+        with atomic_write(prefix + '.txt') as f:
+            f.write(report.getvalue().encode('utf-8'))
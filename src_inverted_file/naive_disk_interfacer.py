@@ -16,6 +16,8 @@
 # along with this program; see the file LICENSE.  If not see
 # <http://www.gnu.org/licenses/>.
 
+import uuid
+
 
 class OutOfBoundError(Exception):
     """
@@ -36,6 +38,7 @@ class NaiveDiskInterfacer(object):
         - list_len_len : integer, the max number of bytes allowed for the encoding of the size of a value associated in _map (in bytes)
           Example : if list_len_len = 4, then the maximum size of a list is pow(2, 8*4) -1 bytes
         - key_len_len : integer, the max number of bytes allowed for the encoding of the size of the key (in bytes)
+        - posting_len : integer, the number of bytes of an encoded element (doc_id, score) of a posting list
 
     """
 
@@ -45,6 +48,7 @@ class NaiveDiskInterfacer(object):
     key_len_len = 1
     doc_id_len = 16
     doc_id_len_len = 1
+    posting_len = doc_id_len_len + doc_id_len + score_len
 
     def __init__(self):
         pass
@@ -159,14 +163,14 @@ class NaiveDiskInterfacer(object):
         """
         Decode the binary representation of an element of a posting list of shape (doc_id, score)
         :param bin_message: bytearray, the binary representation of an element of a posting list, encoded as
-                            <doc_id(id_len bytes)><score(score_len bytes)>
+                            <doc_id_len(doc_id_len_len bytes)><doc_id(doc_id_len bytes)><score(score_len bytes)>
         :return: a tuple (doc_id, score) where :
-            - doc_id : integer, the unique id of a message
+            - doc_id : uuid.UUID, the unique id of a message
             - score : integer, the score of this message relative to the keyword of this posting list
         """
-        bin_doc_id = bin_message[:cls.id_len]
-        bin_score = bin_message[cls.id_len:]
-        doc_id = cls.decode_number(bin_doc_id)
+        bin_doc_id = bin_message[cls.doc_id_len_len:cls.doc_id_len_len + cls.doc_id_len]
+        bin_score = bin_message[cls.doc_id_len_len + cls.doc_id_len:]
+        doc_id = uuid.UUID(bytes=bytes(bin_doc_id))
         score = cls.decode_number(bin_score)
         return doc_id, score
 
@@ -188,14 +192,14 @@ class NaiveDiskInterfacer(object):
     def decode_list(cls, bin_list):
         """
         Decode an entire binary posting list of shape : 
-        (<doc_id(id_len bytes)><score(score_len bytes)>)*N
+        (<doc_id_len(doc_id_len_len bytes)><doc_id(doc_id_len bytes)><score(score_len bytes)>)*N
         :param bin_list: bytearray, the binary representation of a posting list
         :return: list, a list of tuples (doc_id, score) where each :
-            - doc_id : integer, the unique id of a message
+            - doc_id : uuid.UUID, the unique id of a message
             - score : integer, the score of this message relative to the keyword of this posting list
         """
         output = []
-        message_gen = cls._bin_message_regenerator(bin_list, cls.id_len + cls.score_len)
+        message_gen = cls._bin_message_regenerator(bin_list, cls.doc_id_len_len + cls.doc_id_len + cls.score_len)
         for bin_message in message_gen:
             output.append(cls._decode_message(bin_message))
 
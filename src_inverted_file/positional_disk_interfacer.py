@@ -0,0 +1,148 @@
+# positional_disk_interfacer.py Save and read the token positions of an InvertedFile in binary
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import uuid
+
+from src_inverted_file.naive_disk_interfacer import OutOfBoundError
+from src_inverted_file.smart_disk_interfacer import SmartDiskInterfacer
+
+
+class PositionalDiskInterfacer(object):
+    """
+    Empty class used as namespace for saving and reading positional posting lists, where each posting is a pair
+    (doc_id, positions) giving the positions (indexes in the list of tokens) of a word in a message.
+    They are saved in an inverted file of their own (see InvertedFile.positions_filename), in the format :
+    <key_size(key_len_len bytes)><key(key_size bytes)><list_len(list_len_len bytes)>
+    ( (<doc_id(doc_id_len bytes)><nb_positions(varint)>(<position_gap(varint)>)*nb_positions)*N )
+    where position_gap is the difference with the previous position of the posting (the first gap being the first
+    position itself). Varints are the ones of SmartDiskInterfacer.
+
+    Class Attributes :
+        - list_len_len : integer, the number of bytes used for the encoding of the size of a posting list (in bytes)
+        - key_len_len : integer, the number of bytes used for the encoding of the size of the key (in bytes)
+        - doc_id_len : integer, the number of bytes of a docid (a binary uuid)
+    """
+
+    list_len_len = 4
+    key_len_len = 1
+    doc_id_len = 16
+
+    def __init__(self):
+        pass
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------POSITIONAL ENCODING-----------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+    @classmethod
+    def _encode_list(cls, map_content):
+        """
+        Encode a list of (docid, positions) in binary, in the format :
+        <list_len(list_len_len bytes)>( (<doc_id><nb_positions(varint)>(<position_gap(varint)>)*nb_positions)*N )
+        :param map_content : list, list of tuples (docid, positions) where:
+                - docid : uuid.UUID, id of a message
+                - positions : tuple of integers, the ascending positions of a word in the message
+        :return: bytearray, the list encoded
+        """
+        encode_varint = SmartDiskInterfacer._encode_varint
+        output = bytearray()
+        for (doc_id, positions) in map_content:
+            if isinstance(doc_id, uuid.UUID):
+                output += doc_id.bytes
+            else:
+                output += SmartDiskInterfacer._encode_number(doc_id, cls.doc_id_len)
+            encode_varint(len(positions), output)
+            previous_position = 0
+            for position in positions:
+                if position < previous_position:
+                    raise OutOfBoundError('Positions are not ascending ({} < {})'.format(position, previous_position))
+                encode_varint(position - previous_position, output)
+                previous_position = position
+        return bytearray(SmartDiskInterfacer._encode_number(len(output), cls.list_len_len)) + output
+
+    @classmethod
+    def encode_posting_list(cls, key, map_content):
+        """
+        Encode a pair (key, value) in binary, in the format :
+        <key_size(key_len_len bytes)><key(key_size bytes)><list_len(list_len_len bytes)>
+        ( (<doc_id><nb_positions(varint)>(<position_gap(varint)>)*nb_positions)*N )
+        :param key : string, a word, key of the map representing the index
+        :param map_content : list, list of tuples (docid, positions), see _encode_list
+        :return: bytearray, the pair encoded
+        """
+        bin_key = key.encode('utf-8')
+        output = bytearray(SmartDiskInterfacer._encode_number(len(bin_key), cls.key_len_len))
+        output += bin_key
+        output += cls._encode_list(map_content)
+        return output
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------POSITIONAL DECODING-----------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+    @classmethod
+    def decode_number(cls, bin_number):
+        """
+        Convert a binary number into an integer
+        :param bin_number: bytes-like, binary (big endian) representation of a number
+        :return: integer, unsigned decimal representation of the input number
+        """
+        return int.from_bytes(bin_number, 'big')
+
+    @classmethod
+    def decode_list(cls, bin_list):
+        """
+        Decode an entire binary positional posting list of shape :
+        ( (<doc_id(doc_id_len bytes)><nb_positions(varint)>(<position_gap(varint)>)*nb_positions)*N )
+        :param bin_list: bytes-like, the binary representation of a posting list
+        :return: list, a list of tuples (doc_id, positions) where each :
+            - doc_id : uuid.UUID, the unique id of a message
+            - positions : tuple of integers, the ascending positions of the keyword of this posting list in the message
+        """
+        content = bytes(bin_list)
+        output = []
+        cursor = 0
+        while cursor + cls.doc_id_len <= len(content):
+            doc_id = uuid.UUID(bytes=content[cursor:cursor + cls.doc_id_len])
+            cursor += cls.doc_id_len
+            (nb_positions, cursor) = cls._decode_varint(content, cursor)
+            positions = []
+            position = 0
+            for _ in range(nb_positions):
+                (gap, cursor) = cls._decode_varint(content, cursor)
+                position += gap
+                positions.append(position)
+            output.append((doc_id, tuple(positions)))
+        return output
+
+    @staticmethod
+    def _decode_varint(content, cursor):
+        """
+        :param content: bytes, a binary buffer
+        :param cursor: integer, the position of a varint in content
+        :return: tuple (number, cursor), the decoded number and the position following the varint
+        """
+        number = 0
+        shift = 0
+        while True:
+            octet = content[cursor]
+            cursor += 1
+            number |= (octet & 0x7f) << shift
+            if not octet & 0x80:
+                return number, cursor
+            shift += 7
@@ -0,0 +1,127 @@
+# posting_list_cache.py Keep the decoded posting lists of the most queried terms in memory
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import os
+from collections import OrderedDict
+
+
+class PostingListCache(object):
+    """
+    Class made to avoid reading and decoding the posting lists of popular terms at each query.
+    It is a LRU cache bounded by an estimation of the memory taken by the decoded posting lists : once the budget is
+    exceeded, the least recently used posting lists are forgotten.
+    A posting list is cached along with the signature (modification time, size) of the inverted file it was read from,
+    so that a file replaced by a new segment or a merge never serves its former posting lists.
+    The blocks of a posting list decoded one by one by the ranking (see PostingCursor) are cached under the key
+    (key, index) of each block.
+    The cached lists are shared : they must not be modified.
+    Initialize :
+        - max_bytes : integer, the memory budget (in bytes). 0 disables the cache. Default is 32 MiB
+
+    Attributes :
+        - max_bytes : integer, the memory budget (in bytes)
+        - hits : integer, the number of posting lists found in the cache
+        - misses : integer, the number of posting lists which were not in the cache
+        - nb_bytes : integer, the estimated memory taken by the cached posting lists (in bytes)
+        - __posting_lists : OrderedDict ((filename, signature, key): (posting_list, nb_bytes)), from the least to the
+          most recently used
+    """
+
+    # rough size of a decoded posting (a list slot, a tuple, a doc_id and a score) and of a cache entry in CPython
+    posting_cost = 140
+    entry_cost = 400
+
+    def __init__(self, max_bytes=32 << 20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nb_bytes = 0
+        self.__posting_lists = OrderedDict()
+
+    def __len__(self):
+        return len(self.__posting_lists)
+
+    @staticmethod
+    def file_signature(filename):
+        """
+        :param filename: string, the path of an inverted file
+        :return: tuple (mtime, size), changing each time the file is replaced
+        """
+        stat = os.stat(filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, filename, signature, key):
+        """
+        :param filename: string, the path of the inverted file
+        :param signature: tuple, the signature of the inverted file (see file_signature)
+        :param key: string, the key of the posting list (or a tuple (key, index) for a block of it)
+        :return: list, the cached posting list, or None if it is not in the cache
+        """
+        cached = self.__posting_lists.get((filename, signature, key))
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__posting_lists.move_to_end((filename, signature, key))
+        return cached[0]
+
+    def put(self, filename, signature, key, posting_list, nb_bytes=None):
+        """
+        Remember a posting list, forgetting the least recently used ones if the budget is exceeded
+        :param filename: string, the path of the inverted file
+        :param signature: tuple, the signature of the inverted file (see file_signature)
+        :param key: string, the key of the posting list (or a tuple (key, index) for a block of it)
+        :param posting_list: list, the decoded posting list
+        :param nb_bytes: integer, the memory taken by the posting list. Default is an estimation from its length
+        :return: None
+        """
+        if nb_bytes is None:
+            nb_bytes = self.entry_cost + self.posting_cost * len(posting_list)
+        if nb_bytes > self.max_bytes:
+            return
+        self.__forget((filename, signature, key))
+        self.__posting_lists[(filename, signature, key)] = (posting_list, nb_bytes)
+        self.nb_bytes += nb_bytes
+        while self.nb_bytes > self.max_bytes:
+            (_, (_, forgotten_bytes)) = self.__posting_lists.popitem(last=False)
+            self.nb_bytes -= forgotten_bytes
+
+    def invalidate(self, filename=None):
+        """
+        Forget the posting lists of an inverted file, typically when it is removed or replaced
+        :param filename: string, the path of the inverted file. Default is None, to forget everything
+        :return: None
+        """
+        if filename is None:
+            self.__posting_lists.clear()
+            self.nb_bytes = 0
+            return
+        for cache_key in [cache_key for cache_key in self.__posting_lists if cache_key[0] == filename]:
+            self.__forget(cache_key)
+
+    def hit_rate(self):
+        """
+        :return: float, the ratio of posting lists found in the cache (0 if the cache was never used)
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def __forget(self, cache_key):
+        cached = self.__posting_lists.pop(cache_key, None)
+        if cached is not None:
+            self.nb_bytes -= cached[1]
@@ -0,0 +1,789 @@
+# query_engine.py Ranked search of messages in the inverted files of the bot
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import bisect
+import heapq
+import math
+import os
+import time
+import uuid
+from operator import attrgetter
+
+from src_inverted_file import boolean_query
+from src_inverted_file.document_store import DocumentLengths, DocumentStore
+from src_inverted_file.inverted_file import DOCUMENT_LENGTH_KEY, InvertedFile
+from src_inverted_file.mapped_inverted_file import MappedInvertedFile
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer as ndi
+from src_inverted_file.positional_disk_interfacer import PositionalDiskInterfacer
+from src_inverted_file.term_dictionary import TermDictionary
+
+
+class PostingCursor(object):
+    """
+    Class made to walk through the posting list of a term in a segment for the ranking, decoding it block by block (see
+    TermDictionary.skips) : the blocks holding only documents skipped by the ranking are never decoded.
+    Initialize :
+        - posting_list : LazyPostingList, the posting list of the term in the segment
+        - idf : float, the idf of the term in the index
+        - upper_bound : float, the highest contribution of the term to the score of a document of the posting list
+        - block_upper_bounds : list of float, the highest contribution of the term in each block of the posting list.
+          Default is none, upper_bound is then used for every block
+        - decoded : list of tuples (doc_id, term_frequency), the posting list already decoded (by a cache). Default is
+          None, the blocks are then decoded from posting_list
+        - lengths_of : function (doc_ids, start) -> (lengths, position), reading the lengths of documents of the segment
+          sorted by doc_id (see DocumentStore.lengths_of). Default is None, the lengths are then unknown
+        - cache : PostingListCache, where the decoded blocks are kept between queries (under the key (term, index) of
+          the block, or under the term for a posting list of a single block). Default is None
+        - cache_key : tuple (filename, signature, term), the posting list in the cache. Default is None
+
+    Attributes :
+        - doc_id : the doc_id of the current posting, None once the cursor is past the end of the posting list
+        - term_frequency : integer, the term frequency of the current posting
+        - idf : float, the idf of the term
+        - upper_bound : float, the highest contribution of the term to the score of a document of the posting list
+        - nb_decoded_blocks : integer, the number of blocks decoded so far
+    """
+
+    def __init__(self, posting_list, idf, upper_bound, block_upper_bounds=None, decoded=None, lengths_of=None,
+                 cache=None, cache_key=None):
+        self.idf = idf
+        self.upper_bound = upper_bound
+        self.nb_decoded_blocks = 0
+        self.doc_id = None
+        self.term_frequency = 0
+        self.__posting_list = posting_list
+        self.__decoded = decoded
+        self.__skips = posting_list.skips
+        self.__block_upper_bounds = block_upper_bounds if block_upper_bounds else [upper_bound] * len(self.__skips)
+        self.__block_index = -1
+        self.__block = []
+        self.__position = 0
+        self.__lengths_of = lengths_of
+        # the lengths of the documents of the block, read once a document of the block is scored
+        self.__block_lengths = None
+        self.__lengths_position = 0
+        self.__cache = cache
+        self.__cache_key = cache_key
+        self.__load_block(0)
+
+    def next(self):
+        """
+        Move to the next posting
+        :return: None
+        """
+        self.__position += 1
+        if self.__position < len(self.__block):
+            (self.doc_id, self.term_frequency) = self.__block[self.__position]
+        else:
+            self.__load_block(self.__block_index + 1)
+
+    def advance(self, doc_id):
+        """
+        Move to the first posting whose doc_id is not lower than a doc_id, decoding only the block which holds it
+        :param doc_id: a doc_id, or None to move past the end of the posting list
+        :return: None
+        """
+        if self.doc_id is None or (doc_id is not None and self.doc_id >= doc_id):
+            return
+        if doc_id is None:
+            self.__load_block(self.nb_blocks)
+            return
+        index = self.__block_of(doc_id)
+        if index != self.__block_index:
+            self.__load_block(index)
+        self.__position = bisect.bisect_left(self.__block, (doc_id,), self.__position)
+        if self.__position < len(self.__block):
+            (self.doc_id, self.term_frequency) = self.__block[self.__position]
+        else:
+            self.__load_block(self.__block_index + 1)
+
+    @property
+    def nb_blocks(self):
+        """
+        :return: integer, the number of blocks of the posting list
+        """
+        return max(1, len(self.__skips))
+
+    def length(self):
+        """
+        :return: integer, the length of the document of the current posting (None if it is unknown)
+        """
+        if self.__block_lengths is None:
+            if self.__lengths_of is None:
+                return None
+            # the blocks are read in order of doc_id, the search of their lengths goes on from the previous block
+            (self.__block_lengths, self.__lengths_position) = self.__lengths_of(
+                [doc_id for (doc_id, _) in self.__block], self.__lengths_position)
+        return self.__block_lengths[self.__position]
+
+    def block_upper_bound(self, doc_id):
+        """
+        :param doc_id: a doc_id, not lower than the current one
+        :return: float, the highest contribution of the term in the block which may hold the doc_id, without decoding it
+        """
+        if not self.__skips:
+            return self.upper_bound
+        return self.__block_upper_bounds[self.__block_of(doc_id)]
+
+    def block_end(self, doc_id):
+        """
+        :param doc_id: a doc_id, not lower than the current one
+        :return: the first doc_id of the block following the one which may hold the doc_id, None if it is the last block
+        """
+        index = self.__block_of(doc_id) + 1
+        if index >= len(self.__skips):
+            return None
+        # only the disk interfacers whose doc_ids are uuid.UUID have skips
+        return uuid.UUID(bytes=self.__skips[index])
+
+    def __block_of(self, doc_id):
+        """
+        :param doc_id: a doc_id, not lower than the current one
+        :return: integer, the index of the block which may hold the doc_id
+        """
+        if not self.__skips:
+            return 0
+        return bisect.bisect_right(self.__skips, TermDictionary.skip_doc_id_bytes(doc_id), self.__block_index) - 1
+
+    def __load_block(self, index):
+        """
+        Decode a block and move to its first posting, or move past the end of the posting list
+        :param index: integer, the index of the block
+        :return: None
+        """
+        self.__block_index = index
+        self.__position = 0
+        self.__block_lengths = None
+        if index >= self.nb_blocks:
+            self.__block = []
+            self.doc_id = None
+            # the mapped file can be closed once every cursor is exhausted
+            self.__posting_list = None
+            return
+        if self.__decoded is not None:
+            if self.__skips:
+                self.__block = self.__decoded[index * TermDictionary.block_size:(index + 1) * TermDictionary.block_size]
+            else:
+                self.__block = self.__decoded
+        else:
+            self.__block = self.__cached_block(index)
+        (self.doc_id, self.term_frequency) = self.__block[0]
+
+    def __cached_block(self, index):
+        """
+        :param index: integer, the index of a block
+        :return: list of tuples (doc_id, term_frequency), the block, from the cache if it holds it, decoded (and cached)
+                 otherwise
+        """
+        if self.__cache is None:
+            self.nb_decoded_blocks += 1
+            return self.__posting_list.decode_block(index)
+        (filename, signature, term) = self.__cache_key
+        key = (term, index) if self.__skips else term
+        block = self.__cache.get(filename, signature, key)
+        if block is None:
+            block = self.__posting_list.decode_block(index)
+            self.nb_decoded_blocks += 1
+            self.__cache.put(filename, signature, key, block)
+        return block
+
+
+class QueryEngine(object):
+    """
+    Class made to search messages in one or several inverted files (the segments of the index), ranking them with BM25.
+    The score saved in the posting lists is used as the term frequency (which is what score.score computes), and the
+    document lengths are read from the DocumentStore of the segments, or decoded from their
+    DOCUMENT_LENGTH_KEY posting list if a segment has no store. The ranking reads the lengths of the documents of a
+    posting list from the store of its segment, in order of doc_id (see DocumentStore.lengths_of).
+    Only the posting lists of the query terms are decoded, thanks to MappedInvertedFile.
+    The ranking uses block-max WAND : from the highest score and the shortest document of each posting list and of
+    each of its blocks (saved in the term dictionaries), upper bounds of the score of each term are known, and the
+    documents which can not enter the top k are skipped without being scored, and their blocks without being decoded.
+    Boolean queries (AND, OR, NOT, parentheses and "exact phrases", see boolean_query) are answered by boolean_search,
+    the phrases needing the positional posting lists of the segments (see InvertedFile.positions_filename).
+    Initialize :
+        - filenames : list of string, the paths of the inverted files to search in
+        - tokenizer : object implementing word_tokenize, which must be the one used to build the index
+        - disk_interfacer : the disk interfacer the inverted files were saved with. Default is NaiveDiskInterfacer
+        - k1 : float, the BM25 term frequency saturation parameter. Default is 1.2
+        - b : float, the BM25 length normalization parameter. Default is 0.75
+        - cache : PostingListCache, where the decoded posting lists, and the blocks decoded by the ranking, are kept
+          between queries. Default is None
+
+    Attributes :
+        - segments : list of MappedInvertedFile, the opened inverted files
+        - positional_segments : list of MappedInvertedFile, the opened positional inverted file of each segment (None
+          for a segment which has none)
+        - stores : list of DocumentStore, the opened document store of each segment (None for a segment which has none)
+        - nb_documents : integer, the number of documents in the index
+        - average_length : float, the average length of the documents
+        - last_timings : dictionary (step: seconds), the time spent in each step of the last search
+        - last_nb_scored : integer, the number of documents scored by the last search
+        - last_nb_decoded_blocks : integer, the number of blocks of posting lists decoded by the last ranked search with
+          pruning
+        - __lengths : DocumentLengths, or dictionary (doc_id: integer) if a segment has no DocumentStore, the length of
+          each document
+    """
+
+    def __init__(self, filenames, tokenizer, disk_interfacer=ndi, k1=1.2, b=0.75, cache=None):
+        self.segments = [MappedInvertedFile(filename, disk_interfacer) for filename in filenames]
+        self.positional_segments = [
+            MappedInvertedFile(InvertedFile.positions_filename(filename), PositionalDiskInterfacer)
+            if os.path.exists(InvertedFile.positions_filename(filename)) else None
+            for filename in filenames]
+        self.stores = [DocumentStore.open(filename) for filename in filenames]
+        self.tokenizer = tokenizer
+        self.cache = cache
+        self.k1 = k1
+        self.b = b
+        self.last_timings = {}
+        self.last_nb_scored = 0
+        self.last_nb_decoded_blocks = 0
+
+        if all(store is not None for store in self.stores):
+            self.__lengths = DocumentLengths(self.stores)
+        else:
+            self.__lengths = {}
+            for segment in self.segments:
+                posting_list = segment.posting_list(DOCUMENT_LENGTH_KEY)
+                if posting_list is not None:
+                    self.__lengths.update(posting_list.decode())
+                    del posting_list
+        self.nb_documents = len(self.__lengths)
+        self.__documents = None
+        self.average_length = sum(self.__lengths.values()) / self.nb_documents if self.nb_documents else 0.
+
+    def close(self):
+        """
+        Close the inverted files and the document stores
+        :return: None
+        """
+        self.__lengths = {}
+        for opened in self.segments + self.positional_segments + self.stores:
+            if opened is not None:
+                opened.close()
+
+    def document(self, doc_id):
+        """
+        :param doc_id: uuid.UUID, the id of a message found by a search
+        :return: StoredDocument, its length, date, author and links, None if no document store knows it
+        """
+        for store in reversed(self.stores):
+            if store is not None:
+                document = store.document(doc_id)
+                if document is not None:
+                    return document
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def query_terms(self, query):
+        """
+        :param query: string, the text of the query
+        :return: list of string, the distinct tokens of the query, in order of appearance
+        """
+        return list(dict.fromkeys(self.tokenizer.word_tokenize(query)))
+
+    def idf(self, doc_freq):
+        """
+        :param doc_freq: integer, the number of documents containing a term
+        :return: float, the BM25 inverse document frequency of the term (always positive)
+        """
+        return math.log(1. + (self.nb_documents - doc_freq + .5) / (doc_freq + .5))
+
+    def term_score(self, idf, term_frequency, length):
+        """
+        :param idf: float, the idf of the term
+        :param term_frequency: integer, the number of occurrences of the term in the document
+        :param length: integer, the length of the document
+        :return: float, the BM25 contribution of the term to the score of the document
+        """
+        norm = self.k1 * (1. - self.b + self.b * length / self.average_length) if self.average_length else self.k1
+        return idf * term_frequency * (self.k1 + 1.) / (term_frequency + norm)
+
+    def term_upper_bound(self, idf, bounds):
+        """
+        :param idf: float, the idf of a term
+        :param bounds: tuple (max_score, min_length), the highest score of some postings of the term and the length of
+                       their shortest document (see TermDictionary.score_bounds), None or (0, 0) if they are unknown
+        :return: float, the highest BM25 contribution the term can have to the score of a document of these postings
+                 (infinity if the bounds are unknown)
+        """
+        if not bounds or not bounds[0]:
+            return math.inf
+        return self.term_score(idf, bounds[0], bounds[1])
+
+    def block_upper_bound(self, idf, bounds):
+        """
+        The contribution of a term is idf * (k1 + 1) / (1 + k1 * (1 - b) / term_frequency
+        + k1 * b * (length / term_frequency) / average_length), which is the highest for the highest term frequency and
+        the lowest ratio length / term frequency.
+        :param idf: float, the idf of a term
+        :param bounds: tuple (max_score, min_length_per_score), the bounds of a block of a posting list of the term (see
+                       TermDictionary.block_bounds)
+        :return: float, the highest BM25 contribution the term can have to the score of a document of the block
+                 (infinity if the bounds are unknown)
+        """
+        if not bounds[0]:
+            return math.inf
+        if not self.average_length:
+            return self.term_score(idf, bounds[0], 0)
+        length_per_score = bounds[1] / TermDictionary.length_per_score_scale
+        return idf * (self.k1 + 1.) / (1. + self.k1 * (1. - self.b) / bounds[0]
+                                       + self.k1 * self.b * length_per_score / self.average_length)
+
+    def search(self, query, top_k=10, pruning=True):
+        """
+        Rank the documents containing at least one term of the query
+        :param query: string, the text of the query
+        :param top_k: integer, the maximum number of results
+        :param pruning: boolean, skip the documents which can not enter the top k (WAND). Default is True. Results are
+                        the same without it (except the order of documents having the same score)
+        :return: list of tuples (doc_id, score), sorted by decreasing score
+        """
+        timings = {}
+        start_time = time.perf_counter()
+        terms = self.query_terms(query)
+        timings['tokenize'] = time.perf_counter() - start_time
+
+        step_time = time.perf_counter()
+        if pruning:
+            # the posting lists are decoded block by block while ranking
+            cursors = []
+            for term in terms:
+                cursors += self.__open_cursors(term)
+        else:
+            posting_lists = {}
+            for term in terms:
+                segment_posting_lists = self.__load_segment_posting_lists(term, self.segments)
+                if segment_posting_lists:
+                    posting_lists[term] = segment_posting_lists
+        timings['load'] = time.perf_counter() - step_time
+
+        step_time = time.perf_counter()
+        if pruning:
+            results = self.__rank_wand(cursors, top_k)
+        else:
+            results = self.__rank_exhaustive(posting_lists, top_k)
+        timings['rank'] = time.perf_counter() - step_time
+
+        timings['total'] = time.perf_counter() - start_time
+        self.last_timings = timings
+        return results
+
+    def boolean_search(self, query, top_k=10):
+        """
+        Find the documents matching a boolean query, ranked with BM25 on the words which are not negated.
+        The sets of documents are combined by galloping over the posting lists sorted by doc_id (see boolean_query).
+        In a conjunction, only the posting list of the rarest word is decoded : the documents are then looked for in
+        the posting lists of the other words, decoding only the blocks which may hold them (see LazyPostingList.find).
+        :param query: string, the text of the query, see boolean_query
+        :param top_k: integer, the maximum number of results
+        :return: list of tuples (doc_id, score), sorted by decreasing score
+        """
+        timings = {}
+        start_time = time.perf_counter()
+        tree = boolean_query.parse_query(query)
+        timings['tokenize'] = time.perf_counter() - start_time
+
+        step_time = time.perf_counter()
+        loaded = {}
+        matches = self.__evaluate(tree, loaded) if tree is not None else []
+        if tree is not None and tree[0] == 'not':
+            matches = boolean_query.difference(self.__all_documents(), matches)
+        timings['load'] = time.perf_counter() - step_time
+
+        step_time = time.perf_counter()
+        scores = {posting[0]: 0. for posting in matches}
+        lengths = None
+        for term in self.__positive_terms(tree):
+            doc_freq = self.__doc_freq(term) or len(self.__full_posting_list(term, loaded))
+            if not doc_freq:
+                continue
+            idf = self.idf(doc_freq)
+            if lengths is None:
+                lengths = dict(zip((posting[0] for posting in matches),
+                                   self.__lengths_of([posting[0] for posting in matches])))
+            for (doc_id, term_frequency) in self.__find(term, matches, loaded):
+                scores[doc_id] += self.term_score(idf, term_frequency, lengths[doc_id])
+        self.last_nb_scored = len(scores)
+        results = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        timings['rank'] = time.perf_counter() - step_time
+
+        timings['total'] = time.perf_counter() - start_time
+        self.last_timings = timings
+        return results
+
+    def __evaluate(self, node, loaded):
+        """
+        Find the documents matching a node of a boolean query.
+        A negated node ('not', ...) gives the documents NOT matching it : the caller removes them from its other
+        operands, so that the complement of a set is never built unless the whole query is negated.
+        :param node: tuple, a node of the tree of the query (see boolean_query.parse_query)
+        :param loaded: dictionary (term: list of tuples (doc_id, term_frequency)), the posting lists fully decoded so
+                       far, filled by this method
+        :return: list of tuples (doc_id, ...), sorted by doc_id
+        """
+        kind = node[0]
+        if kind == 'word' or kind == 'phrase':
+            terms = self.tokenizer.word_tokenize(node[1])
+            if not terms:
+                return []
+            if len(terms) == 1:
+                return self.__full_posting_list(terms[0], loaded)
+            return self.__match_phrase(terms, loaded)
+        if kind == 'not':
+            return self.__evaluate(node[1], loaded)
+        if kind == 'and':
+            return self.__evaluate_and(self.__and_operands(node), loaded)
+
+        left = self.__evaluate(node[1], loaded)
+        right = self.__evaluate(node[2], loaded)
+        if node[1][0] == 'not':
+            left = boolean_query.difference(self.__all_documents(), left)
+        if node[2][0] == 'not':
+            right = boolean_query.difference(self.__all_documents(), right)
+        return boolean_query.union(left, right)
+
+    def __evaluate_and(self, operands, loaded):
+        """
+        Find the documents matching all the operands of a conjunction
+        :param operands: list of tuples, the nodes joined by AND
+        :param loaded: dictionary, see __evaluate
+        :return: list of tuples (doc_id, ...), sorted by doc_id
+        """
+        positive_terms, positive_nodes, negated_terms, negated_nodes = [], [], [], []
+        for operand in operands:
+            negated = operand[0] == 'not'
+            inner = operand[1] if negated else operand
+            term = self.__single_term(inner)
+            if term is not None:
+                (negated_terms if negated else positive_terms).append(term)
+            else:
+                (negated_nodes if negated else positive_nodes).append(inner)
+
+        if not positive_terms and not positive_nodes:
+            # NOT a AND NOT b is NOT (a OR b)
+            excluded = []
+            for term in negated_terms:
+                excluded = boolean_query.union(excluded, self.__full_posting_list(term, loaded))
+            for inner in negated_nodes:
+                excluded = boolean_query.union(excluded, self.__evaluate(inner, loaded))
+            return boolean_query.difference(self.__all_documents(), excluded)
+
+        positive_terms.sort(key=self.__doc_freq)
+        if positive_nodes:
+            matches = boolean_query.intersect_many([self.__evaluate(inner, loaded) for inner in positive_nodes])
+        else:
+            matches = self.__full_posting_list(positive_terms.pop(0), loaded)
+        for term in positive_terms:
+            if not matches:
+                return []
+            matches = self.__find(term, matches, loaded)
+        for term in negated_terms:
+            if not matches:
+                return []
+            matches = boolean_query.difference(matches, self.__find(term, matches, loaded))
+        for inner in negated_nodes:
+            if not matches:
+                return []
+            matches = boolean_query.difference(matches, self.__evaluate(inner, loaded))
+        return matches
+
+    def __match_phrase(self, terms, loaded):
+        """
+        :param terms: list of string, the tokens of a phrase
+        :param loaded: dictionary, see __evaluate
+        :return: list of tuples (doc_id, ...) sorted by doc_id, the documents where the terms follow each other
+        """
+        candidates = self.__evaluate_and([('word', term) for term in dict.fromkeys(terms)], loaded)
+        if not candidates:
+            return []
+        if any(segment is None for segment in self.positional_segments):
+            raise ValueError('Phrase queries need positional inverted files (see InvertedFile positional mode)')
+
+        positions = {term: self.__load_posting_list(term, self.positional_segments) for term in set(terms)}
+        cursors = dict.fromkeys(positions, 0)
+        output = []
+        for candidate in candidates:
+            document_positions = []
+            for term in terms:
+                term_positions = positions[term]
+                cursors[term] = boolean_query.gallop(term_positions, candidate[0], cursors[term])
+                if cursors[term] == len(term_positions) or term_positions[cursors[term]][0] != candidate[0]:
+                    break
+                document_positions.append(term_positions[cursors[term]][1])
+            else:
+                if boolean_query.phrase_match(document_positions):
+                    output.append(candidate)
+        return output
+
+    def __find(self, term, matches, loaded):
+        """
+        :param term: string, a term of the index
+        :param matches: list of tuples (doc_id, ...), sorted by doc_id
+        :param loaded: dictionary, see __evaluate
+        :return: list of tuples (doc_id, term_frequency), the postings of the term for the documents of matches, sorted
+                 by doc_id. Only the blocks of the posting lists which may hold these documents are decoded
+        """
+        if term in loaded:
+            return boolean_query.select(loaded[term], matches)
+        doc_ids = [match[0] for match in matches]
+        found = []
+        for segment in self.segments:
+            posting_list = segment.posting_list(term)
+            if posting_list is not None:
+                found.append(posting_list.find(doc_ids))
+                del posting_list
+        if len(found) == 1:
+            return found[0]
+        return list(heapq.merge(*found, key=lambda posting: posting[0]))
+
+    def __full_posting_list(self, term, loaded):
+        """
+        :param term: string, a term of the index
+        :param loaded: dictionary, see __evaluate
+        :return: list of tuples (doc_id, term_frequency), the whole posting list of the term, sorted by doc_id
+        """
+        if term not in loaded:
+            loaded[term] = self.__load_posting_list(term, self.segments)
+        return loaded[term]
+
+    def __doc_freq(self, term):
+        """
+        :param term: string, a term of the index
+        :return: integer, the number of documents containing the term (0 if it is unknown)
+        """
+        return sum(segment.doc_freq(term) for segment in self.segments)
+
+    def __single_term(self, node):
+        """
+        :param node: tuple, a node of the tree of a query
+        :return: string, the term of the node if it is a word giving a single token, None otherwise
+        """
+        if node[0] != 'word':
+            return None
+        terms = self.tokenizer.word_tokenize(node[1])
+        return terms[0] if len(terms) == 1 else None
+
+    @classmethod
+    def __and_operands(cls, node):
+        """
+        :param node: tuple, a node of the tree of a query
+        :return: list of tuples, the operands of the nested conjunctions of the node
+        """
+        if node[0] != 'and':
+            return [node]
+        return cls.__and_operands(node[1]) + cls.__and_operands(node[2])
+
+    def __positive_terms(self, node):
+        """
+        :param node: tuple, a node of the tree of a query, or None
+        :return: set of string, the terms of the node which are not under a NOT
+        """
+        if node is None or node[0] == 'not':
+            return set()
+        if node[0] == 'word' or node[0] == 'phrase':
+            return set(self.tokenizer.word_tokenize(node[1]))
+        return self.__positive_terms(node[1]) | self.__positive_terms(node[2])
+
+    def __all_documents(self):
+        """
+        :return: list of tuples (doc_id, length), every document of the index sorted by doc_id
+        """
+        if self.__documents is None:
+            self.__documents = sorted(self.__lengths.items())
+        return self.__documents
+
+    def __load_posting_list(self, term, segments):
+        """
+        :param term: string, a term of the index
+        :param segments: list of MappedInvertedFile (or None), the files to read the posting lists from
+        :return: list of tuples (doc_id, value), the posting lists of the term in all the segments, sorted by doc_id.
+                 It may come from the cache, and must not be modified
+        """
+        decoded = [posting_list for (_, posting_list) in self.__load_segment_posting_lists(term, segments)]
+        if len(decoded) == 1:
+            return decoded[0]
+        # the posting list of each segment is sorted by doc_id
+        return list(heapq.merge(*decoded, key=lambda posting: posting[0]))
+
+    def __load_segment_posting_lists(self, term, segments):
+        """
+        :param term: string, a term of the index
+        :param segments: list of MappedInvertedFile (or None), the files to read the posting lists from
+        :return: list of tuples (index of the segment, list of tuples (doc_id, value)), the posting list of the term in
+                 each segment holding it, sorted by doc_id. They may come from the cache, and must not be modified
+        """
+        decoded = []
+        for (index, segment) in enumerate(segments):
+            if segment is None or term not in segment:
+                continue
+            cached = self.cache.get(segment.filename, segment.signature, term) if self.cache is not None else None
+            if cached is None:
+                posting_list = segment.posting_list(term)
+                cached = posting_list.decode()
+                del posting_list
+                if self.cache is not None:
+                    self.cache.put(segment.filename, segment.signature, term, cached)
+            decoded.append((index, cached))
+        return decoded
+
+    def __segment_lengths_of(self, index):
+        """
+        :param index: integer, the index of a segment
+        :return: function (doc_ids, start) -> (lengths, position), reading the lengths of documents of the segment
+                 sorted by doc_id (see DocumentStore.lengths_of), the unknown ones having the average length
+        """
+        default = self.average_length
+        if isinstance(self.__lengths, DocumentLengths):
+            store = self.stores[index]
+            return lambda doc_ids, start: store.lengths_of(doc_ids, default, start)
+        lengths = self.__lengths
+        return lambda doc_ids, start: ([lengths.get(doc_id, default) for doc_id in doc_ids], start)
+
+    def __lengths_of(self, doc_ids):
+        """
+        :param doc_ids: list of doc_id, sorted
+        :return: list of integers, the length of each document in the index (the average length if it is unknown)
+        """
+        if isinstance(self.__lengths, DocumentLengths):
+            return self.__lengths.lengths_of(doc_ids, self.average_length)
+        return [self.__lengths.get(doc_id, self.average_length) for doc_id in doc_ids]
+
+    def __rank_exhaustive(self, posting_lists, top_k):
+        """
+        Score every document of the posting lists
+        :param posting_lists: dictionary (term: list of tuples (index of a segment, list of tuples
+                              (doc_id, term_frequency))), the posting lists of each term in each segment
+        :param top_k: integer, the maximum number of results
+        :return: list of tuples (doc_id, score), sorted by decreasing score
+        """
+        scores = {}
+        for (term, segment_posting_lists) in posting_lists.items():
+            idf = self.idf(sum(len(posting_list) for (_, posting_list) in segment_posting_lists))
+            for (index, posting_list) in segment_posting_lists:
+                (lengths, _) = self.__segment_lengths_of(index)([doc_id for (doc_id, _) in posting_list], 0)
+                for ((doc_id, term_frequency), length) in zip(posting_list, lengths):
+                    score = self.term_score(idf, term_frequency, length)
+                    scores[doc_id] = scores.get(doc_id, 0.) + score
+        self.last_nb_scored = len(scores)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def __open_cursors(self, term):
+        """
+        :param term: string, a term of the query
+        :return: list of PostingCursor, one on the posting list of the term in each segment holding it
+        """
+        found = []
+        for (index, segment) in enumerate(self.segments):
+            posting_list = segment.posting_list(term)
+            if posting_list is None:
+                continue
+            decoded = self.cache.get(segment.filename, segment.signature, term) if self.cache is not None else None
+            if decoded is None and posting_list.doc_freq is None:
+                # a segment without term dictionary : the length of the posting list is only known once decoded
+                decoded = posting_list.decode()
+            found.append((index, segment, posting_list, decoded))
+        if not found:
+            return []
+
+        idf = self.idf(sum(len(decoded) if decoded is not None else posting_list.doc_freq
+                           for (_, _, posting_list, decoded) in found))
+        cursors = []
+        for (index, segment, posting_list, decoded) in found:
+            upper_bound = self.term_upper_bound(idf, segment.score_bounds(term))
+            block_upper_bounds = [min(self.block_upper_bound(idf, bounds), upper_bound)
+                                  for bounds in posting_list.block_bounds]
+            if block_upper_bounds:
+                upper_bound = max(block_upper_bounds)
+            cursors.append(PostingCursor(posting_list, idf, upper_bound, block_upper_bounds, decoded,
+                                         self.__segment_lengths_of(index), self.cache,
+                                         (segment.filename, segment.signature, term)))
+        return cursors
+
+    def __rank_wand(self, cursors, top_k):
+        """
+        Score the documents of the posting lists with block-max WAND : the cursors are kept sorted by their current
+        doc_id, and the first document (the pivot) whose cumulated upper bounds exceed the lowest score of the top k
+        is the next one which may enter it. If the upper bounds of the blocks of the cursors holding the pivot do not
+        exceed it either, no document is scored before the end of one of these blocks, and the cursors jump there
+        without decoding the blocks in between. Otherwise the cursors before the pivot are moved to it.
+        :param cursors: list of PostingCursor, on the posting lists of the terms of the query in each segment
+        :param top_k: integer, the maximum number of results
+        :return: list of tuples (doc_id, score), sorted by decreasing score
+        """
+        all_cursors = cursors
+        cursors = [cursor for cursor in cursors if cursor.doc_id is not None]
+        doc_id_of = attrgetter('doc_id')
+
+        top = []  # heap of tuples (score, doc_id), of at most top_k elements
+        threshold = 0.
+        nb_scored = 0
+        while cursors and top_k > 0:
+            cursors.sort(key=doc_id_of)
+            bound = 0.
+            pivot = None
+            for (index, cursor) in enumerate(cursors):
+                bound += cursor.upper_bound
+                if bound > threshold:
+                    pivot = index
+                    break
+            if pivot is None:
+                break
+            pivot_doc_id = cursors[pivot].doc_id
+            # the cursors after the pivot already on its document contribute to its score as well
+            end = pivot + 1
+            while end < len(cursors) and cursors[end].doc_id == pivot_doc_id:
+                end += 1
+
+            if sum(cursor.block_upper_bound(pivot_doc_id) for cursor in cursors[:end]) <= threshold:
+                # no document before the end of the current blocks, or before the next cursor, can enter the top k
+                next_doc_id = cursors[end].doc_id if end < len(cursors) else None
+                for cursor in cursors[:end]:
+                    block_end = cursor.block_end(pivot_doc_id)
+                    if block_end is not None and (next_doc_id is None or block_end < next_doc_id):
+                        next_doc_id = block_end
+                for cursor in cursors[:end]:
+                    cursor.advance(next_doc_id)
+            elif cursors[0].doc_id == pivot_doc_id:
+                # all the cursors before the pivot are on its document : score it
+                score = 0.
+                length = cursors[0].length()
+                for cursor in cursors[:end]:
+                    score += self.term_score(cursor.idf, cursor.term_frequency, length)
+                    cursor.next()
+                nb_scored += 1
+                if len(top) < top_k:
+                    heapq.heappush(top, (score, pivot_doc_id))
+                elif score > top[0][0]:
+                    heapq.heapreplace(top, (score, pivot_doc_id))
+                if len(top) == top_k:
+                    threshold = top[0][0]
+            else:
+                for cursor in cursors[:pivot]:
+                    cursor.advance(pivot_doc_id)
+            cursors = [cursor for cursor in cursors if cursor.doc_id is not None]
+
+        self.last_nb_scored = nb_scored
+        self.last_nb_decoded_blocks = sum(cursor.nb_decoded_blocks for cursor in all_cursors)
+        return [(doc_id, score) for (score, doc_id) in sorted(top, reverse=True)]
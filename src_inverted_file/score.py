@@ -16,17 +16,32 @@
 # along with this program; see the file LICENSE.  If not see
 # <http://www.gnu.org/licenses/>.
 
+import inspect
 
-def score(token, document):
+
+def accepts_term_frequencies(score_function):
+    """
+    Tell whether a score function can be given the precomputed term frequencies of a document
+    :param score_function: function of prototype [integer function(token, document)]
+    :return: boolean, True if the function can be called with a term_frequencies keyword parameter
+    """
+    try:
+        parameters = inspect.signature(score_function).parameters
+    except (TypeError, ValueError):
+        return False
+    return 'term_frequencies' in parameters or \
+        any(parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values())
+
+
+def score(token, document, term_frequencies=None):
     """
     Returns the score of a token in a document
-    :param token:
-    :param document:
-    :return:
+    :param token: string, a token of the document
+    :param document: IEMessage, the document
+    :param term_frequencies: dictionary (token: integer), the number of occurrences of each token of the document,
+                             computed once by InvertedFile.add_document. If None, the token is counted in document.text
+    :return: integer, the number of occurrences of the token in the document
     """
-    tokens = document.text.copy()
-    token_count = 0
-    for word in tokens:
-        if word == token:
-            token_count += 1
-    return token_count
\ No newline at end of file
+    if term_frequencies is not None:
+        return term_frequencies[token]
+    return document.text.count(token)
\ No newline at end of file
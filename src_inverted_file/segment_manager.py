@@ -0,0 +1,242 @@
+# segment_manager.py Manage the segments of the index : manifest, snapshots and background compaction
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import asyncio
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+from src_inverted_file.index_state import IndexState
+from src_inverted_file.inverted_file import InvertedFile
+from src_inverted_file.metrics import measured_call, merge_measured, metrics
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer as ndi
+
+SEGMENT_REGEX = re.compile(r'segment_\d+\.if$')
+
+
+class ManifestSnapshot(namedtuple('ManifestSnapshot', ['generation', 'segments'])):
+    """
+    A consistent view of the index, as given by SegmentManager.snapshot : the files of its segments are not removed
+    before the snapshot is released, even if a merge or a rebuild replaces them meanwhile.
+    Attributes :
+        - generation : integer, the generation of the manifest the snapshot was taken from
+        - segments : tuple of string, the paths of the segments, from the oldest to the newest
+    """
+    __slots__ = ()
+
+
+class SegmentManager(object):
+    """
+    Class made to be the single writer of the manifest of the index (an IndexState) in a process, and to keep the
+    number of segments bounded.
+    Each update or live flush adds a segment : the segments are merged in the background (see compact) with a tiered
+    policy, where a segment is in tier floor(log_merge_factor(size / min_segment_size)) and merge_factor consecutive
+    segments of a same tier are merged into one segment of the next tier, keeping the order of the segments. A merge
+    does not replace an older version of a message : doc_ids are generated when a message is indexed (see IEMessage),
+    so a message indexed twice is held twice, under two doc_ids (see IndexState.is_indexed, which avoids it).
+    Readers pin a snapshot of the manifest : the files of the segments removed from the manifest (by a merge or a
+    rebuild) are only deleted once no snapshot uses them anymore.
+    Initialize :
+        - directory : string, the directory of the segments
+        - manifest_filename : string, the path of the json file of the IndexState
+        - disk_interfacer : the disk interfacer the segments are encoded with. Default is NaiveDiskInterfacer
+        - merge_factor : integer, the number of segments of a tier merged at once. Default is 4
+        - min_segment_size : integer, the size (in bytes) under which every segment is in the lowest tier.
+          Default is 1 MiB
+        - max_segments : integer, above this number of segments, the smallest consecutive segments are merged even if
+          they are not in the same tier. Default is 12
+
+    Attributes :
+        - directory : string, the directory of the segments
+        - manifest : IndexState, the current manifest
+        - merge_factor, min_segment_size, max_segments : see Initialize
+        - __pins : Counter (path: integer), the number of unreleased snapshots using each segment
+        - __retired : set of string, the paths of the segments removed from the manifest but still pinned
+        - __merging : set of string, the paths of the segments being merged
+    """
+
+    def __init__(self, directory, manifest_filename, disk_interfacer=ndi, merge_factor=4, min_segment_size=1 << 20,
+                 max_segments=12):
+        self.directory = directory
+        self.manifest = IndexState.load(manifest_filename)
+        self.di = disk_interfacer
+        self.merge_factor = merge_factor
+        self.min_segment_size = min_segment_size
+        self.max_segments = max(max_segments, merge_factor)
+        self.__pins = Counter()
+        self.__retired = set()
+        self.__merging = set()
+
+    @property
+    def segments(self):
+        """
+        :return: list of string, a copy of the paths of the current segments
+        """
+        return list(self.manifest.segments)
+
+    def new_segment_filename(self):
+        """
+        :return: string, a path for a new segment, never given before
+        """
+        return self.manifest.next_segment_filename(self.directory)
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------MANIFEST----------------------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+    def commit(self, filename=None, last_message=None, reset=False, live_messages=None):
+        """
+        Add a segment to the manifest and save it atomically
+        :param filename: string, the path of the new segment. Default is None, when no segment was written
+        :param last_message: discord.Message, the newest message fetched from the history
+                             (see IndexState.register_segment). Default is None
+        :param reset: boolean, the new segment replaces the whole index (rebuild). Default is False
+        :param live_messages: list of discord.Message, the messages indexed live in the segment, which do not move the
+                              high-water mark. Default is None
+        :return: None
+        """
+        retired = []
+        if reset:
+            retired = [segment for segment in self.manifest.segments if segment != filename]
+            self.manifest.reset()
+        self.manifest.register_segment(filename, last_message, live_messages)
+        self.manifest.save()
+        self.__retire(retired)
+
+    def snapshot(self):
+        """
+        Pin the current segments : they are not removed before the snapshot is released
+        :return: ManifestSnapshot
+        """
+        snapshot = ManifestSnapshot(self.manifest.generation, tuple(self.manifest.segments))
+        self.__pins.update(snapshot.segments)
+        return snapshot
+
+    def release(self, snapshot):
+        """
+        Unpin the segments of a snapshot, removing the ones retired meanwhile which are not pinned anymore
+        :param snapshot: ManifestSnapshot, a snapshot given by snapshot, released only once
+        :return: None
+        """
+        self.__pins.subtract(snapshot.segments)
+        for segment in snapshot.segments:
+            if self.__pins[segment] <= 0:
+                del self.__pins[segment]
+        self.__retire([segment for segment in snapshot.segments if segment in self.__retired])
+
+    def __retire(self, segments):
+        """
+        Remove the files of segments which are not in the manifest anymore, or postpone it while they are pinned
+        :param segments: list of string, the paths of the segments
+        :return: None
+        """
+        for segment in segments:
+            if self.__pins[segment] > 0:
+                self.__retired.add(segment)
+            else:
+                self.__retired.discard(segment)
+                InvertedFile.remove_inverted_file(segment)
+
+    def remove_unreferenced(self):
+        """
+        Remove the segment files of the directory which are not in the manifest, left by a crash during an indexing
+        or a merge. It must be called before any indexing starts, which would write segments not committed yet.
+        :return: list of string, the paths of the removed segments
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        removed = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if SEGMENT_REGEX.match(name) and path not in self.manifest.segments and self.__pins[path] <= 0:
+                InvertedFile.remove_inverted_file(path)
+                removed.append(path)
+        return removed
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------COMPACTION--------------------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+    def tier(self, size):
+        """
+        :param size: integer, the size of a segment (in bytes)
+        :return: integer, the tier of the segment, 0 for the smallest ones
+        """
+        return int(math.log(max(size, self.min_segment_size) / self.min_segment_size, self.merge_factor))
+
+    def find_merge(self):
+        """
+        Tiered merge policy
+        :return: list of string, the oldest merge_factor consecutive segments of a same tier, or the consecutive
+                 segments with the smallest total size if there are more than max_segments segments. None if no merge
+                 is needed
+        """
+        segments = self.manifest.segments
+        sizes = [os.path.getsize(segment) if os.path.exists(segment) else 0 for segment in segments]
+        tiers = [self.tier(size) for size in sizes]
+        windows = [start for start in range(len(segments) - self.merge_factor + 1)
+                   if not self.__merging.intersection(segments[start:start + self.merge_factor])]
+        for start in windows:
+            if len(set(tiers[start:start + self.merge_factor])) == 1:
+                return segments[start:start + self.merge_factor]
+        if len(segments) > self.max_segments and windows:
+            start = min(windows, key=lambda start: sum(sizes[start:start + self.merge_factor]))
+            return segments[start:start + self.merge_factor]
+        return None
+
+    async def compact(self, executor, lock, loop=None):
+        """
+        Merge segments until the merge policy is satisfied (see find_merge). The merges run in the executor, and the
+        lock is only held to choose a merge and to commit it, so that the indexing goes on meanwhile.
+        A merge whose segments were removed meanwhile (by a rebuild) is dropped.
+        :param executor: concurrent.futures.Executor, where the merges run, typically a ProcessPoolExecutor
+        :param lock: asyncio.Lock, the lock of the writers of the index
+        :param loop: asyncio event loop. Default is the current event loop
+        :return: integer, the number of merges committed
+        """
+        loop = loop if loop is not None else asyncio.get_event_loop()
+        nb_merges = 0
+        while True:
+            async with lock:
+                segments = self.find_merge()
+                if segments is None:
+                    return nb_merges
+                filename = self.new_segment_filename()
+                snapshot = ManifestSnapshot(self.manifest.generation, tuple(segments))
+                self.__pins.update(snapshot.segments)
+                self.__merging.update(segments)
+            committed = False
+            try:
+                with metrics.timer('compaction'):
+                    merge_measured(await loop.run_in_executor(executor, measured_call,
+                                                              InvertedFile.merge_many_inverted_files, filename,
+                                                              segments, self.di))
+                async with lock:
+                    if all(segment in self.manifest.segments for segment in segments):
+                        self.manifest.replace_segments(segments, filename)
+                        self.manifest.save()
+                        committed = True
+                        self.__retire(segments)
+                        metrics.count('segments_merged', len(segments))
+                        nb_merges += 1
+            finally:
+                if not committed:
+                    InvertedFile.remove_inverted_file(filename)
+                self.__merging.difference_update(segments)
+                self.release(snapshot)
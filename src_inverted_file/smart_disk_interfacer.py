@@ -0,0 +1,306 @@
+# smart_disk_interfacer.py A compressed encoder/decoder to store an inverted file
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import uuid
+
+from src_inverted_file.atomic_file import atomic_write
+from src_inverted_file.naive_disk_interfacer import OutOfBoundError
+
+
+class DocIdMap(object):
+    """
+    Bidirectional mapping between the uuid of the messages and dense integer doc ids (0, 1, 2, ...),
+    so that posting lists can store small, delta-encodable integers instead of 16 bytes uuids.
+    Initialize :
+        - doc_ids : list of uuid.UUID, the uuid of the message whose dense id is the index in the list. Default is empty
+
+    Attributes :
+        - __doc_ids : list of uuid.UUID, dense id -> uuid
+        - __dense_ids : dictionary, uuid -> dense id
+    """
+
+    def __init__(self, doc_ids=None):
+        self.__doc_ids = list(doc_ids) if doc_ids is not None else []
+        self.__dense_ids = {doc_id: dense_id for (dense_id, doc_id) in enumerate(self.__doc_ids)}
+
+    def __len__(self):
+        return len(self.__doc_ids)
+
+    def dense_id(self, doc_id):
+        """
+        Get the dense id of a message, allocating the next free one if the message is unknown
+        :param doc_id: uuid.UUID, the id of a message
+        :return: integer, the dense id of the message
+        """
+        dense_id = self.__dense_ids.get(doc_id)
+        if dense_id is None:
+            dense_id = len(self.__doc_ids)
+            self.__dense_ids[doc_id] = dense_id
+            self.__doc_ids.append(doc_id)
+        return dense_id
+
+    def doc_id(self, dense_id):
+        """
+        :param dense_id: integer, a dense id previously returned by dense_id
+        :return: uuid.UUID, the id of the associated message
+        """
+        return self.__doc_ids[dense_id]
+
+    @staticmethod
+    def map_filename(if_filename):
+        """
+        :param if_filename: string, the path of an inverted file
+        :return: string, the path of the DocIdMap saved next to it by InvertedFile.write_posting_lists
+        """
+        return if_filename + '.ids'
+
+    def save(self, filename):
+        """
+        Save the mapping to the disc, as the concatenation of the 16 bytes of each uuid, ordered by dense id.
+        The file is replaced atomically.
+        :param filename: string, the path of the file to be written
+        :return: None
+        """
+        with atomic_write(filename) as f:
+            f.write(b''.join(doc_id.bytes for doc_id in self.__doc_ids))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a mapping previously written by save
+        :param filename: string, the path of the file to be read
+        :return: DocIdMap, the mapping
+        """
+        with open(filename, 'rb') as f:
+            content = f.read()
+        return cls(uuid.UUID(bytes=content[i:i + 16]) for i in range(0, len(content) - 15, 16))
+
+
+class SmartDiskInterfacer(object):
+    """
+    Compressed implementation of saving and reading an InvertedFile in binary. Each posting list is stored as :
+    <key_size(key_len_len bytes)><key(key_size bytes)><list_len(list_len_len bytes)>( (<doc_gap(varint)><score(varint)>)*N )
+    where the postings are sorted by dense doc id and doc_gap is the difference with the previous dense doc id
+    (the first gap being the dense doc id itself). Varints are unsigned LEB128 : 7 bits per byte, the high bit
+    being set on every byte but the last one.
+    A typical posting then takes 2 or 3 bytes on disc instead of 21 with NaiveDiskInterfacer.
+
+    The key and list sizes keep a fixed width so that InvertedFile can skip posting lists without decoding them.
+
+    Initialize :
+        - doc_ids : DocIdMap, used to translate the uuid of the messages into dense integer doc ids.
+          InvertedFile saves it next to each inverted file it encodes (see DocIdMap.map_filename), and the readers
+          decode a file with the map saved next to it (see for_file), so that the file can be read by another process.
+          If None, doc ids are expected to already be non-negative integers, and are decoded as such.
+
+    Class Attributes :
+        - list_len_len : integer, the number of bytes used for the encoding of the size of a posting list (in bytes)
+        - key_len_len : integer, the number of bytes used for the encoding of the size of the key (in bytes)
+    """
+
+    list_len_len = 4
+    key_len_len = 1
+
+    def __init__(self, doc_ids=None):
+        self.doc_ids = doc_ids
+
+    def for_file(self, filename):
+        """
+        :param filename: string, the path of an inverted file encoded by a SmartDiskInterfacer
+        :return: SmartDiskInterfacer, decoding the file with the DocIdMap saved next to it, or this interfacer if there
+                 is none (the file was encoded without DocIdMap)
+        """
+        map_filename = DocIdMap.map_filename(filename)
+        if not os.path.exists(map_filename):
+            return self
+        return SmartDiskInterfacer(DocIdMap.load(map_filename))
+
+    def save_doc_ids(self, filename):
+        """
+        Save the DocIdMap next to an inverted file this interfacer encoded, or remove the one of a former file of the
+        same path if this interfacer has none
+        :param filename: string, the path of the inverted file
+        :return: None
+        """
+        map_filename = DocIdMap.map_filename(filename)
+        if self.doc_ids is not None:
+            self.doc_ids.save(map_filename)
+        elif os.path.exists(map_filename):
+            os.remove(map_filename)
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------SMART ENCODING----------------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+    @classmethod
+    def _encode_number(cls, number, bin_size):
+        """
+        Encode an number in binary (big endian) over an arbitrary number of bytes
+        :param number: integer, the number to be binary encoded
+        :param bin_size: integer, the number of bytes to encode the number over
+        :return: bytes, a representation of the number encoded
+        """
+        try:
+            return number.to_bytes(bin_size, 'big')
+        except OverflowError:
+            raise OutOfBoundError('Number is too long ({} > 2**({} * 8))'.format(number, bin_size))
+
+    @classmethod
+    def _encode_varint(cls, number, output):
+        """
+        Append the varint representation of a number to a bytearray
+        :param number: integer, the non-negative number to be encoded
+        :param output: bytearray, the buffer to append to
+        :return: None
+        """
+        if number < 0:
+            raise OutOfBoundError('Number is negative ({} < 0)'.format(number))
+        while number >= 0x80:
+            output.append((number & 0x7f) | 0x80)
+            number >>= 7
+        output.append(number)
+
+    def _dense_postings(self, map_content):
+        """
+        Translate a posting list into a list of (dense doc id, score) sorted by dense doc id
+        :param map_content : list, list of tuples (docid, score)
+        :return: list of tuples (integer, integer)
+        """
+        if self.doc_ids is None:
+            return sorted(map_content)
+        dense_id = self.doc_ids.dense_id
+        return sorted((dense_id(doc_id), score) for (doc_id, score) in map_content)
+
+    def _encode_list(self, map_content):
+        """
+        Encode a list of (docid, integer score) in binary, in the format :
+        <list_len(list_len_len bytes)>( (<doc_gap(varint)><score(varint)>)*N )
+        :param map_content : list, list of tuples (docid, score) where:
+                - docid : uuid.UUID (or integer if no DocIdMap is used), id of a message
+                - score : integer, score of a message relative to some word
+        :return: bytearray, the list encoded
+        """
+        output = bytearray()
+        previous_id = 0
+        for (dense_id, score) in self._dense_postings(map_content):
+            self._encode_varint(dense_id - previous_id, output)
+            self._encode_varint(score, output)
+            previous_id = dense_id
+        return bytearray(self._encode_number(len(output), self.list_len_len)) + output
+
+    def encode_posting_list(self, key, map_content):
+        """
+        Encode a pair (key, value) in binary, in the format :
+        <key_size(key_len_len bytes)><key(key_size bytes)><list_len(list_len_len bytes)>( (<doc_gap(varint)><score(varint)>)*N )
+        :param key : string, a word, key of the map representing the index
+        :param map_content : list, list of tuples (docid, score) where:
+                - docid : uuid.UUID (or integer if no DocIdMap is used), id of a message
+                - score : integer, score of a message relative to some word
+        :return: bytearray, the pair encoded
+        """
+        bin_key = key.encode('utf-8')
+        output = bytearray(self._encode_number(len(bin_key), self.key_len_len))
+        output += bin_key
+        output += self._encode_list(map_content)
+        return output
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------SMART DECODING----------------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+    @classmethod
+    def decode_number(cls, bin_number):
+        """
+        Convert a binary number into an integer
+        :param bin_number: bytes-like, binary (big endian) representation of a number
+        :return: integer, unsigned decimal representation of the input number
+        """
+        return int.from_bytes(bin_number, 'big')
+
+    @classmethod
+    def _varint_regenerator(cls, bin_list):
+        """
+        Generator, decode a sequence of varints and yield them
+        :param bin_list: bytes-like, the concatenation of the varints
+        :return: yield integer, each decoded number
+        """
+        number = 0
+        shift = 0
+        for octet in bytes(bin_list):
+            number |= (octet & 0x7f) << shift
+            if octet & 0x80:
+                shift += 7
+            else:
+                yield number
+                number = 0
+                shift = 0
+
+    def decode_dense_list(self, bin_list):
+        """
+        Decode an entire binary posting list without translating the dense doc ids
+        :param bin_list: bytes-like, the binary representation of a posting list
+        :return: list, a list of tuples (dense_doc_id, score) sorted by dense_doc_id
+        """
+        output = []
+        numbers = self._varint_regenerator(bin_list)
+        dense_id = 0
+        for gap in numbers:
+            dense_id += gap
+            output.append((dense_id, next(numbers)))
+        return output
+
+    def decode_list(self, bin_list):
+        """
+        Decode an entire binary posting list of shape :
+        ( (<doc_gap(varint)><score(varint)>)*N )
+        :param bin_list: bytes-like, the binary representation of a posting list
+        :return: list, a list of tuples (doc_id, score) sorted by doc_id, as with the other interfacers, where each :
+            - doc_id : uuid.UUID (or integer if no DocIdMap is used), the unique id of a message
+            - score : integer, the score of this message relative to the keyword of this posting list
+        """
+        output = self.decode_dense_list(bin_list)
+        if self.doc_ids is None:
+            return output
+        doc_id = self.doc_ids.doc_id
+        # dense ids are given in order of first appearance, which is not the order of the uuids
+        return sorted((doc_id(dense_id), score) for (dense_id, score) in output)
+
+
+def interfacer_for_file(interfacer, filename):
+    """
+    :param interfacer: a disk interfacer
+    :param filename: string, the path of an inverted file encoded by the interfacer
+    :return: the disk interfacer decoding the file : interfacer itself, unless it keeps a state saved with each file
+             (see SmartDiskInterfacer.for_file)
+    """
+    for_file = getattr(interfacer, 'for_file', None)
+    return for_file(filename) if for_file is not None else interfacer
+
+
+def save_interfacer_state(interfacer, filename):
+    """
+    Save the state needed to decode an inverted file next to it, for the interfacers keeping one
+    (see SmartDiskInterfacer.save_doc_ids)
+    :param interfacer: the disk interfacer which encoded the file
+    :param filename: string, the path of the inverted file
+    :return: None
+    """
+    save_doc_ids = getattr(interfacer, 'save_doc_ids', None)
+    if save_doc_ids is not None:
+        save_doc_ids(filename)
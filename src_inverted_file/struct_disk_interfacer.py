@@ -0,0 +1,153 @@
+# struct_disk_interfacer.py A vectorized encoder/decoder to store an inverted file
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import struct
+import uuid
+
+from src_inverted_file.naive_disk_interfacer import OutOfBoundError
+
+
+class StructDiskInterfacer(object):
+    """
+    Empty class used as namespace for a struct based implementation of saving and reading an InvertedFile in binary.
+    It writes exactly the same layout as NaiveDiskInterfacer, but packs and unpacks a whole posting list at once
+    instead of building every number byte by byte :
+    <key_size(key_len_len bytes)><key(key_size bytes)><list_len(list_len_len bytes)>
+    ( (<doc_id_len(doc_id_len_len bytes)><doc_id(doc_id_len bytes)><score(score_len bytes)>)*N )
+
+    Class Attributes :
+
+        - score_len : integer, the number of bytes used for the encoding of a score
+        - list_len_len : integer, the number of bytes used for the encoding of the size of a posting list (in bytes)
+        - key_len_len : integer, the number of bytes used for the encoding of the size of the key (in bytes)
+        - doc_id_len : integer, the number of bytes of a docid (a binary uuid)
+        - doc_id_len_len : integer, the number of bytes used for the encoding of doc_id_len
+        - posting_struct : struct.Struct, the binary layout of a single element (doc_id, score) of a posting list
+        - posting_len : integer, the number of bytes of an encoded element (doc_id, score) of a posting list
+
+    """
+
+    score_len = 4
+    list_len_len = 4
+    key_len_len = 1
+    doc_id_len = 16
+    doc_id_len_len = 1
+    posting_struct = struct.Struct('>B16sI')
+    posting_len = posting_struct.size
+
+    def __init__(self):
+        pass
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------STRUCT ENCODING---------------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+    @classmethod
+    def _encode_number(cls, number, bin_size):
+        """
+        Encode an number in binary (big endian) over an arbitrary number of bytes
+        :param number: integer, the number to be binary encoded
+        :param bin_size: integer, the number of bytes to encode the number over
+        :return: bytes, a representation of the number encoded
+        """
+        try:
+            return number.to_bytes(bin_size, 'big')
+        except OverflowError:
+            raise OutOfBoundError('Number is too long ({} > 2**({} * 8))'.format(number, bin_size))
+
+    @classmethod
+    def _doc_id_bytes(cls, doc_id):
+        """
+        Get the binary representation of a docid
+        :param doc_id: uuid.UUID or integer, the id of a message
+        :return: bytes, the doc_id_len bytes of the docid
+        """
+        if isinstance(doc_id, uuid.UUID):
+            return doc_id.bytes
+        return cls._encode_number(doc_id, cls.doc_id_len)
+
+    @classmethod
+    def _encode_list(cls, map_content):
+        """
+        Encode a list of (docid, integer score) in binary, in a single pass, in the format :
+        <list_len(list_len_len bytes)>( (<doc_id_len><doc_id(doc_id_len bytes)><score(score_len bytes)>)*N )
+        :param map_content : list, list of tuples (docid, score) where:
+                - docid : uuid.UUID, id of a message
+                - score : integer, score of a message relative to some word
+        :return: bytearray, the list encoded
+        """
+        entry_size = cls.posting_struct.size
+        list_len = entry_size * len(map_content)
+        output = bytearray(cls.list_len_len + list_len)
+        output[:cls.list_len_len] = cls._encode_number(list_len, cls.list_len_len)
+
+        pack_into = cls.posting_struct.pack_into
+        offset = cls.list_len_len
+        try:
+            for (doc_id, score) in map_content:
+                pack_into(output, offset, cls.doc_id_len, cls._doc_id_bytes(doc_id), score)
+                offset += entry_size
+        except struct.error:
+            raise OutOfBoundError('Score is too long ({} > 2**({} * 8))'.format(score, cls.score_len))
+        return output
+
+    @classmethod
+    def encode_posting_list(cls, key, map_content):
+        """
+        Encode a pair (key, value) in binary, in the format :
+        <key_size(1 byte)><key(key_size bytes)> <list_len(list_len_len bytes)>( (<doc_id(id_len bytes)><score(score_len bytes)>)*N )
+        :param key : string, a word, key of the map representing the index
+        :param map_content : list, list of tuples (docid, score) where:
+                - docid : uuid.UUID, id of a message
+                - score : integer, score of a message relative to some word
+        :return: bytearray, the pair encoded
+        """
+        bin_key = key.encode('utf-8')
+        output = bytearray(cls._encode_number(len(bin_key), cls.key_len_len))
+        output += bin_key
+        output += cls._encode_list(map_content)
+        return output
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------STRUCT DECODING---------------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+    @classmethod
+    def decode_number(cls, bin_number):
+        """
+        Convert a binary number into an integer
+        :param bin_number: bytes-like, binary (big endian) representation of a number
+        :return: integer, unsigned decimal representation of the input number
+        """
+        return int.from_bytes(bin_number, 'big')
+
+    @classmethod
+    def decode_list(cls, bin_list):
+        """
+        Decode an entire binary posting list of shape :
+        (<doc_id_len(doc_id_len_len bytes)><doc_id(doc_id_len bytes)><score(score_len bytes)>)*N
+        Trailing bytes which do not form a complete element are ignored.
+        :param bin_list: bytes-like, the binary representation of a posting list
+        :return: list, a list of tuples (doc_id, score) where each :
+            - doc_id : uuid.UUID, the unique id of a message
+            - score : integer, the score of this message relative to the keyword of this posting list
+        """
+        entry_size = cls.posting_struct.size
+        usable_len = len(bin_list) - len(bin_list) % entry_size
+        return [(uuid.UUID(bytes=bin_doc_id), score)
+                for (_, bin_doc_id, score) in cls.posting_struct.iter_unpack(memoryview(bin_list)[:usable_len])]
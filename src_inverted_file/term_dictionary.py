@@ -0,0 +1,308 @@
+# term_dictionary.py An index of the posting lists stored in an inverted file
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+import bisect
+import os
+import struct
+from collections import OrderedDict
+
+from src_inverted_file.atomic_file import atomic_write
+
+
+class TermDictionary(object):
+    """
+    Class made to locate the posting lists of an inverted file without scanning it.
+    It is saved as a sidecar file next to the inverted file (see dictionary_filename), in the format :
+    <magic(7 bytes)><if_size(8 bytes)><nb_terms(4 bytes)>
+    ( <key_size(1 byte)><key(key_size bytes)><position(8 bytes)><offset(8 bytes)><list_len(4 bytes)><doc_freq(4 bytes)>
+      <max_score(4 bytes)><min_length(4 bytes)><nb_skips(4 bytes)>(<skip_doc_id(16 bytes)>)*nb_skips
+      (<block_max_score(4 bytes)><block_min_length_per_score(4 bytes)>)*nb_skips )*nb_terms
+    if_size is the size of the inverted file when the dictionary was written, and is used to detect a stale sidecar.
+    The skips are the first doc_id of every block of block_size postings of a posting list, the block number i starting
+    at the position i * block_size * posting_len of the encoded posting list. They are only written for the disk
+    interfacers whose postings have a fixed size posting_len, and for the posting lists of more than one block.
+    The highest score of each block and the lowest ratio length / score of its postings (times
+    length_per_score_scale, rounded down) follow the skips, so that the ranking can skip whole blocks without decoding
+    them (see QueryEngine.block_upper_bound). A null block_max_score means that the bounds of the block are unknown.
+    The ratio bounds the score of a block much closer than its shortest document does, long documents having the
+    highest scores.
+    Initialize : None, terms are then added with add, in ascending order of keys
+
+    Attributes :
+        - __keys : list of string, the keys of the inverted file, sorted, searched with a binary search
+        - __entries : list of tuples (position, offset, list_len, doc_freq, max_score, min_length), the entry of each key
+          where :
+            - position : integer, the position of the record <key_size><key><list_len><posting list> in the inverted file
+            - offset : integer, the position of the encoded posting list itself in the inverted file
+            - list_len : integer, the length (in bytes) of the encoded posting list
+            - doc_freq : integer, the number of documents in the posting list
+            - max_score : integer, the highest score of the posting list (0 if unknown), to bound the ranking scores
+            - min_length : integer, the length of the shortest document of the posting list (0 if unknown)
+        - __skips : dictionary (index of a key: bytes), the concatenated skip doc_ids of the keys having some
+        - __block_bounds : dictionary (index of a key: bytes), the concatenated block_bound_struct of each block of the
+          keys having skips
+    """
+
+    magic = b'IEDICT4'
+    header_struct = struct.Struct('>QI')
+    entry_struct = struct.Struct('>QQIIII')
+    skip_count_struct = struct.Struct('>I')
+    block_bound_struct = struct.Struct('>II')
+    length_per_score_scale = 256
+    # number of postings of a block, and number of bytes of a skip doc_id
+    block_size = 128
+    skip_len = 16
+    # highest max_score or min_length which can be saved
+    max_bound = (1 << 32) - 1
+
+    # filename -> ((mtime, size) of the inverted file, TermDictionary), filled by open to avoid reloading at each query,
+    # least recently opened first. It holds at most max_loaded dictionaries (the index has a few dozens of files).
+    __loaded = OrderedDict()
+    max_loaded = 64
+
+    def __init__(self):
+        self.__keys = []
+        self.__entries = []
+        self.__skips = {}
+        self.__block_bounds = {}
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def __contains__(self, key):
+        return self.lookup(key) is not None
+
+    def keys(self):
+        """
+        :return: list of string, the keys of the inverted file, sorted
+        """
+        return list(self.__keys)
+
+    def items(self):
+        """
+        :return: iterator of tuples (key, (position, offset, list_len, doc_freq, max_score, min_length)), sorted by key
+        """
+        return zip(self.__keys, self.__entries)
+
+    def add(self, key, position, offset, list_len, doc_freq, max_score=0, min_length=0, skips=b'', block_bounds=None):
+        """
+        Register a posting list. Keys have to be added in ascending order, as they are in the inverted file.
+        :param key: string, the key of the posting list
+        :param position: integer, the position of the record in the inverted file
+        :param offset: integer, the position of the encoded posting list in the inverted file
+        :param list_len: integer, the length (in bytes) of the encoded posting list
+        :param doc_freq: integer, the number of documents in the posting list
+        :param max_score: integer, the highest score of the posting list. Default is 0 (unknown)
+        :param min_length: integer, the length of the shortest document of the posting list. Default is 0 (unknown)
+        :param skips: bytes, the concatenation of the skip_len bytes of the first doc_id of each block of the posting
+                      list (see skip_doc_id_bytes). Default is none
+        :param block_bounds: list of tuples (max_score, min_length_per_score), the score bounds of each block (see
+                             block_bounds). Default is None (unknown)
+        :return: None
+        """
+        if self.__keys and key <= self.__keys[-1]:
+            raise ValueError('Keys must be added in ascending order ({} <= {})'.format(key, self.__keys[-1]))
+        if skips:
+            self.__skips[len(self.__keys)] = bytes(skips)
+            if block_bounds is None:
+                block_bounds = [(0, 0)] * (len(skips) // self.skip_len)
+            self.__block_bounds[len(self.__keys)] = b''.join(self.block_bound_struct.pack(*bounds)
+                                                             for bounds in block_bounds)
+        self.__keys.append(key)
+        self.__entries.append((position, offset, list_len, doc_freq, max_score, min_length))
+
+    def lookup(self, key):
+        """
+        Binary search of a key
+        :param key: string, the key of the posting list
+        :return: tuple (position, offset, list_len, doc_freq, max_score, min_length) or None if the key is not in the
+                 inverted file
+        """
+        index = self.__index(key)
+        return self.__entries[index] if index is not None else None
+
+    def skips(self, key):
+        """
+        :param key: string, the key of the posting list
+        :return: list of bytes, the first doc_id of each block of the posting list (see skip_doc_id_bytes), sorted.
+                 Empty if the posting list has a single block, or if its blocks are unknown
+        """
+        index = self.__index(key)
+        skips = self.__skips.get(index, b'') if index is not None else b''
+        return [skips[start:start + self.skip_len] for start in range(0, len(skips), self.skip_len)]
+
+    def block_bounds(self, key):
+        """
+        :param key: string, the key of the posting list
+        :return: list of tuples (max_score, min_length_per_score), the highest score of each block of the posting list
+                 and the lowest ratio length / score of its postings times length_per_score_scale, (0, 0) for a block
+                 whose bounds are unknown. Empty if the posting list has no skips
+        """
+        index = self.__index(key)
+        block_bounds = self.__block_bounds.get(index, b'') if index is not None else b''
+        return list(self.block_bound_struct.iter_unpack(block_bounds))
+
+    def __index(self, key):
+        """
+        :param key: string, the key of a posting list
+        :return: integer, the index of the key in __keys, None if the key is not in the inverted file
+        """
+        index = bisect.bisect_left(self.__keys, key)
+        if index < len(self.__keys) and self.__keys[index] == key:
+            return index
+        return None
+
+    @classmethod
+    def skip_doc_id_bytes(cls, doc_id):
+        """
+        :param doc_id: uuid.UUID or integer, the id of a message
+        :return: bytes, the skip_len bytes representing the doc_id, ordered as the doc_ids themselves
+        """
+        if isinstance(doc_id, int):
+            return doc_id.to_bytes(cls.skip_len, 'big')
+        return doc_id.bytes
+
+    def doc_freq(self, key):
+        """
+        :param key: string, the key of the posting list
+        :return: integer, the number of documents containing the key (0 if the key is unknown)
+        """
+        entry = self.lookup(key)
+        return entry[3] if entry is not None else 0
+
+    def score_bounds(self, key):
+        """
+        :param key: string, the key of the posting list
+        :return: tuple (max_score, min_length), the highest score of the posting list and the length of its shortest
+                 document, or None if they are unknown (or if the key is not in the inverted file)
+        """
+        entry = self.lookup(key)
+        if entry is None or entry[4] == 0:
+            return None
+        return entry[4], entry[5]
+
+# ---------------------------------------------------------------------------------------------------------------------#
+# ---------------------------------------------------------SAVE AND LOAD-----------------------------------------------#
+# ---------------------------------------------------------------------------------------------------------------------#
+
+    @staticmethod
+    def dictionary_filename(if_filename):
+        """
+        :param if_filename: string, the path of an inverted file
+        :return: string, the path of its term dictionary
+        """
+        return if_filename + '.dict'
+
+    def save(self, if_filename):
+        """
+        Save the dictionary next to its inverted file, which must already be written
+        :param if_filename: string, the path of the inverted file described by this dictionary
+        :return: None
+        """
+        output = bytearray(self.magic)
+        output += self.header_struct.pack(os.path.getsize(if_filename), len(self.__keys))
+        for (index, (key, entry)) in enumerate(zip(self.__keys, self.__entries)):
+            bin_key = key.encode('utf-8')
+            output.append(len(bin_key))
+            output += bin_key
+            output += self.entry_struct.pack(*entry)
+            skips = self.__skips.get(index, b'')
+            output += self.skip_count_struct.pack(len(skips) // self.skip_len)
+            output += skips
+            output += self.__block_bounds.get(index, b'')
+        with atomic_write(self.dictionary_filename(if_filename)) as f:
+            f.write(output)
+
+    @classmethod
+    def load(cls, if_filename):
+        """
+        Load the dictionary of an inverted file
+        :param if_filename: string, the path of the inverted file
+        :return: TermDictionary, or None if there is no dictionary, or if it does not match the inverted file
+        """
+        try:
+            with open(cls.dictionary_filename(if_filename), 'rb') as f:
+                content = f.read()
+            if_size = os.path.getsize(if_filename)
+        except OSError:
+            return None
+
+        if content[:len(cls.magic)] != cls.magic:
+            return None
+        block_bound_size = cls.block_bound_struct.size
+        cursor = len(cls.magic)
+        expected_size, nb_terms = cls.header_struct.unpack_from(content, cursor)
+        if expected_size != if_size:
+            return None
+        cursor += cls.header_struct.size
+
+        dictionary = cls()
+        entry_size = cls.entry_struct.size
+        for index in range(nb_terms):
+            key_len = content[cursor]
+            cursor += 1
+            dictionary.__keys.append(content[cursor:cursor + key_len].decode('utf-8'))
+            cursor += key_len
+            dictionary.__entries.append(cls.entry_struct.unpack_from(content, cursor))
+            cursor += entry_size
+            (nb_skips,) = cls.skip_count_struct.unpack_from(content, cursor)
+            cursor += cls.skip_count_struct.size
+            if nb_skips:
+                dictionary.__skips[index] = content[cursor:cursor + nb_skips * cls.skip_len]
+                cursor += nb_skips * cls.skip_len
+                dictionary.__block_bounds[index] = content[cursor:cursor + nb_skips * block_bound_size]
+                cursor += nb_skips * block_bound_size
+        return dictionary
+
+    @classmethod
+    def open(cls, if_filename):
+        """
+        Same as load, but keep the last loaded dictionary of each inverted file in memory
+        as long as the inverted file is not modified. Only the max_loaded most recently opened dictionaries are kept.
+        :param if_filename: string, the path of the inverted file
+        :return: TermDictionary, or None if there is no valid dictionary
+        """
+        try:
+            stat = os.stat(if_filename)
+        except OSError:
+            cls.evict(if_filename)
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        cached = cls.__loaded.get(if_filename)
+        if cached is not None and cached[0] == signature:
+            cls.__loaded.move_to_end(if_filename)
+            return cached[1]
+        dictionary = cls.load(if_filename)
+        if dictionary is not None:
+            cls.__loaded[if_filename] = (signature, dictionary)
+            cls.__loaded.move_to_end(if_filename)
+            while len(cls.__loaded) > cls.max_loaded:
+                cls.__loaded.popitem(last=False)
+        else:
+            cls.__loaded.pop(if_filename, None)
+        return dictionary
+
+    @classmethod
+    def evict(cls, if_filename):
+        """
+        Forget the dictionary kept in memory by open for an inverted file, typically when the file is removed
+        :param if_filename: string, the path of the inverted file
+        :return: None
+        """
+        cls.__loaded.pop(if_filename, None)
@@ -16,10 +16,168 @@
 # along with this program; see the file LICENSE.  If not see
 # <http://www.gnu.org/licenses/>.
 
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
 import nltk
 
-# TODO: "punkt" local caching
-nltk.download('punkt')
+from src_inverted_file.atomic_file import atomic_write
+from src_inverted_file.metrics import metrics
+
+# directory where the nltk resources are looked for first, and cached when they have to be downloaded
+NLTK_DATA_DIRECTORY = os.environ.get('IE_BOT_NLTK_DATA',
+                                     os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nltk_data'))
+
+# whether punkt has already been found in this process
+_punkt_ready = False
+
+
+def ensure_punkt():
+    """
+    Make sure the punkt models used by nltk.word_tokenize can be loaded, without touching the network if possible :
+    NLTK_DATA_DIRECTORY and the default nltk data paths are searched first, and punkt is only downloaded (into
+    NLTK_DATA_DIRECTORY) if it is found nowhere. The check is only done once per process.
+    Raise LookupError if punkt is not available and can not be downloaded.
+    """
+    global _punkt_ready
+    if _punkt_ready:
+        return
+    if NLTK_DATA_DIRECTORY not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIRECTORY)
+    try:
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        if not nltk.download('punkt', download_dir=NLTK_DATA_DIRECTORY, quiet=True):
+            raise LookupError("punkt is not in {} and can not be downloaded".format(NLTK_DATA_DIRECTORY))
+    _punkt_ready = True
+
+
+# One alternative of the regex matches one token, in a single pass over the text :
+TOKEN_REGEX = re.compile(r"""
+      ```.+?```                                         # code block
+    | `[^`\n]+`                                         # inline code
+    | (?:https?://|www\.)[^\s<>"]*[^\s<>"'.,;:!?)\]}]   # url, without the punctuation which follows it
+    | <(?:@[!&]?|\#)\d+>                                 # discord mention of a user, a role or a channel
+    | @\w+                                              # plain mention
+    | \w+(?:['’.-]\w+)*                                 # word, with inner apostrophes, dots or hyphens
+    | [^\w\s]                                           # any other lone symbol
+""", re.VERBOSE | re.DOTALL)
+
+# prefixes of the tokens which are kept verbatim (urls, code, mentions) : they are not stemmed
+VERBATIM_PREFIXES = ('http://', 'https://', 'www.', '`', '<@', '<#', '@')
+
+# the keys of the inverted files have their size on a single byte (key_len_len) : longer tokens (urls, code blocks)
+# are cut and suffixed with a hash of the whole token (see cap_token). A character takes at most 4 bytes in utf-8,
+# so tokens of at most MAX_TOKEN_CHARACTERS characters do not need to be encoded to be checked.
+MAX_TOKEN_BYTES = 255
+MAX_TOKEN_CHARACTERS = MAX_TOKEN_BYTES // 4
+TOKEN_HASH_LEN = 16
+
+
+def cap_token(token):
+    """
+    :param token: string, a token
+    :return: string, the token if it takes at most MAX_TOKEN_BYTES bytes in utf-8, otherwise its beginning followed by
+             '#' and the TOKEN_HASH_LEN first hexadecimal digits of its sha1, taking at most MAX_TOKEN_BYTES bytes.
+             Two long tokens sharing their beginning still give distinct keys.
+    """
+    bin_token = token.encode('utf-8')
+    if len(bin_token) <= MAX_TOKEN_BYTES:
+        return token
+    digest = hashlib.sha1(bin_token).hexdigest()[:TOKEN_HASH_LEN]
+    # a character cut in the middle of its bytes is dropped
+    prefix = bin_token[:MAX_TOKEN_BYTES - TOKEN_HASH_LEN - 1].decode('utf-8', 'ignore')
+    return prefix + '#' + digest
+
+
+def regex_word_tokenize(paragraph):
+    """
+    Tokenizer backend made to be faster than nltk.word_tokenize, and to keep urls, code and mentions as single tokens
+    instead of splitting them on their punctuation.
+    Parameters :
+        - paragraph : The text to process
+    Return :
+        - a list of tokens
+    """
+    return TOKEN_REGEX.findall(paragraph)
+
+
+class StemCache(object):
+    """
+    Class made to memoize a stemmer : chat vocabulary is very repetitive, so most tokens have already been stemmed.
+    It is a bounded LRU cache : once full, the least recently used token is forgotten.
+    Initialize :
+        - max_size : integer, the maximum number of stems kept. 0 disables the cache
+    Attributes :
+        - max_size : integer, the maximum number of stems kept
+        - hits : integer, the number of stems found in the cache
+        - misses : integer, the number of stems computed
+        - __stems : OrderedDict (token: stem), from the least to the most recently used
+    """
+
+    def __init__(self, max_size=65536):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__stems = OrderedDict()
+
+    def __len__(self):
+        return len(self.__stems)
+
+    def stem(self, token, stem_function):
+        """
+        Get the stem of a token from the cache, or compute it and remember it
+        :param token: string, the token to stem
+        :param stem_function: function of prototype [string function(token)], the stemmer
+        :return: string, the stem of the token
+        """
+        stem = self.__stems.get(token)
+        if stem is not None:
+            self.hits += 1
+            self.__stems.move_to_end(token)
+            return stem
+
+        self.misses += 1
+        stem = stem_function(token)
+        if self.max_size > 0:
+            self.__stems[token] = stem
+            if len(self.__stems) > self.max_size:
+                self.__stems.popitem(last=False)
+        return stem
+
+    def hit_rate(self):
+        """
+        :return: float, the ratio of stems found in the cache (0 if the cache was never used)
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def save(self, filename):
+        """
+        Save the cached stems as a json list of pairs [token, stem], from the least to the most recently used
+        :param filename: string, the path of the json file
+        :return: None
+        """
+        with atomic_write(filename) as f:
+            f.write(json.dumps(list(self.__stems.items())).encode('utf-8'))
+
+    def load(self, filename):
+        """
+        Add the stems saved in a json file to the cache, if the file exists
+        :param filename: string, the path of the json file
+        :return: None
+        """
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'r') as f:
+            stems = json.load(f)
+        for (token, stem) in stems[-self.max_size:] if self.max_size > 0 else []:
+            self.__stems[token] = stem
+            self.__stems.move_to_end(token)
 
 
 class Tokenizer:
@@ -29,34 +187,88 @@ class Tokenizer:
     Initialize :
             - punctuation : A list of symbols you want to remove from the tokens if they are found alone.
                 Default is ['!', '?', '.', ',', ';', ':', '"', "'", '(', ')', '-', "''", '``']
+            - backend : A function splitting a text into a list of tokens. Default is None, which stands for
+                nltk.word_tokenize. regex_word_tokenize is a faster alternative, which keeps urls as single tokens.
             - stemming : Whether you want to perform stemming on tokens or not. The method used is Porter's algorithm.
+            - stem_cache_size : The maximum number of stems memoized (see StemCache). 0 disables the cache.
+            - stem_cache_file : A json file where the stem cache is loaded from, and saved to by save_stem_cache.
+                Default is None, the cache only lives as long as the Tokenizer.
     Attributes :
-        - __punctuation : A list of lone symbols to filter from tokens.
+        - __punctuation : A frozenset of lone symbols to filter from tokens.
+        - __backend : The function splitting a text into tokens, None for nltk.word_tokenize.
         - __stemmer : A chosen stemmer to use.
+        - stem_cache : The StemCache memoizing __stemmer.
+        - stem_cache_file : The json file of the stem cache, or None.
     """
 
-    def __init__(self, punctuation=['!', '?', '.', ',', ';', ':', '"', "'", '(', ')', '-', "''", '``'], stemming=True):
-        self.__punctuation = punctuation
+    def __init__(self, punctuation=['!', '?', '.', ',', ';', ':', '"', "'", '(', ')', '-', "''", '``'], stemming=True,
+                 stem_cache_size=65536, stem_cache_file=None, backend=None):
+        self.__punctuation = frozenset(punctuation)
+        self.__backend = backend
         if stemming:
             self.__stemmer = nltk.stem.porter.PorterStemmer()
+        self.stem_cache = StemCache(stem_cache_size)
+        self.stem_cache_file = stem_cache_file
+        if stem_cache_file is not None:
+            self.stem_cache.load(stem_cache_file)
+
+    def save_stem_cache(self, filename=None):
+        """
+        Save the stem cache, to reuse it in a later run
+        Parameters :
+            - filename : The json file to write. Default is stem_cache_file.
+        """
+        filename = filename if filename is not None else self.stem_cache_file
+        if filename is not None:
+            self.stem_cache.save(filename)
 
     def word_tokenize(self, paragraph):
         """
-        - Tokenize the input string to a token list using nltk.world_tokenize
+        - Tokenize the input string to a token list using self.__backend (nltk.world_tokenize by default)
         - Remove single punctuation symbols found in self.__punctuation
-        - Try to stem using self.__stemmer. If there is none does nothing instead.
+        - Try to stem using self.__stemmer, through self.stem_cache. If there is none does nothing instead.
+          Urls, code and mentions are not stemmed.
+        - Cap the tokens too long to be keys of an inverted file (see cap_token)
         Parameters :
             - paragraph : The text to process
         Return :
             - a list of tokens
         """
-        tokens = nltk.word_tokenize(paragraph)
-        tokens = [token for token in tokens if token not in self.__punctuation]
+        start_time = time.perf_counter()
+        if self.__backend is None:
+            ensure_punkt()
+            tokens = nltk.word_tokenize(paragraph)
+        else:
+            tokens = self.__backend(paragraph)
+        punctuation = self.__punctuation
+        tokens = [token for token in tokens if token not in punctuation]
+        split_time = time.perf_counter()
+        metrics.add_time('tokenizer.split', split_time - start_time)
+        metrics.count('tokens', len(tokens))
 
         try:
-            tokens = [self.__stemmer.stem(token) for token in tokens]
+            stem = self.__stemmer.stem
         except AttributeError:
             # If stemmer is not defined
-            pass
+            return self.__cap_tokens(tokens)
+
+        stem_cache = self.stem_cache
+        (hits, misses) = (stem_cache.hits, stem_cache.misses)
+        cached_stem = stem_cache.stem
+        tokens = [token if token.startswith(VERBATIM_PREFIXES) else cached_stem(token, stem) for token in tokens]
+        metrics.add_time('tokenizer.stem', time.perf_counter() - split_time)
+        metrics.count('stem_cache.hits', stem_cache.hits - hits)
+        metrics.count('stem_cache.misses', stem_cache.misses - misses)
+        return self.__cap_tokens(tokens)
 
-        return tokens
+    @staticmethod
+    def __cap_tokens(tokens):
+        """
+        Parameters :
+            - tokens : A list of tokens
+        Return :
+            - the list of tokens, where the tokens longer than MAX_TOKEN_BYTES bytes are replaced (see cap_token)
+        """
+        if all(len(token) <= MAX_TOKEN_CHARACTERS for token in tokens):
+            return tokens
+        return [cap_token(token) if len(token) > MAX_TOKEN_CHARACTERS else token for token in tokens]
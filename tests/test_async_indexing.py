@@ -0,0 +1,145 @@
+# test_async_indexing.py Parallel and streamed indexing, compared with a sequential InvertedFile
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import asyncio
+import datetime
+import importlib.util
+import os
+import random
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from src_inverted_file.async_indexing import InlineExecutor, PortableMessage, build_inverted_file_parallel, \
+    generate_inverted_file_async, generate_inverted_file_streaming
+from src_inverted_file.document_store import DocumentStore
+from src_inverted_file.inverted_file import InvertedFile
+from src_inverted_file.score import score
+
+# the workers tokenize the messages with Tokenizer, which needs nltk
+HAS_NLTK = importlib.util.find_spec('nltk') is not None
+if HAS_NLTK:
+    from src_inverted_file.formatted_document import FormattedDocument
+    from src_inverted_file.tokenizer import Tokenizer
+
+VOCABULARY = ['books', 'reading', 'library', 'novel', 'poems', 'author', 'chapter', 'science', 'history', 'review']
+
+
+def synthetic_messages(rand, nb_messages):
+    """
+    :param rand: random.Random
+    :param nb_messages: integer, the number of messages
+    :return: list of PortableMessage, each of them written by its own author (1, 2, ...) so that it can be found back
+             in an inverted file whatever its doc_id
+    """
+    start = datetime.datetime(2018, 1, 1)
+    return [PortableMessage(" ".join(rand.choices(VOCABULARY, k=rand.randint(1, 15))), str(index + 1),
+                            start + datetime.timedelta(minutes=index),
+                            [{'url': 'https://example.com/{}'.format(index)}] if index % 7 == 0 else [])
+            for index in range(nb_messages)]
+
+
+def describe(filename):
+    """
+    :param filename: string, the path of an inverted file
+    :return: dictionary (key: list of tuples (author, score)), the posting lists of the file, where each doc_id is
+             replaced by the author of its message (the doc_ids are generated anew each time a message is indexed)
+    """
+    inverted_file = InvertedFile(score)
+    inverted_file.read_posting_lists(None, filename)
+    with DocumentStore.open(filename) as store:
+        return {key: sorted((store.document(doc_id).author, posting_score) for (doc_id, posting_score) in posting_list)
+                for (key, posting_list) in inverted_file.map.items()}
+
+
+async def stream(messages):
+    """
+    :param messages: list of PortableMessage
+    :return: yield the messages one by one, standing for ChannelHistory
+    """
+    for message in messages:
+        await asyncio.sleep(0)
+        yield message
+
+
+@unittest.skipUnless(HAS_NLTK, "nltk is not installed")
+class TestAsyncIndexing(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.messages = synthetic_messages(random.Random(6), 230)
+        filename = os.path.join(cls.directory.name, 'sequential.if')
+        inverted_file = InvertedFile(score)
+        for document in FormattedDocument(messages=cls.messages, tokenizer=Tokenizer()).matches:
+            inverted_file.add_document(document)
+        inverted_file.save(filename)
+        cls.expected = describe(filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.filename = os.path.join(self.directory.name, 'index.if')
+        self.progress = []
+
+    async def report_progress(self, nb_indexed, nb_messages):
+        self.progress.append((nb_indexed, nb_messages))
+
+    def test_parallel_build(self):
+        # several shards per process, merged on disc
+        build_inverted_file_parallel(self.messages, self.filename, processes=2, chunk_size=40)
+        self.assertEqual(describe(self.filename), self.expected)
+
+    def test_async_chunks(self):
+        async def run():
+            with ProcessPoolExecutor(2) as executor:
+                return await generate_inverted_file_async(self.messages, self.filename, executor,
+                                                          progress=self.report_progress, chunk_size=50)
+        self.assertEqual(asyncio.run(run()), self.filename)
+        self.assertEqual(describe(self.filename), self.expected)
+        self.assertEqual(self.progress, [(nb_indexed, 230) for nb_indexed in (50, 100, 150, 200, 230)])
+
+    def test_streaming_batches(self):
+        async def run():
+            with ProcessPoolExecutor(2) as executor:
+                return await generate_inverted_file_streaming(stream(self.messages), self.filename, executor,
+                                                              batch_size=40, max_pending=2,
+                                                              progress=self.report_progress)
+        self.assertEqual(asyncio.run(run()), (self.filename, 230))
+        self.assertEqual(describe(self.filename), self.expected)
+        self.assertEqual(self.progress[-1], (230, 230))
+        self.assertEqual([nb_indexed for (nb_indexed, _) in self.progress], [40, 80, 120, 160, 200, 230])
+        # the chunks are removed once merged
+        self.assertEqual(sorted(name for name in os.listdir(self.directory.name) if 'chunk' in name), [])
+
+    def test_streaming_single_batch_and_empty_stream(self):
+        async def run(messages):
+            return await generate_inverted_file_streaming(stream(messages), self.filename, InlineExecutor(),
+                                                          batch_size=1000)
+        # a single batch is renamed into the inverted file instead of being merged
+        self.assertEqual(asyncio.run(run(self.messages)), (self.filename, 230))
+        self.assertEqual(describe(self.filename), self.expected)
+        self.assertEqual(asyncio.run(run([])), (None, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
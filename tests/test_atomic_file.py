@@ -0,0 +1,73 @@
+# test_atomic_file.py A file written atomically is either the previous one or the complete new one
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import os
+import tempfile
+import unittest
+
+from src_inverted_file.atomic_file import atomic_write
+
+
+class TestAtomicWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'index.if')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self):
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    def test_replaces_the_file(self):
+        with atomic_write(self.filename) as f:
+            f.write(b'first')
+        with atomic_write(self.filename, buffer_size=4) as f:
+            f.write(b'second ')
+            # the former file is still there until the block ends
+            self.assertEqual(self.read(), b'first')
+            f.write(b'version')
+        self.assertEqual(self.read(), b'second version')
+        self.assertEqual(os.listdir(self.directory.name), ['index.if'])
+
+    def test_target_intact_when_the_writer_raises(self):
+        with atomic_write(self.filename) as f:
+            f.write(b'complete')
+        for error in (ValueError, KeyboardInterrupt):
+            with self.assertRaises(error):
+                with atomic_write(self.filename) as f:
+                    f.write(b'trunc')
+                    raise error()
+            self.assertEqual(self.read(), b'complete')
+            # no temporary file is left behind
+            self.assertEqual(os.listdir(self.directory.name), ['index.if'])
+
+    def test_no_file_when_the_first_writer_raises(self):
+        with self.assertRaises(ValueError):
+            with atomic_write(self.filename) as f:
+                f.write(b'trunc')
+                raise ValueError()
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
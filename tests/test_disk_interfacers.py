@@ -0,0 +1,259 @@
+# test_disk_interfacers.py Round trips of the posting lists through every disk interfacer
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import os
+import random
+import tempfile
+import unittest
+import uuid
+
+from src_inverted_file.ie_message import IEMessage
+from src_inverted_file.inverted_file import DOCUMENT_LENGTH_KEY, InvertedFile
+from src_inverted_file.inverted_file_builder import InvertedFileBuilder
+from src_inverted_file.mapped_inverted_file import MappedInvertedFile
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer, OutOfBoundError
+from src_inverted_file.positional_disk_interfacer import PositionalDiskInterfacer
+from src_inverted_file.score import score
+from src_inverted_file.smart_disk_interfacer import DocIdMap, SmartDiskInterfacer
+from src_inverted_file.struct_disk_interfacer import StructDiskInterfacer
+
+
+def random_postings(rand, nb_postings, max_score=1000):
+    """
+    :param rand: random.Random
+    :param nb_postings: integer, the number of postings
+    :param max_score: integer, the highest score
+    :return: list of tuples (uuid.UUID, integer), sorted by doc_id
+    """
+    return sorted((uuid.UUID(int=rand.getrandbits(128)), rand.randint(0, max_score)) for _ in range(nb_postings))
+
+
+def random_documents(rand, nb_documents, vocabulary):
+    """
+    :param rand: random.Random
+    :param nb_documents: integer, the number of documents
+    :param vocabulary: list of string, the words of the documents
+    :return: list of IEMessage
+    """
+    documents = []
+    for _ in range(nb_documents):
+        document = IEMessage()
+        document.text = rand.choices(vocabulary, k=rand.randint(1, 12))
+        documents.append(document)
+    return documents
+
+
+def decode_record(interfacer, encoded):
+    """
+    :param interfacer: a disk interfacer
+    :param encoded: bytearray, a record <key_size><key><list_len><posting list> given by encode_posting_list
+    :return: tuple (key, posting_list), the decoded record
+    """
+    key_len = interfacer.decode_number(encoded[:interfacer.key_len_len])
+    cursor = interfacer.key_len_len
+    key = bytes(encoded[cursor:cursor + key_len]).decode('utf-8')
+    cursor += key_len
+    list_len = interfacer.decode_number(encoded[cursor:cursor + interfacer.list_len_len])
+    cursor += interfacer.list_len_len
+    if cursor + list_len != len(encoded):
+        raise AssertionError('list_len {} does not match the record'.format(list_len))
+    return key, interfacer.decode_list(encoded[cursor:])
+
+
+class TestPostingListRoundTrip(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(0)
+
+    def check_round_trip(self, interfacer, postings, key='clé'):
+        self.assertEqual(decode_record(interfacer, interfacer.encode_posting_list(key, postings)), (key, postings))
+
+    def test_naive(self):
+        for nb_postings in (0, 1, 300):
+            self.check_round_trip(NaiveDiskInterfacer, random_postings(self.rand, nb_postings))
+
+    def test_struct(self):
+        for nb_postings in (0, 1, 300):
+            self.check_round_trip(StructDiskInterfacer, random_postings(self.rand, nb_postings))
+
+    def test_struct_writes_the_naive_layout(self):
+        postings = random_postings(self.rand, 50)
+        self.assertEqual(StructDiskInterfacer.encode_posting_list('word', postings),
+                         NaiveDiskInterfacer.encode_posting_list('word', postings))
+
+    def test_smart_with_doc_id_map(self):
+        postings = random_postings(self.rand, 300, max_score=1 << 40)
+        interfacer = SmartDiskInterfacer(DocIdMap())
+        (key, decoded) = decode_record(interfacer, interfacer.encode_posting_list('word', postings))
+        self.assertEqual(sorted(decoded), postings)
+
+    def test_smart_with_integer_doc_ids(self):
+        postings = sorted(self.rand.sample(range(1 << 30), 300))
+        postings = [(doc_id, self.rand.randint(0, 1 << 20)) for doc_id in postings]
+        self.check_round_trip(SmartDiskInterfacer(), postings)
+
+    def test_positional(self):
+        postings = []
+        for (doc_id, _) in random_postings(self.rand, 100):
+            positions = tuple(sorted(self.rand.sample(range(10000), self.rand.randint(1, 20))))
+            postings.append((doc_id, positions))
+        self.check_round_trip(PositionalDiskInterfacer, postings)
+
+    def test_out_of_bound_score(self):
+        postings = [(uuid.uuid1(), 1 << 40)]
+        for interfacer in (NaiveDiskInterfacer, StructDiskInterfacer):
+            with self.assertRaises(OutOfBoundError):
+                interfacer.encode_posting_list('word', postings)
+
+
+class TestInvertedFileRoundTrip(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(1)
+        self.vocabulary = ['w{}'.format(index) for index in range(40)]
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'index.if')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def expected_posting_lists(self, documents):
+        """
+        :param documents: list of IEMessage
+        :return: dictionary (key: list of tuples (doc_id, score)), the posting lists of the documents, sorted
+        """
+        expected = {DOCUMENT_LENGTH_KEY: sorted((document.id, document.length) for document in documents)}
+        for document in documents:
+            for token in set(document.text):
+                expected.setdefault(token, []).append((document.id, document.text.count(token)))
+        return {key: sorted(posting_list) for (key, posting_list) in expected.items()}
+
+    def check_saved(self, documents, interfacer, filename):
+        expected = self.expected_posting_lists(documents)
+        with MappedInvertedFile(filename, interfacer) as mapped:
+            self.assertEqual(mapped.keys(), sorted(expected))
+            for (key, posting_list) in expected.items():
+                self.assertEqual(sorted(mapped.posting_list(key).decode()), posting_list)
+                self.assertEqual(mapped.doc_freq(key), len(posting_list))
+
+        inverted_file = InvertedFile(score, interfacer)
+        inverted_file.read_posting_lists(None, filename)
+        self.assertEqual({key: sorted(posting_list) for (key, posting_list) in inverted_file.map.items()}, expected)
+
+    def test_save_and_read(self):
+        documents = random_documents(self.rand, 200, self.vocabulary)
+        for interfacer in (NaiveDiskInterfacer, StructDiskInterfacer, SmartDiskInterfacer(DocIdMap())):
+            inverted_file = InvertedFile(score, interfacer)
+            for document in documents:
+                inverted_file.add_document(document)
+            inverted_file.save(self.filename)
+            self.check_saved(documents, interfacer, self.filename)
+
+    def test_doc_id_map_is_saved_with_the_file(self):
+        # the files are read and merged with a new interfacer, as another process would do
+        documents = random_documents(self.rand, 300, self.vocabulary)
+        filenames = []
+        for start in range(0, len(documents), 100):
+            filename = os.path.join(self.directory.name, 'part_{}.if'.format(start))
+            inverted_file = InvertedFile(score, SmartDiskInterfacer(DocIdMap()))
+            for document in documents[start:start + 100]:
+                inverted_file.add_document(document)
+            inverted_file.save(filename)
+            self.assertIn(DocIdMap.map_filename(filename), InvertedFile.sidecar_filenames(filename))
+            self.assertTrue(os.path.exists(DocIdMap.map_filename(filename)))
+            self.check_saved(documents[start:start + 100], SmartDiskInterfacer(DocIdMap()), filename)
+            filenames.append(filename)
+
+        InvertedFile.merge_many_inverted_files(self.filename, filenames, SmartDiskInterfacer(DocIdMap()))
+        self.check_saved(documents, SmartDiskInterfacer(DocIdMap()), self.filename)
+        InvertedFile.remove_inverted_file(self.filename)
+        self.assertFalse(os.path.exists(DocIdMap.map_filename(self.filename)))
+
+    def test_close_with_live_posting_lists(self):
+        documents = random_documents(self.rand, 50, self.vocabulary)
+        inverted_file = InvertedFile(score)
+        for document in documents:
+            inverted_file.add_document(document)
+        inverted_file.save(self.filename)
+
+        # a posting list returned by the file may outlive it, the map is then closed when the list is released
+        with MappedInvertedFile(self.filename) as mapped:
+            posting_list = mapped.posting_list('w1')
+        self.assertEqual(sorted(posting_list.decode()), self.expected_posting_lists(documents)['w1'])
+        mapped.close()
+
+    def test_positions(self):
+        documents = random_documents(self.rand, 100, self.vocabulary)
+        inverted_file = InvertedFile(score, positional=True)
+        for document in documents:
+            inverted_file.add_document(document)
+        inverted_file.save(self.filename)
+
+        with MappedInvertedFile(InvertedFile.positions_filename(self.filename), PositionalDiskInterfacer) as mapped:
+            for document in documents:
+                for (position, token) in enumerate(document.text):
+                    found = dict(mapped.posting_list(token).find([document.id]))
+                    self.assertIn(position, found[document.id])
+
+    def test_spilled_build(self):
+        # a budget of a few postings spills many runs, which are decoded again to be merged
+        documents = random_documents(self.rand, 300, self.vocabulary)
+        for interfacer in (NaiveDiskInterfacer, StructDiskInterfacer):
+            builder = InvertedFileBuilder(score, interfacer, memory_budget=4096, run_directory=self.directory.name)
+            builder.add_documents(documents)
+            self.assertGreater(len(builder.runs), 1)
+            builder.finish(self.filename)
+            self.check_saved(documents, interfacer, self.filename)
+
+    def test_builder_writes_the_same_files(self):
+        documents = random_documents(self.rand, 300, self.vocabulary)
+        inverted_file = InvertedFile(score, StructDiskInterfacer, positional=True)
+        for document in documents:
+            inverted_file.add_document(document)
+        inverted_file.save(self.filename)
+        built_filename = os.path.join(self.directory.name, 'built.if')
+        builder = InvertedFileBuilder(score, StructDiskInterfacer, memory_budget=8192,
+                                      run_directory=self.directory.name, positional=True)
+        builder.add_documents(documents)
+        builder.finish(built_filename)
+
+        for (path, built_path) in zip([self.filename] + InvertedFile.sidecar_filenames(self.filename),
+                                      [built_filename] + InvertedFile.sidecar_filenames(built_filename)):
+            self.assertEqual(os.path.exists(path), os.path.exists(built_path), os.path.basename(path))
+            if os.path.exists(path):
+                with open(path, 'rb') as f, open(built_path, 'rb') as built_f:
+                    self.assertEqual(f.read(), built_f.read(), os.path.basename(path))
+
+    def test_merge_keeps_every_document(self):
+        documents = random_documents(self.rand, 300, self.vocabulary)
+        filenames = []
+        for start in range(0, len(documents), 100):
+            filename = os.path.join(self.directory.name, 'part_{}.if'.format(start))
+            inverted_file = InvertedFile(score, StructDiskInterfacer)
+            for document in documents[start:start + 100]:
+                inverted_file.add_document(document)
+            inverted_file.save(filename)
+            filenames.append(filename)
+        InvertedFile.merge_many_inverted_files(self.filename, filenames, StructDiskInterfacer)
+        self.check_saved(documents, StructDiskInterfacer, self.filename)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+# test_document_store.py Lengths read in place from the document stores, compared with a dictionary
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import os
+import random
+import tempfile
+import unittest
+import uuid
+
+from src_inverted_file.document_store import DocumentLengths, DocumentStore, DocumentStoreWriter
+
+
+def random_lengths(rand, nb_documents, nb_shared_highs=0):
+    """
+    :param rand: random.Random
+    :param nb_documents: integer, the number of documents
+    :param nb_shared_highs: integer, the number of documents sharing their 64 high bits with another one
+    :return: dictionary (uuid.UUID: integer), the length of each document
+    """
+    doc_ids = [uuid.UUID(int=rand.getrandbits(128)) for _ in range(nb_documents)]
+    doc_ids += [uuid.UUID(int=(doc_id.int >> 64 << 64) | rand.getrandbits(64)) for doc_id in doc_ids[:nb_shared_highs]]
+    return {doc_id: rand.randint(1, 500) for doc_id in doc_ids}
+
+
+def write_lengths(filename, lengths):
+    """
+    :param filename: string, the path of the store
+    :param lengths: dictionary (uuid.UUID: integer), the length of each document
+    :return: None
+    """
+    writer = DocumentStoreWriter()
+    for (doc_id, length) in lengths.items():
+        writer.add(doc_id, length)
+    writer.save(filename)
+
+
+class TestDocumentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(10)
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'index.if.docs')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lengths_of(self):
+        lengths = random_lengths(self.rand, 5000, nb_shared_highs=300)
+        write_lengths(self.filename, lengths)
+        absent = list(random_lengths(self.rand, 500))
+        with DocumentStore(self.filename) as store:
+            # dense, sparse, and with documents which are not in the store
+            for doc_ids in (sorted(lengths), sorted(self.rand.sample(sorted(lengths), 40)),
+                            sorted(self.rand.sample(sorted(lengths), 2500) + absent), absent[:1]):
+                expected = [lengths.get(doc_id, -1) for doc_id in doc_ids]
+                self.assertEqual(store.lengths_of(doc_ids, -1)[0], expected)
+                self.assertEqual([store.lengths[store.dense_id(doc_id)] if doc_id in lengths else -1
+                                  for doc_id in doc_ids], expected)
+
+            # the search of a list goes on from the position returned for the previous one
+            doc_ids = sorted(self.rand.sample(sorted(lengths), 1000) + absent)
+            position = 0
+            for start in range(0, len(doc_ids), 70):
+                (found, position) = store.lengths_of(doc_ids[start:start + 70], -1, position)
+                self.assertEqual(found, [lengths.get(doc_id, -1) for doc_id in doc_ids[start:start + 70]])
+
+    def test_newest_store_wins(self):
+        lengths = random_lengths(self.rand, 300)
+        newer = {doc_id: length + 1 for (doc_id, length) in self.rand.sample(sorted(lengths.items()), 100)}
+        newer.update(random_lengths(self.rand, 50))
+        write_lengths(self.filename, lengths)
+        write_lengths(self.filename + '2', newer)
+        with DocumentStore(self.filename) as store, DocumentStore(self.filename + '2') as newer_store:
+            expected = dict(lengths)
+            expected.update(newer)
+            doc_ids = sorted(expected)
+            document_lengths = DocumentLengths([store, newer_store])
+            self.assertEqual(document_lengths.lengths_of(doc_ids), [expected[doc_id] for doc_id in doc_ids])
+            self.assertEqual([document_lengths.get(doc_id) for doc_id in doc_ids],
+                             [expected[doc_id] for doc_id in doc_ids])
+
+    def test_merge(self):
+        lengths = random_lengths(self.rand, 200)
+        newer = random_lengths(self.rand, 100)
+        write_lengths(self.filename, lengths)
+        write_lengths(self.filename + '2', newer)
+        DocumentStore.merge(self.filename + '3', [self.filename, self.filename + '2'])
+        lengths.update(newer)
+        doc_ids = sorted(lengths)
+        with DocumentStore(self.filename + '3') as store:
+            self.assertEqual(list(store.lengths_items()), [(doc_id, lengths[doc_id]) for doc_id in doc_ids])
+            self.assertEqual(store.lengths_of(doc_ids)[0], [lengths[doc_id] for doc_id in doc_ids])
+            self.assertEqual(store.document(doc_ids[7]).length, lengths[doc_ids[7]])
+            self.assertIsNone(store.document(uuid.UUID(int=0)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# test_index_state.py High-water mark of the manifest, with the history updates and the live indexing
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import json
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+
+from src_inverted_file.index_state import IndexState
+
+# stands for discord.Message, whose ids are strings
+Message = namedtuple('Message', ['id', 'timestamp'])
+
+
+class TestIndexState(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'index_state.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_live_messages_do_not_move_the_mark(self):
+        state = IndexState(self.filename)
+        state.register_segment('history.if', Message('100', 't100'))
+        # 150 and 180 are posted and indexed live while 120 is not fetched yet
+        state.register_segment('live.if', live_messages=[Message('150', 't150'), Message('180', 't180')])
+        self.assertEqual(state.last_message_id, '100')
+        self.assertFalse(state.is_indexed('120'))
+        self.assertTrue(state.is_indexed('150'))
+        self.assertTrue(state.is_indexed('90'))
+
+        state.save()
+        state = IndexState.load(self.filename)
+        self.assertEqual(state.live_message_ids, {'150', '180'})
+        # the update fetches up to 160 : 150 is behind the mark, 180 is still only indexed live
+        state.register_segment('update.if', Message('160', 't160'))
+        self.assertEqual(state.last_message_id, '160')
+        self.assertEqual(state.live_message_ids, {'180'})
+        self.assertTrue(state.is_indexed('120'))
+        self.assertFalse(state.is_indexed('170'))
+
+        # the ids are saved sorted, and only those after the mark
+        state.register_segment('live2.if', live_messages=[Message('1000', 't1000'), Message('900', 't900')])
+        state.save()
+        with open(self.filename, 'r') as f:
+            self.assertEqual(json.load(f)['live_message_ids'], ['180', '900', '1000'])
+
+        state.reset()
+        self.assertEqual(state.live_message_ids, set())
+        self.assertFalse(state.is_indexed('180'))
+
+    def test_former_manifest(self):
+        with open(self.filename, 'w') as f:
+            json.dump({'last_message_id': '100', 'segments': ['a.if']}, f)
+        state = IndexState.load(self.filename)
+        self.assertEqual(state.segments, ['a.if'])
+        self.assertEqual(state.live_message_ids, set())
+        self.assertTrue(state.is_indexed('100'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+# test_metrics.py Timers and counters of the indexing stages, and the profiling of a run
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+from src_inverted_file.metrics import Metrics, measured_call, merge_measured, metrics, profiled
+
+
+def stage(nb_tokens):
+    """
+    Stands for a stage of the indexing, run through measured_call
+    :param nb_tokens: integer, the number of tokens it counts
+    :return: integer, nb_tokens
+    """
+    with metrics.timer('test.stage'):
+        metrics.count('test.tokens', nb_tokens)
+    return nb_tokens
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_timers_and_counters(self):
+        stages = Metrics()
+        with stages.timer('tokenize'):
+            time.sleep(0.01)
+        stages.add_time('tokenize', 0.5, calls=3)
+        stages.count('tokens', 10)
+        stages.count('tokens')
+        stages.set('stem_cache.hit_rate', 0.75)
+        self.assertEqual(stages.timers['tokenize'][1], 4)
+        self.assertGreaterEqual(stages.timers['tokenize'][0], 0.51)
+        self.assertEqual(stages.counters['tokens'], 11)
+
+        report = stages.format()
+        for name in ('tokenize', 'tokens', 'stem_cache.hit_rate', '0.750'):
+            self.assertIn(name, report)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'metrics.txt')
+            stages.dump(filename)
+            with open(filename, 'r', encoding='utf-8') as f:
+                self.assertEqual(f.read(), report + "\n")
+
+        stages.reset()
+        self.assertEqual((dict(stages.counters), stages.timers, stages.gauges), ({}, {}, {}))
+
+    def test_disabled(self):
+        stages = Metrics(enabled=False)
+        with stages.timer('tokenize'):
+            stages.count('tokens', 10)
+        stages.add_time('merge', 1.)
+        self.assertEqual((dict(stages.counters), stages.timers), ({}, {}))
+
+    def test_measured_call(self):
+        # what a stage adds is measured apart from what was there before
+        stage(3)
+        measured = measured_call(stage, 5)
+        (result, snapshot, pid) = measured
+        self.assertEqual(result, 5)
+        self.assertEqual(pid, os.getpid())
+        self.assertEqual(snapshot['counters'], {'test.tokens': 5})
+        self.assertEqual(snapshot['timers']['test.stage'][1], 1)
+
+        # a call run in this process is already counted, one run in another process is added
+        nb_tokens = metrics.counters['test.tokens']
+        self.assertEqual(merge_measured(measured), 5)
+        self.assertEqual(metrics.counters['test.tokens'], nb_tokens)
+        self.assertEqual(merge_measured((result, snapshot, pid + 1)), 5)
+        self.assertEqual(metrics.counters['test.tokens'], nb_tokens + 5)
+
+    def test_profiled(self):
+        already_tracing = tracemalloc.is_tracing()
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = os.path.join(directory, 'profile')
+            with profiled(prefix, nb_lines=5):
+                stage(sum(len(str(number)) for number in range(10000)))
+            self.assertEqual(tracemalloc.is_tracing(), already_tracing)
+            self.assertGreater(pstats.Stats(prefix + '.prof').total_calls, 0)
+            with open(prefix + '.txt', 'r', encoding='utf-8') as f:
+                report = f.read()
+        self.assertIn('stage', report)
+        self.assertIn('MB at the peak', report)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,271 @@
+# test_query_engine.py Ranked and boolean searches compared with brute force
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import itertools
+import os
+import random
+import tempfile
+import unittest
+
+from src_inverted_file import boolean_query
+from src_inverted_file.ie_message import IEMessage
+from src_inverted_file.inverted_file import InvertedFile
+from src_inverted_file.posting_list_cache import PostingListCache
+from src_inverted_file.query_engine import QueryEngine
+from src_inverted_file.score import score
+from src_inverted_file.smart_disk_interfacer import DocIdMap, SmartDiskInterfacer
+from src_inverted_file.struct_disk_interfacer import StructDiskInterfacer
+
+VOCABULARY = ['w{}'.format(index) for index in range(30)]
+
+
+class SplitTokenizer(object):
+    """
+    Tokenizer splitting on white spaces, standing for Tokenizer (which needs nltk) in the tests
+    """
+
+    @staticmethod
+    def word_tokenize(text):
+        return text.split()
+
+
+def write_segments(directory, documents, nb_segments, interfacer=StructDiskInterfacer, prefix='segment'):
+    """
+    Index the documents in several positional segments
+    :param directory: string, where the segments are written
+    :param documents: list of IEMessage
+    :param nb_segments: integer, the number of segments
+    :param interfacer: the disk interfacer of the segments
+    :param prefix: string, the beginning of the names of the segments
+    :return: list of string, the paths of the segments
+    """
+    filenames = []
+    size = -(-len(documents) // nb_segments)
+    for start in range(0, len(documents), size):
+        filename = os.path.join(directory, '{}_{}.if'.format(prefix, start))
+        inverted_file = InvertedFile(score, interfacer, positional=True)
+        for document in documents[start:start + size]:
+            inverted_file.add_document(document)
+        inverted_file.save(filename)
+        filenames.append(filename)
+    return filenames
+
+
+def zipf_documents(rand, nb_documents):
+    """
+    :param rand: random.Random
+    :param nb_documents: integer, the number of documents
+    :return: list of IEMessage, whose words follow a Zipf law, so that some posting lists are long and others short
+    """
+    weights = [1. / rank for rank in range(1, len(VOCABULARY) + 1)]
+    documents = []
+    for _ in range(nb_documents):
+        document = IEMessage()
+        document.text = rand.choices(VOCABULARY, weights, k=rand.randint(1, 40))
+        documents.append(document)
+    return documents
+
+
+class TestRanking(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.documents = zipf_documents(random.Random(3), 3000)
+        cls.filenames = write_segments(cls.directory.name, cls.documents, 3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def check_same_ranking(self, engine, query, top_k):
+        self.check_same_ranking_of(engine, query, top_k, len(self.documents))
+
+    def check_same_ranking_of(self, engine, query, top_k, nb_documents):
+        everything = dict(engine.search(query, top_k=nb_documents, pruning=False))
+        exhaustive = engine.search(query, top_k=top_k, pruning=False)
+        pruned = engine.search(query, top_k=top_k)
+        # the order of documents having the same score may differ, their scores may not
+        self.assertEqual(len(pruned), len(exhaustive))
+        for ((_, pruned_score), (_, exhaustive_score)) in zip(pruned, exhaustive):
+            self.assertAlmostEqual(pruned_score, exhaustive_score)
+        for (doc_id, pruned_score) in pruned:
+            self.assertAlmostEqual(pruned_score, everything[doc_id])
+
+    def test_pruning_gives_the_exhaustive_ranking(self):
+        rand = random.Random(4)
+        with QueryEngine(self.filenames, SplitTokenizer(), StructDiskInterfacer) as engine:
+            for _ in range(40):
+                query = " ".join(rand.sample(VOCABULARY, rand.randint(1, 5)))
+                self.check_same_ranking(engine, query, rand.choice((1, 5, 10, 50)))
+            self.check_same_ranking(engine, 'w0 missing', 10)
+            self.assertEqual(engine.search('missing'), [])
+
+    def test_smart_segments(self):
+        filenames = write_segments(self.directory.name, self.documents, 3, SmartDiskInterfacer(DocIdMap()), 'smart')
+        with QueryEngine(self.filenames, SplitTokenizer(), StructDiskInterfacer) as engine, \
+                QueryEngine(filenames, SplitTokenizer(), SmartDiskInterfacer(DocIdMap())) as smart_engine:
+            for query in ('w0', 'w1 w7', 'w3 w12 w25'):
+                self.assertEqual(smart_engine.search(query, top_k=20), engine.search(query, top_k=20))
+            self.assertEqual(smart_engine.boolean_search('w1 NOT w2', top_k=20),
+                             engine.boolean_search('w1 NOT w2', top_k=20))
+
+    def test_pruning_skips_documents(self):
+        with QueryEngine(self.filenames, SplitTokenizer(), StructDiskInterfacer) as engine:
+            engine.search('w0 w29', top_k=5, pruning=False)
+            exhaustive = engine.last_nb_scored
+            engine.search('w0 w29', top_k=5)
+            self.assertLess(engine.last_nb_scored, exhaustive)
+
+    def test_pruning_skips_blocks(self):
+        # a word in every document, and a word which is rare but frequent in the few documents having it
+        rand = random.Random(8)
+        documents = []
+        for index in range(4000):
+            document = IEMessage()
+            document.text = ['common'] + rand.choices(VOCABULARY, k=rand.randint(1, 20))
+            if index % 500 == 0:
+                document.text += ['rare'] * 5
+            documents.append(document)
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = write_segments(directory, documents, 2)
+            with QueryEngine(filenames, SplitTokenizer(), StructDiskInterfacer) as engine:
+                nb_blocks = sum(len(segment.posting_list('common').skips) for segment in engine.segments)
+                self.check_same_ranking_of(engine, 'common rare', 5, len(documents))
+                engine.search('common rare', top_k=5)
+                self.assertLessEqual(engine.last_nb_decoded_blocks, nb_blocks // 2)
+                self.assertLess(engine.last_nb_scored, len(documents) // 10)
+
+    def test_cached_posting_lists(self):
+        # the ranking fills the cache with the blocks it decodes, and finds them there at the next query
+        rand = random.Random(9)
+        queries = [" ".join(rand.sample(VOCABULARY, rand.randint(1, 4))) for _ in range(10)]
+        with QueryEngine(self.filenames, SplitTokenizer(), StructDiskInterfacer) as engine:
+            expected = [engine.search(query, top_k=10) for query in queries]
+        cache = PostingListCache(1 << 24)
+        with QueryEngine(self.filenames, SplitTokenizer(), StructDiskInterfacer, cache=cache) as engine:
+            for (query, results) in zip(queries, expected):
+                self.assertEqual(engine.search(query, top_k=10), results)
+                self.assertGreater(engine.last_nb_decoded_blocks, 0)
+                hits = cache.hits
+                self.assertEqual(engine.search(query, top_k=10), results)
+                self.assertEqual(engine.last_nb_decoded_blocks, 0)
+                self.assertGreater(cache.hits, hits)
+            self.assertGreater(len(cache), 0)
+
+            # the posting lists decoded by an exhaustive search are walked through block by block as well
+            cache.invalidate()
+            for query in queries:
+                engine.search(query, top_k=10, pruning=False)
+                self.assertEqual(engine.search(query, top_k=10), expected[queries.index(query)])
+                self.assertEqual(engine.last_nb_decoded_blocks, 0)
+
+class TestBooleanSearch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        rand = random.Random(5)
+        cls.documents = []
+        for _ in range(600):
+            document = IEMessage()
+            document.text = rand.choices(VOCABULARY[:8], k=rand.randint(1, 8))
+            cls.documents.append(document)
+        cls.filenames = write_segments(cls.directory.name, cls.documents, 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def brute_force(self, node):
+        """
+        :param node: tuple, a node of the tree of a query (see boolean_query.parse_query)
+        :return: set of uuid.UUID, the documents matching the node, checking every document
+        """
+        kind = node[0]
+        if kind == 'word':
+            return {document.id for document in self.documents if node[1] in document.text}
+        if kind == 'phrase':
+            words = node[1].split()
+            return {document.id for document in self.documents
+                    if any(document.text[start:start + len(words)] == words for start in range(len(document.text)))}
+        if kind == 'not':
+            return {document.id for document in self.documents} - self.brute_force(node[1])
+        if kind == 'and':
+            return self.brute_force(node[1]) & self.brute_force(node[2])
+        return self.brute_force(node[1]) | self.brute_force(node[2])
+
+    def random_query(self, rand, depth):
+        """
+        :param rand: random.Random
+        :param depth: integer, the maximum depth of the query
+        :return: string, a random boolean query
+        """
+        if depth == 0 or rand.random() < 0.3:
+            if rand.random() < 0.15:
+                return '"{}"'.format(" ".join(rand.choices(VOCABULARY[:8], k=rand.randint(2, 3))))
+            return rand.choice(VOCABULARY[:8])
+        kind = rand.choice(('AND', 'OR', 'NOT', ' ', '()'))
+        if kind == 'NOT':
+            return 'NOT ' + self.random_query(rand, depth - 1)
+        if kind == '()':
+            return '(' + self.random_query(rand, depth - 1) + ')'
+        return ' '.join((self.random_query(rand, depth - 1), kind, self.random_query(rand, depth - 1)))
+
+    def test_operators(self):
+        rand = random.Random(6)
+        with QueryEngine(self.filenames, SplitTokenizer(), StructDiskInterfacer) as engine:
+            for query in itertools.chain(['w0 AND w1', 'w0 OR w1', 'NOT w0', 'w0 NOT w1', 'NOT w0 NOT w1',
+                                          '"w0 w1"', 'NOT (w0 OR "w2 w3")'],
+                                         (self.random_query(rand, 4) for _ in range(300))):
+                expected = self.brute_force(boolean_query.parse_query(query))
+                found = engine.boolean_search(query, top_k=len(self.documents))
+                self.assertEqual({doc_id for (doc_id, _) in found}, expected, query)
+
+    def test_sorted_lists_operations(self):
+        rand = random.Random(7)
+        for _ in range(200):
+            postings = [sorted((doc_id, 'x') for doc_id in rand.sample(range(200), rand.randint(0, 120)))
+                        for _ in range(3)]
+            sets = [{doc_id for (doc_id, _) in posting_list} for posting_list in postings]
+            self.assertEqual([doc_id for (doc_id, _) in boolean_query.intersect(postings[0], postings[1])],
+                             sorted(sets[0] & sets[1]))
+            self.assertEqual([doc_id for (doc_id, _) in boolean_query.intersect_many(postings)],
+                             sorted(sets[0] & sets[1] & sets[2]))
+            self.assertEqual([doc_id for (doc_id, _) in boolean_query.union(postings[0], postings[1])],
+                             sorted(sets[0] | sets[1]))
+            self.assertEqual([doc_id for (doc_id, _) in boolean_query.difference(postings[0], postings[1])],
+                             sorted(sets[0] - sets[1]))
+            self.assertEqual(boolean_query.select(postings[0], postings[1]),
+                             [posting for posting in postings[0] if posting[0] in sets[1]])
+            for doc_id in range(-1, 201, 7):
+                start = rand.randint(0, len(postings[0]))
+                expected = next((index for index in range(start, len(postings[0])) if postings[0][index][0] >= doc_id),
+                                len(postings[0]))
+                self.assertEqual(boolean_query.gallop(postings[0], doc_id, start), expected)
+
+    def test_syntax_errors(self):
+        for query in ('(w0', 'w0 )', 'AND w0', 'w0 OR', 'NOT'):
+            with self.assertRaises(boolean_query.QuerySyntaxError):
+                boolean_query.parse_query(query)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+# test_segment_manager.py Compaction of the segments of the index, snapshots and manifest
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import asyncio
+import os
+import random
+import tempfile
+import unittest
+from collections import namedtuple
+
+from src_inverted_file.async_indexing import InlineExecutor
+from src_inverted_file.ie_message import IEMessage
+from src_inverted_file.index_state import IndexState
+from src_inverted_file.inverted_file import InvertedFile
+from src_inverted_file.query_engine import QueryEngine
+from src_inverted_file.score import score
+from src_inverted_file.segment_manager import SegmentManager
+
+# stands for discord.Message, whose ids are strings
+Message = namedtuple('Message', ['id', 'timestamp'])
+
+VOCABULARY = ['w{}'.format(index) for index in range(30)]
+QUERIES = ['w0', 'w3 w7', 'w1 w12 w25', 'w29', 'missing']
+
+
+class SplitTokenizer(object):
+    """
+    Tokenizer splitting on white spaces, standing for Tokenizer (which needs nltk) in the tests
+    """
+
+    @staticmethod
+    def word_tokenize(text):
+        return text.split()
+
+
+def random_documents(rand, nb_documents):
+    """
+    :param rand: random.Random
+    :param nb_documents: integer, the number of documents
+    :return: list of IEMessage, whose words are drawn from VOCABULARY, the first ones being the most frequent
+    """
+    weights = [1. / rank for rank in range(1, len(VOCABULARY) + 1)]
+    documents = []
+    for _ in range(nb_documents):
+        document = IEMessage()
+        document.text = rand.choices(VOCABULARY, weights, k=rand.randint(1, 40))
+        documents.append(document)
+    return documents
+
+
+def compact(manager):
+    """
+    :param manager: SegmentManager
+    :return: integer, the number of merges of SegmentManager.compact, run at once in this thread
+    """
+    async def run():
+        return await manager.compact(InlineExecutor(), asyncio.Lock())
+    return asyncio.run(run())
+
+
+class TestSegmentManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.manifest_filename = os.path.join(self.directory.name, 'index_state.json')
+        self.manager = SegmentManager(self.directory.name, self.manifest_filename, merge_factor=2, max_segments=4)
+        self.documents = random_documents(random.Random(5), 800)
+        # one segment per update, 100 messages each
+        for (number, start) in enumerate(range(0, len(self.documents), 100)):
+            filename = self.manager.new_segment_filename()
+            inverted_file = InvertedFile(score)
+            for document in self.documents[start:start + 100]:
+                inverted_file.add_document(document)
+            inverted_file.save(filename)
+            self.manager.commit(filename, Message(str(1000 + number), 't{}'.format(number)))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def search_all(self, filenames):
+        """
+        :param filenames: list of string, the segments to search
+        :return: list of dictionaries (doc_id: score), the results of each query of QUERIES, for every document
+        """
+        with QueryEngine(filenames, SplitTokenizer()) as engine:
+            return [dict(engine.search(query, top_k=len(self.documents), pruning=False)) for query in QUERIES]
+
+    def assertSameResults(self, results, expected):
+        for (found, wanted) in zip(results, expected):
+            self.assertEqual(sorted(found), sorted(wanted))
+            for (doc_id, wanted_score) in wanted.items():
+                self.assertAlmostEqual(found[doc_id], wanted_score)
+
+    def test_compaction_cascade(self):
+        segments = self.manager.segments
+        self.assertEqual(len(segments), 8)
+        expected = self.search_all(segments)
+
+        # the small segments are all in the lowest tier : they are merged by two until a single one is left
+        self.assertEqual(self.manager.find_merge(), segments[:2])
+        self.assertEqual(compact(self.manager), 7)
+        self.assertEqual(len(self.manager.segments), 1)
+        self.assertIsNone(self.manager.find_merge())
+        self.assertFalse(any(os.path.exists(segment) for segment in segments))
+        self.assertSameResults(self.search_all(self.manager.segments), expected)
+
+    def test_snapshot_keeps_its_segments(self):
+        segments = self.manager.segments
+        expected = self.search_all(segments)
+        snapshot = self.manager.snapshot()
+        self.assertEqual(snapshot.segments, tuple(segments))
+
+        compact(self.manager)
+        # the merged segments are out of the manifest, but the searches of the snapshot still read them
+        self.assertTrue(all(segment not in self.manager.segments for segment in segments))
+        self.assertTrue(all(os.path.exists(segment) for segment in segments))
+        self.assertSameResults(self.search_all(snapshot.segments), expected)
+        self.assertEqual(self.manager.remove_unreferenced(), [])
+
+        self.manager.release(snapshot)
+        self.assertFalse(any(os.path.exists(segment) for segment in segments))
+        self.assertSameResults(self.search_all(self.manager.segments), expected)
+
+    def test_manifest_after_compaction(self):
+        generation = self.manager.manifest.generation
+        compact(self.manager)
+        saved = IndexState.load(self.manifest_filename)
+        self.assertEqual(saved.segments, self.manager.segments)
+        self.assertEqual(saved.generation, generation + 7)
+        self.assertEqual(saved.last_message_id, '1007')
+        self.assertEqual(sorted(saved.segment_generations), saved.segments)
+        # the next segment gets a path which was never used
+        self.assertNotIn(self.manager.new_segment_filename(), saved.segments)
+
+        # a new process finds the same index, with no segment left over by the merges
+        manager = SegmentManager(self.directory.name, self.manifest_filename, merge_factor=2, max_segments=4)
+        self.assertEqual(manager.segments, saved.segments)
+        self.assertEqual(manager.remove_unreferenced(), [])
+        self.assertEqual(sorted(name for name in os.listdir(self.directory.name) if name.endswith('.if')),
+                         [os.path.basename(segment) for segment in saved.segments])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+# test_term_dictionary.py Round trips of the term dictionaries, and block-wise lookups in the posting lists
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import os
+import random
+import tempfile
+import unittest
+import uuid
+
+from src_inverted_file.inverted_file import DOCUMENT_LENGTH_KEY, InvertedFile
+from src_inverted_file.mapped_inverted_file import LazyPostingList, MappedInvertedFile
+from src_inverted_file.naive_disk_interfacer import NaiveDiskInterfacer
+from src_inverted_file.struct_disk_interfacer import StructDiskInterfacer
+from src_inverted_file.term_dictionary import TermDictionary
+
+
+class TestTermDictionary(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'index.if')
+        with open(self.filename, 'wb') as f:
+            f.write(b'\x00' * 1000)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        dictionary = TermDictionary()
+        skips = b''.join(uuid.UUID(int=index).bytes for index in range(3))
+        dictionary.add('a', 0, 10, 100, 4, 7, 3)
+        dictionary.add('bé', 110, 125, 400, 300, 12, 1, skips, [(12, 256), (3, 1000), (7, 512)])
+        dictionary.add('c', 525, 530, 21, 1)
+        dictionary.add('d', 546, 550, 200, 260, 5, 2, skips)
+        dictionary.save(self.filename)
+
+        loaded = TermDictionary.load(self.filename)
+        self.assertEqual(list(loaded.items()), list(dictionary.items()))
+        self.assertEqual(loaded.skips('bé'), [uuid.UUID(int=index).bytes for index in range(3)])
+        self.assertEqual(loaded.block_bounds('bé'), [(12, 256), (3, 1000), (7, 512)])
+        self.assertEqual(loaded.block_bounds('d'), [(0, 0)] * 3)
+        self.assertEqual(loaded.skips('a'), [])
+        self.assertEqual(loaded.block_bounds('a'), [])
+        self.assertEqual(loaded.score_bounds('a'), (7, 3))
+        self.assertIsNone(loaded.score_bounds('c'))
+        self.assertIsNone(loaded.lookup('b'))
+        self.assertEqual(loaded.doc_freq('missing'), 0)
+
+    def test_keys_must_be_sorted(self):
+        dictionary = TermDictionary()
+        dictionary.add('b', 0, 2, 1, 1)
+        with self.assertRaises(ValueError):
+            dictionary.add('a', 3, 5, 1, 1)
+
+    def test_stale_dictionary(self):
+        dictionary = TermDictionary()
+        dictionary.add('a', 0, 10, 100, 4)
+        dictionary.save(self.filename)
+        with open(self.filename, 'ab') as f:
+            f.write(b'\x00')
+        self.assertIsNone(TermDictionary.load(self.filename))
+        self.assertIsNone(TermDictionary.open(self.filename))
+
+    def test_unknown_format(self):
+        dictionary = TermDictionary()
+        dictionary.add('a', 0, 10, 100, 4)
+        dictionary.save(self.filename)
+        with open(TermDictionary.dictionary_filename(self.filename), 'r+b') as f:
+            f.write(b'IEDICT0')
+        self.assertIsNone(TermDictionary.load(self.filename))
+
+    def test_open_reloads_a_modified_file(self):
+        dictionary = TermDictionary()
+        dictionary.add('a', 0, 10, 100, 4)
+        dictionary.save(self.filename)
+        self.assertIs(TermDictionary.open(self.filename), TermDictionary.open(self.filename))
+
+        with open(self.filename, 'wb') as f:
+            f.write(b'\x00' * 2000)
+        dictionary = TermDictionary()
+        dictionary.add('b', 0, 10, 100, 4)
+        dictionary.save(self.filename)
+        self.assertEqual(TermDictionary.open(self.filename).keys(), ['b'])
+
+    def test_open_keeps_the_most_recent_dictionaries(self):
+        filenames = [os.path.join(self.directory.name, 'index_{}.if'.format(index)) for index in range(3)]
+        for filename in filenames:
+            InvertedFile.write_posting_lists(filename, [('a', [(uuid.uuid1(), 1)])])
+        max_loaded = TermDictionary.max_loaded
+        TermDictionary.max_loaded = 2
+        try:
+            opened = [TermDictionary.open(filename) for filename in filenames]
+            self.assertIs(TermDictionary.open(filenames[2]), opened[2])
+            self.assertIs(TermDictionary.open(filenames[1]), opened[1])
+            self.assertIsNot(TermDictionary.open(filenames[0]), opened[0])
+        finally:
+            TermDictionary.max_loaded = max_loaded
+            for filename in filenames:
+                InvertedFile.remove_inverted_file(filename)
+
+    def test_removed_file_is_forgotten(self):
+        InvertedFile.write_posting_lists(self.filename, [('a', [(uuid.uuid1(), 1)])])
+        with open(self.filename, 'rb') as f:
+            content = f.read()
+        with open(TermDictionary.dictionary_filename(self.filename), 'rb') as f:
+            dictionary_content = f.read()
+        stat = os.stat(self.filename)
+        opened = TermDictionary.open(self.filename)
+        InvertedFile.remove_inverted_file(self.filename)
+
+        # a new file with the same signature must not get the dictionary of the removed one
+        with open(self.filename, 'wb') as f:
+            f.write(content)
+        with open(TermDictionary.dictionary_filename(self.filename), 'wb') as f:
+            f.write(dictionary_content)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIsNot(TermDictionary.open(self.filename), opened)
+
+
+class TestSkipBlocks(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(2)
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'index.if')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_posting_list(self, interfacer, nb_postings, lengths=None):
+        """
+        :param interfacer: a disk interfacer with a fixed posting_len
+        :param nb_postings: integer, the length of the posting list
+        :param lengths: dictionary (doc_id: integer), filled with the length of the documents of the postings to save
+                        them as well, so that the score bounds are known. Default is None
+        :return: list of tuples (uuid.UUID, integer), the posting list saved under the key 'word'
+        """
+        postings = sorted((uuid.UUID(int=self.rand.getrandbits(128)), self.rand.randint(1, 9))
+                          for _ in range(nb_postings))
+        posting_lists = [('word', postings)]
+        if lengths is not None:
+            lengths.update((doc_id, score + self.rand.randint(0, 30)) for (doc_id, score) in postings)
+            posting_lists.insert(0, (DOCUMENT_LENGTH_KEY, sorted(lengths.items())))
+        InvertedFile.write_posting_lists(self.filename, posting_lists, interfacer)
+        return postings
+
+    def test_skips_are_block_starts(self):
+        lengths = {}
+        postings = self.write_posting_list(StructDiskInterfacer, 5 * TermDictionary.block_size + 7, lengths)
+        with MappedInvertedFile(self.filename, StructDiskInterfacer) as mapped:
+            posting_list = mapped.posting_list('word')
+            self.assertEqual(posting_list.nb_blocks, 6)
+            self.assertEqual(posting_list.skips,
+                             [postings[start][0].bytes for start in range(0, len(postings), TermDictionary.block_size)])
+            self.assertEqual(len(posting_list.block_bounds), 6)
+            decoded = []
+            for index in range(posting_list.nb_blocks):
+                block = posting_list.decode_block(index)
+                (max_score, min_length_per_score) = posting_list.block_bounds[index]
+                self.assertEqual(max_score, max(score for (_, score) in block))
+                self.assertEqual(min_length_per_score,
+                                 int(min(lengths[doc_id] / score for (doc_id, score) in block)
+                                     * TermDictionary.length_per_score_scale))
+                decoded += block
+            self.assertEqual(decoded, postings)
+            del posting_list
+
+    def test_find(self):
+        for interfacer in (NaiveDiskInterfacer, StructDiskInterfacer):
+            postings = self.write_posting_list(interfacer, 7 * TermDictionary.block_size + 50)
+            present = self.rand.sample(postings, 60)
+            absent = [uuid.UUID(int=self.rand.getrandbits(128)) for _ in range(60)]
+            # ids before the first posting and after the last one, and the first id of each block
+            absent += [uuid.UUID(int=postings[0][0].int - 1), uuid.UUID(int=postings[-1][0].int + 1)]
+            present += postings[::TermDictionary.block_size]
+            doc_ids = sorted(set([doc_id for (doc_id, _) in present] + absent))
+
+            with MappedInvertedFile(self.filename, interfacer) as mapped:
+                posting_list = mapped.posting_list('word')
+                self.assertGreater(posting_list.nb_blocks, 1)
+                self.assertEqual(posting_list.find(doc_ids), sorted(set(present)))
+                self.assertEqual(posting_list.find([]), [])
+                del posting_list
+
+    def test_find_without_skips(self):
+        postings = sorted((uuid.uuid1(), index) for index in range(20))
+        posting_list = LazyPostingList(memoryview(StructDiskInterfacer._encode_list(postings))[4:], StructDiskInterfacer)
+        self.assertEqual(posting_list.nb_blocks, 1)
+        doc_ids = sorted([postings[3][0], uuid.UUID(int=postings[3][0].int + 1), postings[17][0]])
+        self.assertEqual(posting_list.find(doc_ids), [postings[3], postings[17]])
+
+
+if __name__ == "__main__":
+    unittest.main()
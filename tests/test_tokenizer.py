@@ -0,0 +1,194 @@
+# test_tokenizer.py Tokens of the regex backend, and tokens too long to be keys of an inverted file
+#
+# Copyright (C) 2017-2018 Edern Haumont, Jérome Liermann, François Robion, Nicolas Six
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file LICENSE.  If not see
+# <http://www.gnu.org/licenses/>.
+
+# Usage (from the root of the repository) : python -m pytest tests
+
+import importlib.util
+import os
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+from src_inverted_file.inverted_file import InvertedFile
+from src_inverted_file.mapped_inverted_file import MappedInvertedFile
+
+# the tokenizer module needs nltk, even for the regex backend (for the stemmer)
+HAS_NLTK = importlib.util.find_spec('nltk') is not None
+if HAS_NLTK:
+    import nltk
+
+    from src_inverted_file import tokenizer as tokenizer_module
+    from src_inverted_file.tokenizer import MAX_TOKEN_BYTES, StemCache, Tokenizer, cap_token, regex_word_tokenize
+
+
+@unittest.skipUnless(HAS_NLTK, "nltk is not installed")
+class TestTokenizer(unittest.TestCase):
+
+    def test_regex_backend_keeps_verbatim_tokens(self):
+        text = "see https://example.com/a_b?c=1, `x = 1` and <@123>."
+        self.assertEqual(regex_word_tokenize(text),
+                         ['see', 'https://example.com/a_b?c=1', ',', '`x = 1`', 'and', '<@123>', '.'])
+
+    def test_cap_token(self):
+        self.assertEqual(cap_token('short'), 'short')
+        exact = 'é' * (MAX_TOKEN_BYTES // 2) + 'a'
+        self.assertEqual(cap_token(exact), exact)
+
+        for long_token in ('https://example.com/' + 'a' * 1000, 'é' * 300, '```' + '€x' * 200 + '```'):
+            capped = cap_token(long_token)
+            self.assertLessEqual(len(capped.encode('utf-8')), MAX_TOKEN_BYTES)
+            self.assertTrue(long_token.startswith(capped[:capped.rindex('#')]))
+            self.assertEqual(cap_token(long_token), capped)
+        self.assertNotEqual(cap_token('a' * 300 + 'b'), cap_token('a' * 300 + 'c'))
+
+    def test_long_tokens_can_be_saved(self):
+        url = 'https://example.com/' + '/'.join(['segment'] * 60)
+        code = '```' + 'print(1)\n' * 40 + '```'
+        tokenizer = Tokenizer(backend=regex_word_tokenize)
+        tokens = tokenizer.word_tokenize("look at {} then {}".format(url, code))
+        self.assertEqual(tokens[:3], ['look', 'at', cap_token(url)])
+        self.assertEqual(tokens[-1], cap_token(code))
+        # the query finds the same key
+        self.assertEqual(tokenizer.word_tokenize(url), [cap_token(url)])
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'index.if')
+            InvertedFile.write_posting_lists(filename, [(token, [(uuid.uuid1(), 1)]) for token in sorted(set(tokens))])
+            with MappedInvertedFile(filename) as mapped:
+                self.assertEqual(mapped.keys(), sorted(set(tokens)))
+
+
+
+@unittest.skipUnless(HAS_NLTK, "nltk is not installed")
+class TestStemCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        stemmed = []
+        cache = StemCache(10)
+        for token in ('books', 'reading', 'books', 'books', 'reading', 'novels'):
+            self.assertEqual(cache.stem(token, lambda word: stemmed.append(word) or word[:4]), token[:4])
+        # each token is only stemmed once
+        self.assertEqual(stemmed, ['books', 'reading', 'novels'])
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertAlmostEqual(cache.hit_rate(), 0.5)
+        self.assertEqual(StemCache(10).hit_rate(), 0.)
+
+    def test_least_recently_used_is_forgotten(self):
+        cache = StemCache(3)
+        for token in ('a', 'b', 'c'):
+            cache.stem(token, str.upper)
+        cache.stem('a', str.upper)
+        cache.stem('d', str.upper)
+        self.assertEqual(len(cache), 3)
+        # b was the least recently used : it is stemmed again, a is still cached
+        misses = cache.misses
+        cache.stem('a', str.upper)
+        self.assertEqual(cache.misses, misses)
+        cache.stem('b', str.upper)
+        self.assertEqual(cache.misses, misses + 1)
+        self.assertEqual(len(cache), 3)
+
+        disabled = StemCache(0)
+        for token in ('a', 'a', 'a'):
+            self.assertEqual(disabled.stem(token, str.upper), 'A')
+        self.assertEqual((len(disabled), disabled.hits, disabled.misses), (0, 0, 3))
+
+    def test_save_and_load(self):
+        cache = StemCache(4)
+        for token in ('a', 'b', 'c', 'd'):
+            cache.stem(token, str.upper)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'stems.json')
+            cache.save(filename)
+            # a smaller cache keeps the most recently used stems
+            loaded = StemCache(2)
+            loaded.load(filename)
+            loaded.load(os.path.join(directory, 'missing.json'))
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual(loaded.stem('d', lambda token: 'not cached'), 'D')
+        self.assertEqual(loaded.stem('a', lambda token: 'not cached'), 'not cached')
+
+    def test_tokenizer_uses_the_cache(self):
+        tokenizer = Tokenizer(backend=regex_word_tokenize)
+        self.assertEqual(tokenizer.word_tokenize("reading books"), tokenizer.word_tokenize("reading books"))
+        self.assertEqual((tokenizer.stem_cache.hits, tokenizer.stem_cache.misses), (2, 2))
+        uncached = Tokenizer(backend=regex_word_tokenize, stem_cache_size=0)
+        self.assertEqual(uncached.word_tokenize("reading books"), tokenizer.word_tokenize("reading books"))
+
+
+
+@unittest.skipUnless(HAS_NLTK, "nltk is not installed")
+class TestEnsurePunkt(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.nltk_path = list(nltk.data.path)
+        patchers = [mock.patch.object(tokenizer_module, '_punkt_ready', False),
+                    mock.patch.object(tokenizer_module, 'NLTK_DATA_DIRECTORY', self.directory.name),
+                    mock.patch.object(nltk.data, 'find'),
+                    mock.patch.object(nltk, 'download', return_value=True)]
+        (_, _, self.find, self.download) = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        nltk.data.path[:] = self.nltk_path
+        self.directory.cleanup()
+
+    def test_found_offline(self):
+        tokenizer_module.ensure_punkt()
+        # the directory of the bot is searched first, and nothing is downloaded
+        self.assertEqual(nltk.data.path[0], self.directory.name)
+        self.find.assert_called_once_with('tokenizers/punkt')
+        self.download.assert_not_called()
+        # the check is only done once per process
+        tokenizer_module.ensure_punkt()
+        self.find.assert_called_once_with('tokenizers/punkt')
+
+    def test_downloaded_once_when_missing(self):
+        self.find.side_effect = LookupError
+        tokenizer_module.ensure_punkt()
+        self.download.assert_called_once_with('punkt', download_dir=self.directory.name, quiet=True)
+        tokenizer_module.ensure_punkt()
+        self.assertEqual(self.download.call_count, 1)
+
+    def test_missing_and_offline(self):
+        self.find.side_effect = LookupError
+        self.download.return_value = False
+        self.assertRaises(LookupError, tokenizer_module.ensure_punkt)
+        # it is looked for again on the next call
+        self.assertRaises(LookupError, tokenizer_module.ensure_punkt)
+        self.assertEqual(self.download.call_count, 2)
+
+    def test_looked_for_on_first_use(self):
+        # neither the constructor nor the regex backend need punkt
+        tokenizer = Tokenizer()
+        regex_tokenizer = Tokenizer(backend=regex_word_tokenize)
+        self.assertEqual(regex_tokenizer.word_tokenize("reading books"), ['read', 'book'])
+        self.find.assert_not_called()
+
+        with mock.patch.object(nltk, 'word_tokenize', side_effect=str.split):
+            self.assertEqual(tokenizer.word_tokenize("reading books"), ['read', 'book'])
+            tokenizer.word_tokenize("reading books")
+        self.find.assert_called_once_with('tokenizers/punkt')
+        self.download.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()